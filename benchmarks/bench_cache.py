@@ -0,0 +1,166 @@
+"""
+Benchmark for the cache backends shared by Hubcast replicas.
+
+Simulates REPLICAS replicas, each with its own token, installation id and
+repo config caches, handling events for REPOS repositories spread across
+them. Renewing a token or looking up an id or config sleeps for a round
+trip to GitHub or GitLab. Reports how many of those requests each backend
+leaves the replicas making, how long the events took, and the average
+latency of a cache lookup.
+
+The redis backend is run against a minimal stand-in server speaking the
+Redis protocol, started in-process, unless REDIS_URL points at a real one.
+
+Usage: PYTHONPATH=src python benchmarks/bench_cache.py [REPLICAS]
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+from hubcast.cache.memory import MemoryBackend
+from hubcast.cache.resp import RespBackend
+from hubcast.cache.sqlite import SQLiteBackend
+from hubcast.clients.utils import LookupCache, TokenCache
+
+REPLICAS = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+REPOS = 49
+EVENTS = 400
+API_RTT = 0.050
+
+
+class StandIn:
+    """Just enough of a Redis server for the cache backend."""
+
+    def __init__(self):
+        self.values = {}
+
+    async def serve(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                args = []
+                for _ in range(int(line[1:])):
+                    length = int((await reader.readline())[1:])
+                    args.append((await reader.readexactly(length + 2))[:-2])
+                writer.write(self.execute(args))
+                await writer.drain()
+        except asyncio.CancelledError:
+            # the benchmark is over
+            pass
+        finally:
+            writer.close()
+
+    def execute(self, args):
+        command = args[0].upper()
+        now = time.monotonic()
+        if command == b"GET":
+            expires, value = self.values.get(args[1], (None, None))
+            if value is None or (expires is not None and expires <= now):
+                return b"$-1\r\n"
+            return b"$%d\r\n%s\r\n" % (len(value), value)
+        if command == b"SET":
+            expires = None
+            if len(args) == 5 and args[3].upper() == b"PX":
+                expires = now + int(args[4]) / 1000
+            self.values[args[1]] = (expires, args[2])
+            return b"+OK\r\n"
+        if command == b"DEL":
+            return b":%d\r\n" % (self.values.pop(args[1], None) is not None)
+        return b"-ERR unknown command\r\n"
+
+
+class Replica:
+    def __init__(self, backend):
+        self.tokens = TokenCache("github_tokens:1", backend)
+        self.ids = LookupCache("installation_ids:1", backend)
+        self.configs = LookupCache("repo_config", backend)
+
+
+class Requests:
+    def __init__(self):
+        self.count = 0
+
+    async def make(self):
+        self.count += 1
+        await asyncio.sleep(API_RTT)
+
+
+async def handle_event(replica, repo, requests):
+    installation_id = await replica.ids.get(repo)
+    if installation_id is None:
+        await requests.make()
+        installation_id = 1000 + int(repo.split("-")[1])
+        await replica.ids.set(repo, installation_id)
+
+    async def renew():
+        await requests.make()
+        return time.time() + 3600, f"token-{installation_id}"
+
+    await replica.tokens.get(installation_id, renew)
+
+    if await replica.configs.get(repo) is None:
+        await requests.make()
+        await replica.configs.set(repo, {"Repo": {"owner": "dest", "name": repo}})
+
+
+async def run(name, backends):
+    requests = Requests()
+    replicas = [Replica(backend) for backend in backends]
+
+    # every replica gets a share of the events of every repository
+    start = time.perf_counter()
+    for i in range(0, EVENTS, REPLICAS * 10):
+        await asyncio.gather(
+            *(
+                handle_event(replicas[j % REPLICAS], f"repo-{j % REPOS}", requests)
+                for j in range(i, min(i + REPLICAS * 10, EVENTS))
+            )
+        )
+    elapsed = time.perf_counter() - start
+
+    # every value is cached by now, time lookups alone
+    lookups = 2000
+    lookup_start = time.perf_counter()
+    for i in range(lookups):
+        await replicas[i % REPLICAS].configs.get(f"repo-{i % REPOS}")
+    lookup = (time.perf_counter() - lookup_start) / lookups
+
+    print(
+        f"{name:>8}: {requests.count:4d} API requests, events took "
+        f"{elapsed * 1000:6.0f} ms, lookups {lookup * 1e6:6.1f} us"
+    )
+
+
+async def main():
+    print(f"{REPLICAS} replicas, {REPOS} repositories, {EVENTS} events")
+
+    await run("memory", [MemoryBackend() for _ in range(REPLICAS)])
+
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "cache.db")
+        backends = [SQLiteBackend(path, "bench:") for _ in range(REPLICAS)]
+        await run("sqlite", backends)
+        for backend in backends:
+            await backend.close()
+
+    url = os.environ.get("REDIS_URL")
+    server = None
+    if url is None:
+        server = await asyncio.start_server(StandIn().serve, "127.0.0.1", 0)
+        url = "redis://127.0.0.1:%d" % server.sockets[0].getsockname()[1]
+
+    backends = [RespBackend(url, "bench:") for _ in range(REPLICAS)]
+    await run("redis", backends)
+    for backend in backends:
+        await backend.close()
+    if server is not None:
+        server.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,212 @@
+"""
+Benchmark for the critical path of GitHub webhook handlers.
+
+Dispatches one event of each type to the GitHub router with fake GitHub,
+GitLab and git clients standing in for the servers. Every call sleeps for
+a typical round trip to the server it stands in for, so the time taken by
+an event is the latency of its critical path. The sum of the round trips
+of every call made is what the event would take with each call awaited in
+turn.
+
+Usage: PYTHONPATH=src python benchmarks/bench_handlers.py [DESTINATIONS]
+"""
+
+import asyncio
+import sys
+import time
+
+from gidgethub import sansio
+
+from hubcast.clients.github.client import RepoSnapshot
+from hubcast.web.github import mirror
+from hubcast.web.github.routes import router
+from hubcast.web.github.utils import config_cache
+
+DESTINATIONS = int(sys.argv[1]) if len(sys.argv) > 1 else 2
+ROUNDS = 5
+
+# simulated round trips, in seconds
+GITHUB_RTT = 0.080
+GITLAB_RTT = 0.040
+GIT_LIST_RTT = 0.050
+GIT_PUSH_RTT = 0.200
+
+SHA = "1" * 40
+OLD_SHA = "2" * 40
+CONFIG = {"Repo": [{"owner": "dest", "name": f"repo{i}"} for i in range(DESTINATIONS)]}
+PR = {
+    "number": 7,
+    "head": {
+        "ref": "feature",
+        "sha": SHA,
+        "repo": {"full_name": "org/repo", "clone_url": "https://github.com/org/repo"},
+    },
+    "base": {
+        "ref": "main",
+        "repo": {"full_name": "org/repo", "clone_url": "https://github.com/org/repo"},
+    },
+}
+
+
+class Calls:
+    """Round trips made while handling an event."""
+
+    def __init__(self):
+        self.count = 0
+        self.serial = 0.0
+
+    async def wait(self, rtt: float):
+        self.count += 1
+        self.serial += rtt
+        await asyncio.sleep(rtt)
+
+
+calls = Calls()
+
+
+class FakeGitHub:
+    repo_owner = "org"
+    repo_name = "repo"
+    bot_user = "hubcast"
+
+    async def get_prs(self, branch=None):
+        await calls.wait(GITHUB_RTT)
+        return []
+
+    async def get_repo_config(self):
+        await calls.wait(GITHUB_RTT)
+        return CONFIG
+
+    async def get_repo_snapshot(self, pr_numbers=(), branches=(), open_prs=False):
+        await calls.wait(GITHUB_RTT)
+        return RepoSnapshot(
+            CONFIG, {n: PR for n in pr_numbers}, {b: SHA for b in branches}, []
+        )
+
+    async def post_comment(self, issue_number, body):
+        await calls.wait(GITHUB_RTT)
+
+    async def react_to_comment(self, comment_id, reaction):
+        await calls.wait(GITHUB_RTT)
+
+
+class FakeGitLabAuth:
+    async def authenticate_user(self, username):
+        # tokens are cached, so only the first request of an event is slow
+        if not self.cached:
+            self.cached = True
+            await calls.wait(GITLAB_RTT)
+        return "token"
+
+
+class FakeGitLab:
+    instance_url = "https://gitlab.example.com"
+    user = "bot"
+
+    def __init__(self):
+        self.auth = FakeGitLabAuth()
+        self.auth.cached = False
+
+    # every destination is on the one instance
+    def instance(self, name):
+        return self
+
+    def for_dest(self, dest):
+        return self
+
+    async def set_webhook(self, gl_fullname, data):
+        # list the project's hooks, then update the existing one
+        await calls.wait(GITLAB_RTT)
+        await calls.wait(GITLAB_RTT)
+
+    async def run_pipeline(self, gl_fullname, branch):
+        await calls.wait(GITLAB_RTT)
+        return {"id": 1, "sha": SHA, "status": "created", "web_url": "https://ci/1"}
+
+
+class FakeBatcher:
+    async def update(self, src_url, dest_url, update, haves, **kwargs):
+        await calls.wait(GIT_PUSH_RTT)
+
+
+async def fake_ls_refs(url, prefixes, username=None, password=None):
+    await calls.wait(GIT_LIST_RTT)
+    return {"refs/heads/main": OLD_SHA, "refs/heads/feature": OLD_SHA}
+
+
+EVENTS = {
+    "push": (
+        "push",
+        {
+            "ref": "refs/heads/main",
+            "deleted": False,
+            "head_commit": {"id": SHA},
+            "repository": {
+                "full_name": "org/repo",
+                "clone_url": "https://github.com/org/repo",
+            },
+        },
+    ),
+    "pull_request": (
+        "pull_request",
+        {"action": "synchronize", "pull_request": PR},
+    ),
+    "approve comment": (
+        "issue_comment",
+        {
+            "action": "created",
+            "issue": {"number": 7, "pull_request": {}},
+            "comment": {"id": 1, "body": "@hubcast approve"},
+        },
+    ),
+    "run pipeline comment": (
+        "issue_comment",
+        {
+            "action": "created",
+            "issue": {"number": 7, "pull_request": {}},
+            "comment": {"id": 1, "body": "@hubcast run pipeline"},
+        },
+    ),
+    "check rerun": (
+        "check_run",
+        {
+            "action": "rerequested",
+            "repository": {"full_name": "org/repo"},
+            "check_run": {
+                "name": "gitlab-ci",
+                "head_sha": SHA,
+                "check_suite": {"head_branch": "main"},
+            },
+        },
+    ),
+}
+
+
+async def main():
+    global calls
+
+    mirror.ls_refs = fake_ls_refs
+    mirror.batcher = FakeBatcher()
+
+    print(f"{DESTINATIONS} destinations")
+    for name, (event_type, data) in EVENTS.items():
+        times = []
+        for _ in range(ROUNDS):
+            calls = Calls()
+            await config_cache.invalidate("org/repo")
+            event = sansio.Event(data, event=event_type, delivery_id="1")
+            start = time.perf_counter()
+            await router.dispatch(event, FakeGitHub(), FakeGitLab(), "bot")
+            times.append(time.perf_counter() - start)
+
+        wall = min(times)
+        print(
+            f"{name:>22}: {calls.count:3d} calls, "
+            f"serial {calls.serial * 1000:6.0f} ms, "
+            f"critical path {wall * 1000:6.0f} ms "
+            f"({1 - wall / calls.serial:4.0%} saved)"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,92 @@
+"""
+Microbenchmark for the Hubcast logging pipeline.
+
+Reports records/sec for the JSON formatter alone, and for the calling thread
+when records are written synchronously versus through the logging queue to a
+sink that stalls like a slow disk or log shipper.
+
+Usage: PYTHONPATH=src python benchmarks/bench_logging.py
+"""
+
+import io
+import logging
+import time
+
+from hubcast.logging import HubcastJSONFormatter, start_queue_logging
+
+FMT_KEYS = {
+    "level": "levelname",
+    "message": "message",
+    "timestamp": "timestamp",
+    "logger": "name",
+}
+RECORDS = 50_000
+SLOW_RECORDS = 2_000
+
+
+class SlowStream(io.StringIO):
+    """A stream stalling for `delay` seconds on every write."""
+
+    def __init__(self, delay: float):
+        super().__init__()
+        self.delay = delay
+
+    def write(self, s: str) -> int:
+        time.sleep(self.delay)
+        return len(s)
+
+
+def make_record(i: int) -> logging.LogRecord:
+    record = logging.LogRecord(
+        "hubcast.web.github.routes",
+        logging.INFO,
+        __file__,
+        42,
+        "Mirroring refs %d",
+        (i,),
+        None,
+    )
+    record.repo = "llnl/hubcast"
+    record.want_sha = "0" * 40
+    return record
+
+
+def bench_formatter() -> float:
+    formatter = HubcastJSONFormatter(fmt_keys=FMT_KEYS)
+    records = [make_record(i) for i in range(RECORDS)]
+
+    start = time.perf_counter()
+    for record in records:
+        formatter.format(record)
+    return RECORDS / (time.perf_counter() - start)
+
+
+def bench_emit(use_queue: bool) -> float:
+    logger = logging.getLogger(f"bench.{'queue' if use_queue else 'sync'}")
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+
+    handler = logging.StreamHandler(SlowStream(delay=0.0005))
+    handler.setFormatter(HubcastJSONFormatter(fmt_keys=FMT_KEYS))
+    logger.addHandler(handler)
+
+    listener = start_queue_logging(SLOW_RECORDS, logger) if use_queue else None
+
+    start = time.perf_counter()
+    for i in range(SLOW_RECORDS):
+        logger.info("Mirroring refs %d", i, extra={"repo": "llnl/hubcast"})
+    elapsed = time.perf_counter() - start
+
+    if listener:
+        listener.stop()
+    return SLOW_RECORDS / elapsed
+
+
+def main():
+    print(f"json formatter:          {bench_formatter():>12,.0f} records/sec")
+    print(f"slow sink, synchronous:  {bench_emit(False):>12,.0f} records/sec")
+    print(f"slow sink, queued:       {bench_emit(True):>12,.0f} records/sec")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""
+Benchmark for fetch negotiation when mirroring into a busy destination.
+
+Builds a source repository and a destination mirror of it holding thousands
+of pr-N branches with commits the source has never seen, as forks leave
+behind, then serves both locally through git http-backend. New commits are
+pushed to the source's main branch and the pack needed to mirror them is
+negotiated twice: once offering every destination ref as a have, as
+ls-remote returns them, and once offering only the tips ls-refs reports for
+the target ref, HEAD and the base branch.
+
+Reports the time spent listing destination refs, the time until the first
+pack byte arrives, the number of haves sent and the pack size.
+
+Usage: PYTHONPATH=src python benchmarks/bench_negotiation.py [FORK_BRANCHES]
+"""
+
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from repligit.asyncio import ls_remote
+
+from hubcast.clients.git import fetch_pack, ls_refs
+
+FORK_BRANCHES = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+BASE_COMMITS = 500
+NEW_COMMITS = 20
+ROUNDS = 5
+TARGET_REF = "refs/heads/main"
+
+
+def fast_import(repo: str, commits) -> None:
+    """Create commits in `repo`, given as (ref, message, parent) tuples."""
+    stream = []
+    for i, (ref, message, parent) in enumerate(commits):
+        body = message.encode()
+        content = f"{message}\n".encode() * 20
+        stream.append(f"commit {ref}\n".encode())
+        stream.append(f"mark :{i + 1}\n".encode())
+        stream.append(
+            f"committer Bench <bench@example.com> {1700000000 + i} +0000\n".encode()
+        )
+        stream.append(f"data {len(body)}\n".encode() + body + b"\n")
+        if parent:
+            stream.append(f"from {parent}\n".encode())
+        stream.append(f"M 644 inline {message.split()[0]}.txt\n".encode())
+        stream.append(f"data {len(content)}\n".encode() + content + b"\n")
+
+    subprocess.run(
+        ["git", "fast-import", "--quiet"],
+        cwd=repo,
+        input=b"".join(stream),
+        check=True,
+    )
+
+
+def git(repo: str, *args: str) -> str:
+    result = subprocess.run(
+        ["git", *args], cwd=repo, check=True, capture_output=True, text=True
+    )
+    return result.stdout.strip()
+
+
+def build_repos(root: str) -> None:
+    src = os.path.join(root, "src.git")
+    dest = os.path.join(root, "dest.git")
+    subprocess.run(["git", "init", "-q", "--bare", "-b", "main", src], check=True)
+
+    fast_import(
+        src,
+        [
+            (TARGET_REF, f"base{i}", ":" + str(i) if i else None)
+            for i in range(BASE_COMMITS)
+        ],
+    )
+    subprocess.run(["git", "clone", "-q", "--bare", src, dest], check=True)
+
+    # fork branches, each one commit on top of some point of main's history
+    history = git(dest, "rev-list", TARGET_REF).split()
+    fast_import(
+        dest,
+        [
+            (f"refs/heads/pr-{n}", f"fork{n} change", history[n % len(history)])
+            for n in range(FORK_BRANCHES)
+        ],
+    )
+    git(dest, "pack-refs", "--all")
+
+    # new commits on main which the destination needs
+    tip = git(src, "rev-parse", TARGET_REF)
+    fast_import(
+        src,
+        [(TARGET_REF, f"new{i}", f":{i}" if i else tip) for i in range(NEW_COMMITS)],
+    )
+
+
+def make_app(root: str) -> web.Application:
+    """Serve the repositories under `root` through git http-backend."""
+
+    async def handle(request):
+        body = await request.read()
+        env = dict(
+            os.environ,
+            GIT_PROJECT_ROOT=root,
+            GIT_HTTP_EXPORT_ALL="1",
+            GIT_PROTOCOL=request.headers.get("Git-Protocol", ""),
+            REQUEST_METHOD=request.method,
+            PATH_INFO=request.path,
+            QUERY_STRING=request.query_string,
+            CONTENT_TYPE=request.headers.get("Content-Type", ""),
+            CONTENT_LENGTH=str(len(body)),
+        )
+        proc = await asyncio.create_subprocess_exec(
+            "git",
+            "http-backend",
+            env=env,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        out, _ = await proc.communicate(body)
+
+        head, _, payload = out.partition(b"\r\n\r\n")
+        status = 200
+        headers = {}
+        for line in head.decode().split("\r\n"):
+            key, _, value = line.partition(": ")
+            if key.lower() == "status":
+                status = int(value.split()[0])
+            else:
+                headers[key] = value
+        return web.Response(status=status, body=payload, headers=headers)
+
+    app = web.Application(client_max_size=1 << 30)
+    app.router.add_route("*", "/{tail:.*}", handle)
+    return app
+
+
+async def negotiate(src_url: str, dest_url: str, want_sha: str, filtered: bool):
+    start = time.perf_counter()
+    if filtered:
+        wanted = {TARGET_REF, "HEAD"}
+        refs = await ls_refs(dest_url, wanted)
+        haves = [sha for ref, sha in refs.items() if ref in wanted]
+    else:
+        haves = list((await ls_remote(dest_url)).values())
+    listed = time.perf_counter()
+
+    packfile = await fetch_pack(src_url, [want_sha], haves)
+    chunks = packfile.__aiter__()
+    size = len(await chunks.__anext__())
+    first_byte = time.perf_counter()
+    async for chunk in chunks:
+        size += len(chunk)
+
+    return listed - start, first_byte - listed, len(haves), size
+
+
+async def main():
+    with tempfile.TemporaryDirectory() as root:
+        print(f"building repositories with {FORK_BRANCHES} fork branches...")
+        build_repos(root)
+        want_sha = git(os.path.join(root, "src.git"), "rev-parse", TARGET_REF)
+
+        async with TestServer(make_app(root)) as server:
+            src_url = str(server.make_url("/src.git"))
+            dest_url = str(server.make_url("/dest.git"))
+
+            for label, filtered in (("all refs", False), ("ls-refs", True)):
+                runs = [
+                    await negotiate(src_url, dest_url, want_sha, filtered)
+                    for _ in range(ROUNDS)
+                ]
+                list_time = min(r[0] for r in runs)
+                pack_time = min(r[1] for r in runs)
+                _, _, haves, size = runs[-1]
+                print(
+                    f"{label:>10}: list {list_time * 1000:7.1f} ms, "
+                    f"first pack byte {pack_time * 1000:7.1f} ms, "
+                    f"{haves:5d} haves, pack {size:8d} bytes"
+                )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
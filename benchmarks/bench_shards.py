@@ -0,0 +1,104 @@
+"""
+Benchmark for the per-repository ordering of webhook jobs.
+
+Simulates a monorepo receiving a burst of MONO_EVENTS pushes spread over
+MONO_REFS refs, while SMALL_REPOS other repositories each receive a few
+events, all arriving at once. Every job sleeps for a random time standing in
+for mirroring. Runs the events through a JobTracker as unordered jobs, as
+they were before, and queued by repository and ref, then reports how long
+the small repositories' events took, how many jobs ran, and how many events
+finished before an earlier event of the same ref.
+
+Usage: PYTHONPATH=src python benchmarks/bench_shards.py [CONCURRENCY]
+"""
+
+import asyncio
+import random
+import statistics
+import sys
+import time
+
+from aiojobs import Scheduler
+
+from hubcast.web.jobs import EventJob, JobTracker
+from hubcast.web.shards import ShardQueue
+
+CONCURRENCY = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+MONO_EVENTS = 400
+MONO_REFS = 40
+SMALL_REPOS = 20
+SMALL_EVENTS = 3
+JOB_TIME = (0.02, 0.08)
+
+
+def events():
+    rng = random.Random(1)
+    mono = [
+        ("org/mono", f"refs/heads/b{rng.randrange(MONO_REFS)}")
+        for _ in range(MONO_EVENTS)
+    ]
+    small = [
+        (f"org/small-{i}", f"refs/heads/b{j}")
+        for j in range(SMALL_EVENTS)
+        for i in range(SMALL_REPOS)
+    ]
+    # the monorepo's burst arrives just ahead of everyone else
+    return [(repo, ref, rng.uniform(*JOB_TIME)) for repo, ref in mono + small]
+
+
+async def run(name, ordered):
+    jobs = JobTracker(shards=ShardQueue(CONCURRENCY))
+    jobs.scheduler = Scheduler(limit=CONCURRENCY, wait_timeout=0)
+
+    latencies = {}
+    finished = {}
+    out_of_order = 0
+    ran = 0
+
+    async def work(seq, repo, ref, duration, arrived):
+        nonlocal out_of_order, ran
+        ran += 1
+        await asyncio.sleep(duration)
+        if finished.get((repo, ref), -1) > seq:
+            out_of_order += 1
+        finished[(repo, ref)] = max(seq, finished.get((repo, ref), -1))
+        latencies.setdefault(repo, []).append(time.perf_counter() - arrived)
+
+    start = time.perf_counter()
+    for seq, (repo, ref, duration) in enumerate(events()):
+        job = EventJob(
+            "github",
+            "push",
+            {},
+            repo=repo,
+            lane=ref if ordered else None,
+            supersedes=ordered,
+        )
+        await jobs.spawn(work(seq, repo, ref, duration, time.perf_counter()), job)
+
+    while jobs.jobs:
+        await asyncio.sleep(0.005)
+    elapsed = time.perf_counter() - start
+    await jobs.scheduler.close()
+
+    small = [t for repo, ts in latencies.items() if repo != "org/mono" for t in ts]
+    small.sort()
+    print(
+        f"{name:>10}: {ran:4d} jobs ran in {elapsed:5.2f} s, small repos "
+        f"p50 {statistics.median(small) * 1000:6.0f} ms "
+        f"p95 {small[int(len(small) * 0.95)] * 1000:6.0f} ms, "
+        f"{out_of_order} finished out of order"
+    )
+
+
+async def main():
+    print(
+        f"{CONCURRENCY} jobs at once, {MONO_EVENTS} monorepo events, "
+        f"{SMALL_REPOS} small repos with {SMALL_EVENTS} events each"
+    )
+    await run("unordered", False)
+    await run("sharded", True)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
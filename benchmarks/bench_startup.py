@@ -0,0 +1,144 @@
+"""
+Benchmark for how quickly Hubcast starts.
+
+Reports the time spent importing `hubcast.__main__`, as measured by
+`python -X importtime`, along with the packages it's spent in, and the time
+from launching `python -m hubcast` until /healthz and then /readyz first
+answer 200. The server runs with a throwaway config pointing at servers
+which don't exist, nothing is requested from them while starting.
+
+Each measurement is the best of several runs. With --max-import-ms or
+--max-health-ms the benchmark exits non-zero when it's slower than that,
+so it can gate changes pulling heavy imports back into startup.
+
+Usage: PYTHONPATH=src python benchmarks/bench_startup.py [--runs N]
+           [--max-import-ms MS] [--max-health-ms MS]
+"""
+
+import argparse
+import collections
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+TIMEOUT = 30
+
+
+def import_time():
+    """Return the microseconds spent importing, in total and by package."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import hubcast.__main__"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    total = 0
+    packages = collections.Counter()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = line[len("import time:") :].split("|")
+        total += int(self_us)
+        packages[name.strip().split(".")[0]] += int(self_us)
+    return total, packages
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(url, deadline):
+    while time.perf_counter() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                if response.status == 200:
+                    return time.perf_counter()
+        except (urllib.error.URLError, ConnectionError):
+            pass
+        time.sleep(0.002)
+    raise TimeoutError(f"{url} didn't answer within {TIMEOUT}s")
+
+
+def start_time(workdir):
+    """Return the seconds until /healthz and /readyz first answer 200."""
+    users = os.path.join(workdir, "users.yml")
+    with open(users, "w") as f:
+        f.write("Users:\n  octocat: octocat\n")
+
+    port = free_port()
+    env = {
+        **os.environ,
+        "HC_PORT": str(port),
+        "HC_ACCOUNT_MAP_TYPE": "file",
+        "HC_ACCOUNT_MAP_PATH": users,
+        "HC_LOGGING_CONFIG_PATH": os.path.join(workdir, "missing.json"),
+        "HC_GH_APP_IDENTIFIER": "1",
+        "HC_GH_PRIVATE_KEY": "unused",
+        "HC_GH_REQUESTER": "hubcast-bench",
+        "HC_GH_SECRET": "secret",
+        "HC_GH_BOT_USER": "hubcast",
+        "HC_GL_URL": "http://127.0.0.1:9",
+        "HC_GL_REQUESTER": "hubcast-bench",
+        "HC_GL_TOKEN": "unused",
+        "HC_GL_SECRET": "secret",
+        "HC_GL_CALLBACK_URL": "http://127.0.0.1:9",
+    }
+
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "hubcast"],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        deadline = start + TIMEOUT
+        healthy = wait_for(f"http://127.0.0.1:{port}/healthz", deadline)
+        ready = wait_for(f"http://127.0.0.1:{port}/readyz", deadline)
+    finally:
+        proc.terminate()
+        proc.wait()
+
+    return healthy - start, ready - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-import-ms", type=float)
+    parser.add_argument("--max-health-ms", type=float)
+    args = parser.parse_args()
+
+    imports = [import_time() for _ in range(args.runs)]
+    total, packages = min(imports, key=lambda result: result[0])
+    print(f"import hubcast.__main__: {total / 1000:6.1f} ms")
+    for name, self_us in packages.most_common(8):
+        print(f"  {name:>20}: {self_us / 1000:6.1f} ms")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        starts = [start_time(workdir) for _ in range(args.runs)]
+    healthy = min(start[0] for start in starts)
+    ready = min(start[1] for start in starts)
+    print(f"first 200 from /healthz: {healthy * 1000:6.1f} ms")
+    print(f"first 200 from /readyz:  {ready * 1000:6.1f} ms")
+
+    failed = False
+    if args.max_import_ms is not None and total / 1000 > args.max_import_ms:
+        print(f"import time exceeds {args.max_import_ms} ms")
+        failed = True
+    if args.max_health_ms is not None and healthy * 1000 > args.max_health_ms:
+        print(f"time to healthy exceeds {args.max_health_ms} ms")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
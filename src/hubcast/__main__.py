@@ -1,98 +1,296 @@
-import json
+import argparse
+import asyncio
+import contextlib
 import logging
-import logging.config
 import os
+import signal
 import sys
 
 from aiohttp import web
-from aiojobs.aiohttp import setup
+from aiojobs.aiohttp import get_scheduler_from_app, setup
 
-from hubcast.account_map.file import FileMap, FileMapError
-from hubcast.clients.github import GitHubClientFactory
-from hubcast.clients.gitlab import GitLabClientFactory
-from hubcast.config import Config, ConfigError
-from hubcast.web.github import GitHubHandler
-from hubcast.web.gitlab import GitLabHandler
+from hubcast.config import ConfigError, load_config
+from hubcast.logging import LoggingConfigError, configure_logging, start_queue_logging
+from hubcast.web import metrics
+from hubcast.web.dedup import DeliveryCache
+from hubcast.web.diagnostics import LoopMonitor, Profiler, ProfilerBusy
+from hubcast.web.health import HealthHandler
+from hubcast.web.jobs import JobTracker
+from hubcast.web.shards import ShardQueue
+from hubcast.web.startup import Startup
+
+# the rest of Hubcast, imported in the background once the server listens
+SERVICES = "hubcast.web.services"
 
 log = logging.getLogger(__name__)
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(prog="hubcast")
+    subparsers = parser.add_subparsers(dest="command")
+
+    subparsers.add_parser("serve", help="run the webhook server (default)")
+
+    reconcile = subparsers.add_parser(
+        "reconcile", help="sync every out of date ref once and exit"
+    )
+    reconcile.add_argument(
+        "repos",
+        nargs="*",
+        metavar="OWNER/REPO",
+        help="only reconcile these GitHub repositories",
+    )
+
+    prune = subparsers.add_parser(
+        "prune", help="delete destination branches no longer on GitHub once and exit"
+    )
+    prune.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="only report the branches which would be deleted",
+    )
+    prune.add_argument(
+        "repos",
+        nargs="*",
+        metavar="OWNER/REPO",
+        help="only prune these GitHub repositories",
+    )
+
+    return parser.parse_args()
+
+
+async def closing(cache, aw):
+    """Await a one-off command, then close the cache it used."""
+    try:
+        return await aw
+    finally:
+        await cache.close()
+
+
+def lifecycle(jobs, startup, drain_delay, monitor=None, profiler=None):
+    """
+    Build everything else once the server is listening, and on shutdown
+    drain running jobs and checkpoint the ones that don't finish in time.
+
+    SIGTERM marks the app as not ready right away, but the listener is kept
+    open for drain_delay seconds so load balancers can route around us.
+    SIGHUP reloads the configuration, SIGUSR1 starts a profiling session.
+    The loop monitor runs from the start, so it also sees startup.
+    """
+
+    async def ctx(app):
+        loop = asyncio.get_running_loop()
+        jobs.scheduler = get_scheduler_from_app(app)
+        exit_tasks = set()
+        reloads = set()
+
+        def raise_graceful_exit():
+            raise web.GracefulExit()
+
+        async def delayed_exit():
+            await asyncio.sleep(drain_delay)
+            loop.call_soon(raise_graceful_exit)
+
+        def on_sigterm():
+            if jobs.draining:
+                return
+            log.info("Received SIGTERM, draining", extra={"delay": drain_delay})
+            jobs.draining = True
+            exit_tasks.add(asyncio.create_task(delayed_exit()))
+
+        def on_sighup():
+            if startup.services is None:
+                log.warning("Received SIGHUP while starting, not reloading")
+                return
+
+            from hubcast.web.reload import ReloadError
+
+            async def reload():
+                try:
+                    await startup.services.reloader.reload()
+                except ReloadError as exc:
+                    log.error("Configuration reload failed", extra={"error": str(exc)})
+
+            log.info("Received SIGHUP, reloading configuration")
+            # read and applied in the background, the loop keeps serving
+            task = asyncio.create_task(reload())
+            reloads.add(task)
+            task.add_done_callback(reloads.discard)
+
+        def on_sigusr1():
+            log.info("Received SIGUSR1, profiling")
+            try:
+                profiler.start()
+            except ProfilerBusy as exc:
+                log.warning(str(exc))
+
+        # replaces the handler installed by web.run_app
+        loop.add_signal_handler(signal.SIGTERM, on_sigterm)
+        loop.add_signal_handler(signal.SIGHUP, on_sighup)
+        if profiler is not None:
+            loop.add_signal_handler(signal.SIGUSR1, on_sigusr1)
+
+        watching = None
+        if monitor is not None:
+            watching = asyncio.create_task(monitor.run())
+
+        # runs while the server binds and answers health checks
+        warmup = asyncio.create_task(startup.run())
+
+        yield
+
+        warmup.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await warmup
+        jobs.checkpoint(await jobs.drain())
+        await startup.stop()
+
+        if watching is not None:
+            watching.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await watching
+
+    return ctx
+
+
 def main():
+    args = parse_args()
     app = web.Application()
 
+    # settings may also come from a file, which can be reloaded while running
+    config_path = os.environ.get("HC_CONFIG_FILE")
     try:
-        conf = Config()
+        conf = load_config(config_path)
     except ConfigError as exc:
         log.error(exc)
         sys.exit(1)
 
-    if os.path.exists(conf.logging_config_path):
+    try:
+        configure_logging(conf.logging_config_path)
+    except LoggingConfigError as exc:
+        log.error(exc)
+        sys.exit(1)
+
+    log_listener = None
+    if conf.logging_async:
+        log_listener = start_queue_logging(conf.logging_queue_size)
+
+    if args.command in ("reconcile", "prune"):
+        # the one-off commands need everything, there's no server to start early
+        from hubcast.web.services import build_workers
+
         try:
-            with open(conf.logging_config_path) as f:
-                logging_config = json.load(f)
-            logging.config.dictConfig(logging_config)
-        except (
-            json.decoder.JSONDecodeError,
-            # calls to logging.config.dictConfig will raise the following exceptions (cf stdlib docs):
-            ValueError,
-            TypeError,
-            AttributeError,
-            ImportError,
-        ) as exc:
+            workers = build_workers(conf, args.command, getattr(args, "dry_run", False))
+        except ConfigError as exc:
             log.error(exc)
             sys.exit(1)
-    else:
-        logging.basicConfig(level=logging.INFO)
 
-    # error if we're unable to initialize an account map
-    if conf.account_map_type == "file":
+    if args.command == "reconcile":
         try:
-            account_map = FileMap(conf.account_map_path)
-        except FileMapError:
-            log.exception("Error initializing file account map")
-            sys.exit(1)
-    else:
-        log.error(
-            "Unknown account map type",
-            extra={"account_map_type": conf.account_map_type},
-        )
-        sys.exit(1)
+            asyncio.run(
+                closing(
+                    workers.cache, workers.reconciler.reconcile_all(args.repos or None)
+                )
+            )
+        finally:
+            if log_listener:
+                log_listener.stop()
+        return
 
-    gh_client_factory = GitHubClientFactory(
-        conf.gh.app_id, conf.gh.privkey, conf.gh.requester, conf.gh.bot_user
-    )
-    gl_client_factory = GitLabClientFactory(
-        conf.gl.instance_url,
-        conf.gl.requester,
-        conf.gl.token,
-        conf.gl.callback_url,
-        conf.gl.webhook_secret,
-        conf.gl.token_type,
-    )
+    if args.command == "prune":
+        try:
+            report = asyncio.run(
+                closing(workers.cache, workers.pruner.prune_all(args.repos or None))
+            )
+        finally:
+            if log_listener:
+                log_listener.stop()
 
-    gh_handler = GitHubHandler(
-        conf.gh.webhook_secret,
-        account_map,
-        gh_client_factory,
-        gl_client_factory,
-    )
+        verb = "would delete" if workers.pruner.dry_run else "deleted"
+        for repo, dests in report.items():
+            for dest, refs in dests.items():
+                print(f"{repo} -> {dest}: {verb} {len(refs)} branches")
+                for ref in refs:
+                    print(f"  {ref}")
+        return
 
-    gl_handler = GitLabHandler(
-        conf.gl.webhook_secret,
-        gh_client_factory,
+    deliveries = DeliveryCache(conf.dedup_size, conf.dedup_ttl)
+    jobs = JobTracker(
+        conf.drain_timeout,
+        conf.checkpoint_path,
+        ShardQueue(conf.job_concurrency, conf.repo_concurrency, conf.repo_weights),
+        deliveries,
     )
+    profiler = Profiler(conf.profile_dir, conf.profile_seconds)
+    monitor = None
+    if conf.loop_lag_threshold > 0:
+        monitor = LoopMonitor(conf.loop_lag_threshold)
+
+    def build_services():
+        from hubcast.web.services import build_services
+
+        return build_services(
+            conf, config_path, deliveries, jobs, log_listener, profiler
+        )
+
+    # webhooks wait for the rest of Hubcast, health checks don't
+    startup = Startup([SERVICES], build_services, jobs)
+    health = HealthHandler(jobs, startup)
 
     log.info("Starting HTTP server")
 
-    app.router.add_post("/v1/events/src/github", gh_handler.handle)
-    app.router.add_post("/v1/events/dest/gitlab", gl_handler.handle)
+    app.router.add_post(
+        "/v1/events/src/github", startup.handler(lambda s: s.handlers["github"].handle)
+    )
+    app.router.add_post(
+        "/v1/events/dest/gitlab", startup.handler(lambda s: s.handlers["gitlab"].handle)
+    )
+    app.router.add_get("/metrics", metrics.handle)
+    app.router.add_get("/healthz", health.live)
+    app.router.add_get("/readyz", health.ready)
 
-    setup(app)
-    web.run_app(
-        app,
-        port=conf.port,
-        access_log_format='"%r" %s %b "%{Referer}i" "%{User-Agent}i"',
+    if conf.admin_token:
+        app.router.add_get("/admin/jobs", startup.handler(lambda s: s.admin.list_jobs))
+        app.router.add_delete(
+            "/admin/jobs/{job_id}", startup.handler(lambda s: s.admin.cancel_job)
+        )
+        app.router.add_get(
+            "/admin/caches", startup.handler(lambda s: s.admin.list_caches)
+        )
+        app.router.add_delete(
+            "/admin/caches/{cache}/{key:.+}",
+            startup.handler(lambda s: s.admin.invalidate),
+        )
+        app.router.add_post("/admin/reload", startup.handler(lambda s: s.admin.reload))
+        app.router.add_get(
+            "/admin/latency", startup.handler(lambda s: s.admin.list_latency)
+        )
+        app.router.add_post(
+            "/admin/profile", startup.handler(lambda s: s.admin.profile)
+        )
+
+    # jobs are drained by lifecycle, anything left when the scheduler
+    # closes has already been checkpointed
+    setup(app, wait_timeout=0, limit=conf.job_concurrency)
+    app.cleanup_ctx.append(
+        lifecycle(jobs, startup, conf.drain_delay, monitor, profiler)
     )
+    try:
+        web.run_app(
+            app,
+            port=conf.port,
+            access_log_format='"%r" %s %b "%{Referer}i" "%{User-Agent}i"',
+        )
+    finally:
+        # flush anything still waiting on the logging queue, the listener is
+        # replaced whenever logging is reloaded
+        if startup.services is not None:
+            log_listener = startup.services.reloader.log_listener
+        if log_listener:
+            log_listener.stop()
+
+    if startup.failed:
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,62 @@
+from abc import ABC, abstractmethod
+from typing import Optional
+
+
+class CacheError(Exception):
+    pass
+
+
+class CacheBackend(ABC):
+    """
+    An abstract interface defining where cached values are stored.
+
+    Keys and values are strings, values expire after the ttl they're set
+    with. Leases are values naming their owner, which only the owner can
+    renew or release, so replicas can exclude each other. Backends raise
+    CacheError when their store can't be reached.
+    """
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[str]:
+        """Return the value of a key, or None if it's unset or expired."""
+        pass
+
+    @abstractmethod
+    async def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        """Set the value of a key, expiring after `ttl` seconds if given."""
+        pass
+
+    @abstractmethod
+    async def delete(self, key: str) -> bool:
+        """Remove a key, returning False if it was unset."""
+        pass
+
+    @abstractmethod
+    async def count(self, prefix: str) -> int:
+        """Return the number of unexpired keys starting with `prefix`."""
+        pass
+
+    @abstractmethod
+    async def acquire_lease(self, key: str, owner: str, ttl: float) -> bool:
+        """
+        Set a key to `owner` for `ttl` seconds unless it's held by someone
+        else, returning whether `owner` now holds it.
+        """
+        pass
+
+    @abstractmethod
+    async def renew_lease(self, key: str, owner: str, ttl: float) -> bool:
+        """
+        Extend a lease held by `owner` to `ttl` seconds from now, returning
+        False if it has expired or is held by someone else.
+        """
+        pass
+
+    @abstractmethod
+    async def release_lease(self, key: str, owner: str) -> None:
+        """Remove a lease, if it's still held by `owner`."""
+        pass
+
+    async def close(self) -> None:
+        """Release any connections to the store."""
+        pass
@@ -0,0 +1,58 @@
+import time
+from typing import Dict, Optional, Tuple
+
+from .abc import CacheBackend
+
+
+class MemoryBackend(CacheBackend):
+    """
+    Values kept in this process, the default when replicas don't share a
+    cache. Expired values are dropped when they're next read.
+    """
+
+    def __init__(self):
+        # key -> (expiry as a time.monotonic(), or None, value)
+        self._values: Dict[str, Tuple[Optional[float], str]] = {}
+
+    async def get(self, key: str) -> Optional[str]:
+        entry = self._values.get(key)
+        if entry is None:
+            return None
+
+        expires, value = entry
+        if expires is not None and expires <= time.monotonic():
+            del self._values[key]
+            return None
+        return value
+
+    async def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        expires = time.monotonic() + ttl if ttl else None
+        self._values[key] = (expires, value)
+
+    async def delete(self, key: str) -> bool:
+        return self._values.pop(key, None) is not None
+
+    async def count(self, prefix: str) -> int:
+        now = time.monotonic()
+        return sum(
+            1
+            for key, (expires, _) in self._values.items()
+            if key.startswith(prefix) and (expires is None or expires > now)
+        )
+
+    async def acquire_lease(self, key: str, owner: str, ttl: float) -> bool:
+        current = await self.get(key)
+        if current is not None and current != owner:
+            return False
+        await self.set(key, owner, ttl)
+        return True
+
+    async def renew_lease(self, key: str, owner: str, ttl: float) -> bool:
+        if await self.get(key) != owner:
+            return False
+        await self.set(key, owner, ttl)
+        return True
+
+    async def release_lease(self, key: str, owner: str) -> None:
+        if await self.get(key) == owner:
+            del self._values[key]
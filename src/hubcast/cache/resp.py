@@ -0,0 +1,199 @@
+import asyncio
+import re
+import urllib.parse
+from typing import Any, Optional
+
+from .abc import CacheBackend, CacheError
+
+# characters with a meaning in the patterns matched by SCAN
+GLOB_CHARS = re.compile(r"([*?\[\]\\])")
+
+# leases are checked and changed by scripts, which the server runs atomically
+ACQUIRE_SCRIPT = """
+local owner = redis.call("GET", KEYS[1])
+if owner and owner ~= ARGV[1] then return 0 end
+redis.call("SET", KEYS[1], ARGV[1], "PX", ARGV[2])
+return 1
+"""
+RENEW_SCRIPT = """
+if redis.call("GET", KEYS[1]) ~= ARGV[1] then return 0 end
+return redis.call("PEXPIRE", KEYS[1], ARGV[2])
+"""
+RELEASE_SCRIPT = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then redis.call("DEL", KEYS[1]) end
+return 0
+"""
+
+
+def _ms(seconds: float) -> str:
+    return str(max(1, int(seconds * 1000)))
+
+
+class RespBackend(CacheBackend):
+    """
+    Values kept in a server speaking the Redis protocol (RESP), such as
+    Redis or Valkey, shared by every replica connecting to it.
+
+    Commands are sent over one connection, opened when first needed and
+    reopened after an error. Each waits at most `timeout` seconds, so an
+    unreachable server slows a lookup down by no more than that.
+
+    Attributes
+    ----------
+    url: str
+        The server, as redis://[[user]:password@]host[:port][/db], or
+        rediss:// for TLS.
+    prefix: str
+        Prepended to every key, separating deployments sharing a server.
+    timeout: float
+        Seconds to wait for a connection or a reply.
+    """
+
+    def __init__(self, url: str, prefix: str = "", timeout: float = 2.0):
+        parsed = urllib.parse.urlsplit(url)
+        if parsed.scheme not in ("redis", "rediss"):
+            raise CacheError(f"Unsupported cache URL scheme: {parsed.scheme}")
+
+        self.url = url
+        self.prefix = prefix
+        self.timeout = timeout
+        self._host = parsed.hostname or "localhost"
+        self._port = parsed.port or 6379
+        self._username = urllib.parse.unquote(parsed.username or "") or None
+        self._password = urllib.parse.unquote(parsed.password or "") or None
+        self._ssl = parsed.scheme == "rediss"
+        try:
+            self._db = int(parsed.path.lstrip("/") or 0)
+        except ValueError:
+            raise CacheError(f"Invalid cache database in URL: {parsed.path}")
+
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        # replies arrive in order, only one command is in flight at a time
+        self._lock = asyncio.Lock()
+
+    async def get(self, key: str) -> Optional[str]:
+        value = await self._command("GET", self.prefix + key)
+        return value.decode() if value is not None else None
+
+    async def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        args = ["SET", self.prefix + key, value]
+        if ttl:
+            args += ["PX", _ms(ttl)]
+        await self._command(*args)
+
+    async def delete(self, key: str) -> bool:
+        return await self._command("DEL", self.prefix + key) > 0
+
+    async def count(self, prefix: str) -> int:
+        # SCAN may return a key more than once, count each only once
+        pattern = GLOB_CHARS.sub(r"\\\1", self.prefix + prefix) + "*"
+        keys = set()
+        cursor = b"0"
+        while True:
+            cursor, batch = await self._command(
+                "SCAN", cursor, "MATCH", pattern, "COUNT", "1000"
+            )
+            keys.update(batch)
+            if cursor == b"0":
+                return len(keys)
+
+    async def acquire_lease(self, key: str, owner: str, ttl: float) -> bool:
+        reply = await self._command(
+            "EVAL", ACQUIRE_SCRIPT, "1", self.prefix + key, owner, _ms(ttl)
+        )
+        return reply == 1
+
+    async def renew_lease(self, key: str, owner: str, ttl: float) -> bool:
+        reply = await self._command(
+            "EVAL", RENEW_SCRIPT, "1", self.prefix + key, owner, _ms(ttl)
+        )
+        return reply == 1
+
+    async def release_lease(self, key: str, owner: str) -> None:
+        await self._command("EVAL", RELEASE_SCRIPT, "1", self.prefix + key, owner)
+
+    async def close(self) -> None:
+        async with self._lock:
+            self._disconnect()
+
+    async def _command(self, *args) -> Any:
+        async with self._lock:
+            try:
+                return await asyncio.wait_for(self._send(args), self.timeout)
+            except CacheError:
+                raise
+            except (OSError, EOFError, asyncio.TimeoutError, ValueError) as exc:
+                self._disconnect()
+                raise CacheError(f"Cache server {self._host}:{self._port}: {exc!r}")
+            except BaseException:
+                # a reply may still be on its way, it mustn't answer the
+                # next command
+                self._disconnect()
+                raise
+
+    async def _send(self, args) -> Any:
+        if self._writer is None:
+            await self._connect()
+
+        self._writer.write(self._encode(args))
+        await self._writer.drain()
+        return await self._read_reply()
+
+    async def _connect(self) -> None:
+        self._reader, self._writer = await asyncio.open_connection(
+            self._host, self._port, ssl=self._ssl or None
+        )
+        try:
+            if self._password is not None:
+                auth = ["AUTH", self._password]
+                if self._username is not None:
+                    auth.insert(1, self._username)
+                self._writer.write(self._encode(auth))
+                await self._read_reply()
+            if self._db:
+                self._writer.write(self._encode(["SELECT", str(self._db)]))
+                await self._read_reply()
+        except BaseException:
+            # never send commands over a connection which isn't set up
+            self._disconnect()
+            raise
+
+    def _disconnect(self) -> None:
+        writer, self._reader, self._writer = self._writer, None, None
+        if writer is not None:
+            writer.close()
+
+    @staticmethod
+    def _encode(args) -> bytes:
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode()
+            parts.append(f"${len(data)}\r\n".encode() + data + b"\r\n")
+        return b"".join(parts)
+
+    async def _read_reply(self) -> Any:
+        line = await self._reader.readline()
+        if not line.endswith(b"\r\n"):
+            raise EOFError("connection closed")
+
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode()
+        if kind == b"-":
+            # the connection is still usable after an error reply
+            raise CacheError(f"Cache server error: {rest.decode()}")
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            length = int(rest)
+            if length < 0:
+                return None
+            return (await self._reader.readexactly(length + 2))[:-2]
+        if kind == b"*":
+            length = int(rest)
+            if length < 0:
+                return None
+            return [await self._read_reply() for _ in range(length)]
+
+        raise ValueError(f"unexpected reply {line!r}")
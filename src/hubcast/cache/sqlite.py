@@ -0,0 +1,120 @@
+import asyncio
+import sqlite3
+import threading
+import time
+from typing import Optional, Tuple
+
+from .abc import CacheBackend, CacheError
+
+# sets between purges of expired values
+PURGE_EVERY = 1000
+
+
+class SQLiteBackend(CacheBackend):
+    """
+    Values kept in a SQLite database file, shared by every replica on a
+    host or with access to the same local volume. Not for network
+    filesystems, whose locking SQLite can't rely on.
+
+    Queries run in a thread so the event loop never waits on the disk.
+
+    Attributes
+    ----------
+    path: str
+        The database file, created if it doesn't exist.
+    prefix: str
+        Prepended to every key, separating deployments sharing a file.
+    """
+
+    def __init__(self, path: str, prefix: str = ""):
+        self.path = path
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._sets = 0
+        try:
+            self._db = sqlite3.connect(
+                path, timeout=5, isolation_level=None, check_same_thread=False
+            )
+            # readers don't block the writer of another replica
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL)"
+            )
+        except sqlite3.Error as exc:
+            raise CacheError(f"Failed to open cache database {path}: {exc}")
+
+    async def get(self, key: str) -> Optional[str]:
+        rows, _ = await self._run(
+            "SELECT value FROM cache WHERE key = ? AND (expires IS NULL OR expires > ?)",
+            (self.prefix + key, time.time()),
+        )
+        return rows[0][0] if rows else None
+
+    async def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        expires = time.time() + ttl if ttl else None
+        await self._run(
+            "INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)",
+            (self.prefix + key, value, expires),
+        )
+
+        self._sets += 1
+        if self._sets % PURGE_EVERY == 0:
+            await self._run("DELETE FROM cache WHERE expires <= ?", (time.time(),))
+
+    async def delete(self, key: str) -> bool:
+        _, deleted = await self._run(
+            "DELETE FROM cache WHERE key = ?", (self.prefix + key,)
+        )
+        return deleted > 0
+
+    async def count(self, prefix: str) -> int:
+        # a range rather than LIKE, so the primary key index is used and
+        # keys may contain wildcards
+        start = self.prefix + prefix
+        rows, _ = await self._run(
+            "SELECT COUNT(*) FROM cache WHERE key >= ? AND key < ? "
+            "AND (expires IS NULL OR expires > ?)",
+            (start, start + "\U0010ffff", time.time()),
+        )
+        return rows[0][0]
+
+    async def acquire_lease(self, key: str, owner: str, ttl: float) -> bool:
+        # takes over the row only once the previous lease has expired
+        now = time.time()
+        _, changed = await self._run(
+            "INSERT INTO cache (key, value, expires) VALUES (?, ?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET value = excluded.value, "
+            "expires = excluded.expires "
+            "WHERE cache.value = excluded.value OR cache.expires <= ?",
+            (self.prefix + key, owner, now + ttl, now),
+        )
+        return changed > 0
+
+    async def renew_lease(self, key: str, owner: str, ttl: float) -> bool:
+        now = time.time()
+        _, changed = await self._run(
+            "UPDATE cache SET expires = ? WHERE key = ? AND value = ? AND expires > ?",
+            (now + ttl, self.prefix + key, owner, now),
+        )
+        return changed > 0
+
+    async def release_lease(self, key: str, owner: str) -> None:
+        await self._run(
+            "DELETE FROM cache WHERE key = ? AND value = ?", (self.prefix + key, owner)
+        )
+
+    async def close(self) -> None:
+        await asyncio.to_thread(self._db.close)
+
+    async def _run(self, sql: str, params: tuple) -> Tuple[list, int]:
+        """Run a query, returning its rows and the number of rows changed."""
+        return await asyncio.to_thread(self._query, sql, params)
+
+    def _query(self, sql: str, params: tuple) -> Tuple[list, int]:
+        try:
+            with self._lock:
+                cursor = self._db.execute(sql, params)
+                return cursor.fetchall(), cursor.rowcount
+        except sqlite3.Error as exc:
+            raise CacheError(f"Cache database query failed: {exc}")
@@ -0,0 +1,18 @@
+from .batch import RefBatcher
+from .client import EMPTY_PACK, NULL_SHA, RefUpdate, fetch_pack, ls_refs, send_pack
+from .meter import PackMeter, PackTooLarge
+from .spool import PackBudget, PackSpool
+
+__all__ = [
+    "EMPTY_PACK",
+    "NULL_SHA",
+    "PackBudget",
+    "PackMeter",
+    "PackSpool",
+    "PackTooLarge",
+    "RefBatcher",
+    "RefUpdate",
+    "fetch_pack",
+    "ls_refs",
+    "send_pack",
+]
@@ -0,0 +1,314 @@
+import asyncio
+import logging
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Set, Tuple, Union
+
+from repligit.exceptions import RefUpdateRejected, UnexpectedResponse
+
+from hubcast.clients import shadow
+
+from .client import EMPTY_PACK, RefUpdate, fetch_pack, send_pack
+from .meter import PackMeter
+from .spool import PackBudget, PackSpool
+
+log = logging.getLogger(__name__)
+
+
+class _Entry:
+    def __init__(
+        self,
+        dest_url: str,
+        update: RefUpdate,
+        have_shas: Set[str],
+        future: asyncio.Future,
+        password: Optional[str] = None,
+        repo: Optional[str] = None,
+        max_pack_size: Optional[int] = None,
+    ):
+        self.dest_url = dest_url
+        self.update = update
+        self.have_shas = have_shas
+        self.future = future
+        self.password = password
+        self.repo = repo
+        self.max_pack_size = max_pack_size
+
+
+class _Batch:
+    def __init__(self, src_url: str, username: Optional[str]):
+        self.src_url = src_url
+        self.username = username
+        self.entries: List[_Entry] = []
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+class RefBatcher:
+    """
+    Gathers ref updates and deletions arriving within a short window and
+    applies them with one multi-command receive-pack per destination.
+
+    Updates are batched per source repository and pushing user. Every batch
+    fetches a single pack from the source holding the objects all of its
+    updates need, and each caller is handed back the result for its own ref.
+    Destinations may live on different GitLab instances, so each is pushed
+    with the token its own updates came with. Packs larger than the source
+    repository allows are cut off, failing the updates needing them with
+    PackTooLarge. A batch's pack is held to the strictest limit of its
+    updates.
+
+    Attributes
+    ----------
+    window: float
+        Seconds to wait for more updates after the first one of a batch.
+    max_size: int
+        Number of updates which flush a batch without waiting out the window.
+    budget: PackBudget
+        The memory budget packs going to several destinations are buffered
+        within.
+    spill_threshold: int
+        Bytes above which a buffered pack is written to disk instead.
+    spill_dir: str
+        Where packs are written, the system temp dir if None.
+    max_pack_size: int
+        Bytes a pack may have unless its updates say otherwise, 0 for no
+        limit.
+    """
+
+    def __init__(
+        self,
+        window: float = 0.05,
+        max_size: int = 100,
+        budget: Optional[PackBudget] = None,
+        spill_threshold: int = 64 << 20,
+        spill_dir: Optional[str] = None,
+        max_pack_size: int = 0,
+    ):
+        self.window = window
+        self.max_size = max_size
+        self.budget = budget or PackBudget(512 << 20)
+        self.spill_threshold = spill_threshold
+        self.spill_dir = spill_dir
+        self.max_pack_size = max_pack_size
+        self._batches: Dict[Tuple[str, Optional[str]], _Batch] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def update(
+        self,
+        src_url: str,
+        dest_url: str,
+        update: RefUpdate,
+        have_shas: Iterable[str],
+        username: Optional[str] = None,
+        password: Optional[str] = None,
+        repo: Optional[str] = None,
+        max_pack_size: Optional[int] = None,
+    ) -> None:
+        """
+        Queue a ref update (or deletion) and wait for it to be applied.
+
+        `repo` names the repository the update is for in pack metrics, and
+        `max_pack_size` overrides the batcher's limit for its packs.
+
+        Raises RefUpdateRejected if the destination refused this ref,
+        PackTooLarge if the pack it needed was cut off, or the error which
+        failed the whole batch.
+        """
+        loop = asyncio.get_running_loop()
+        key = (src_url, username)
+
+        batch = self._batches.get(key)
+        if batch is None:
+            batch = self._batches[key] = _Batch(src_url, username)
+            batch.timer = loop.call_later(self.window, self._flush, key)
+
+        future = loop.create_future()
+        batch.entries.append(
+            _Entry(
+                dest_url,
+                update,
+                set(have_shas),
+                future,
+                password,
+                repo,
+                max_pack_size,
+            )
+        )
+
+        if len(batch.entries) >= self.max_size:
+            batch.timer.cancel()
+            self._flush(key)
+
+        await future
+
+    def _flush(self, key: Tuple[str, Optional[str]]) -> None:
+        batch = self._batches.pop(key, None)
+        if batch is None:
+            return
+
+        task = asyncio.create_task(self._send(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, batch: _Batch) -> None:
+        try:
+            await self._apply(batch)
+        except BaseException as exc:
+            for entry in batch.entries:
+                if not entry.future.done():
+                    entry.future.set_exception(exc)
+            if not isinstance(exc, Exception):
+                raise
+
+    async def _apply(self, batch: _Batch) -> None:
+        # group entries per destination, several updates of the same ref are
+        # collapsed into one command from the first old sha to the last new sha
+        dests: Dict[str, Dict[str, RefUpdate]] = {}
+        haves: Dict[str, Set[str]] = {}
+        passwords: Dict[str, Optional[str]] = {}
+        for entry in batch.entries:
+            updates = dests.setdefault(entry.dest_url, {})
+            haves.setdefault(entry.dest_url, set()).update(entry.have_shas)
+            # a token only ever goes to its own destination, later entries
+            # may carry a fresher one for it
+            passwords[entry.dest_url] = entry.password
+
+            previous = updates.get(entry.update.ref)
+            if previous:
+                updates[entry.update.ref] = previous._replace(
+                    to_sha=entry.update.to_sha
+                )
+            else:
+                updates[entry.update.ref] = entry.update
+
+        meter = PackMeter(
+            batch.entries[0].repo or batch.src_url, self._pack_limit(batch)
+        )
+        packfile = await self._fetch(batch, dests, haves, meter)
+
+        # in shadow mode packs are read through, but not pushed
+        push = send_pack if shadow.recorder is None else shadow.recorder.send_pack
+
+        urls = list(dests)
+        try:
+            results = await asyncio.gather(
+                *(
+                    push(
+                        url,
+                        list(dests[url].values()),
+                        # every upload reads the spooled pack on its own
+                        packfile.chunks()
+                        if isinstance(packfile, PackSpool)
+                        else packfile,
+                        username=batch.username,
+                        password=passwords[url],
+                    )
+                    for url in urls
+                ),
+                return_exceptions=True,
+            )
+        finally:
+            if isinstance(packfile, PackSpool):
+                packfile.close()
+            elif not isinstance(packfile, bytes):
+                # a failed upload may have never read the streamed pack
+                await packfile.aclose()
+
+        # uploads of a pack cut off in the middle fail however the client
+        # reports it, hand their callers the reason instead
+        if meter.error is not None:
+            results = [
+                meter.error if isinstance(result, BaseException) else result
+                for result in results
+            ]
+
+        log.info(
+            "Applied batched ref updates",
+            extra={
+                "src": batch.src_url,
+                "destinations": len(urls),
+                "updates": len(batch.entries),
+            },
+        )
+
+        by_url = dict(zip(urls, results))
+        for entry in batch.entries:
+            if entry.future.done():
+                continue
+
+            result = by_url[entry.dest_url]
+            if isinstance(result, BaseException):
+                entry.future.set_exception(result)
+            elif result.get(entry.update.ref):
+                entry.future.set_exception(RefUpdateRejected(result[entry.update.ref]))
+            else:
+                entry.future.set_result(None)
+
+    def _pack_limit(self, batch: _Batch) -> int:
+        """Return the strictest pack size limit of a batch's updates."""
+        limits = [
+            self.max_pack_size if entry.max_pack_size is None else entry.max_pack_size
+            for entry in batch.entries
+        ]
+        # 0 is no limit, so it's only the limit when every update says so
+        return min((limit for limit in limits if limit > 0), default=0)
+
+    async def _fetch(
+        self,
+        batch: _Batch,
+        dests: Dict[str, Dict[str, RefUpdate]],
+        haves: Dict[str, Set[str]],
+        meter: PackMeter,
+    ) -> Union[bytes, AsyncIterator[bytes], PackSpool]:
+        needs_pack = [
+            url
+            for url, updates in dests.items()
+            if any(not u.is_delete for u in updates.values())
+        ]
+        if not needs_pack:
+            return b""
+
+        # a single pack has to apply on every destination, so it may only
+        # leave out objects all of them already have
+        have_shas = set.intersection(*(haves[url] for url in needs_pack))
+        want_shas = {
+            u.to_sha
+            for url in needs_pack
+            for u in dests[url].values()
+            if not u.is_delete
+        }
+        want_shas -= have_shas
+
+        if not want_shas:
+            return EMPTY_PACK
+
+        # the streamed pack can only be consumed once, spool it when it's
+        # going to more than one destination, waiting for room in the
+        # budget before starting the download
+        if len(needs_pack) == 1:
+            return meter.wrap(self._download(batch.src_url, want_shas, have_shas))
+
+        spool = PackSpool(self.budget, self.spill_threshold, self.spill_dir)
+        try:
+            await spool.fill(
+                meter.wrap(self._download(batch.src_url, want_shas, have_shas))
+            )
+        except BaseException:
+            spool.close()
+            raise
+        return spool
+
+    @staticmethod
+    async def _download(
+        src_url: str, want_shas: Set[str], have_shas: Set[str]
+    ) -> AsyncIterator[bytes]:
+        # only started once the pack is read, so an upload failing before
+        # it gets to the pack never opens the download
+        packfile = await fetch_pack(src_url, want_shas, have_shas)
+        if packfile is None:
+            raise UnexpectedResponse(
+                f"no packfile in upload-pack response. src={src_url}"
+            )
+        try:
+            async for chunk in packfile:
+                yield chunk
+        finally:
+            await packfile.aclose()
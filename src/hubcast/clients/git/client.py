@@ -0,0 +1,212 @@
+import hashlib
+from typing import (
+    AsyncIterable,
+    AsyncIterator,
+    Dict,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Union,
+)
+
+import aiohttp
+from repligit.asyncio.parse import read_pkt_lines
+from repligit.exceptions import RemoteError, UnexpectedResponse, UnpackFailed
+from repligit.parse import encode_lines
+
+NULL_SHA = "0" * 40
+
+# a version 2 packfile holding no objects, sent when every object a ref update
+# needs already exists on the remote
+_EMPTY_PACK_HEADER = b"PACK" + (2).to_bytes(4, "big") + (0).to_bytes(4, "big")
+EMPTY_PACK = _EMPTY_PACK_HEADER + hashlib.sha1(_EMPTY_PACK_HEADER).digest()  # nosec B324
+
+# packs can take as long as they need to transfer, as long as they keep
+# moving, so a stalled remote can't hold a push or its pack forever
+TRANSFER_TIMEOUT = aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=300)
+
+
+class RefUpdate(NamedTuple):
+    """A single receive-pack command moving `ref` from `from_sha` to `to_sha`."""
+
+    ref: str
+    from_sha: str
+    to_sha: str
+
+    @property
+    def is_delete(self) -> bool:
+        return self.to_sha == NULL_SHA
+
+
+def _basic_auth(username: Optional[str], password: Optional[str]):
+    return aiohttp.BasicAuth(username or "", password) if password else None
+
+
+async def ls_refs(
+    url: str,
+    prefixes: Iterable[str],
+    username: Optional[str] = None,
+    password: Optional[str] = None,
+) -> Dict[str, str]:
+    """
+    List the refs of a remote starting with any of `prefixes`.
+
+    Uses the protocol v2 ls-refs command, so the remote only advertises the
+    matching refs instead of every ref it has, which for a busy GitLab
+    project includes thousands of branches and merge request refs. Like
+    git, a prefix matches any ref starting with it, so callers wanting an
+    exact ref must filter the result.
+    """
+    args = [f"ref-prefix {prefix}".encode() for prefix in set(prefixes)]
+    request = (
+        encode_lines([b"command=ls-refs"]) + b"0001" + encode_lines(args) + b"0000"
+    )
+
+    async with (
+        aiohttp.ClientSession(auth=_basic_auth(username, password)) as session,
+        session.post(
+            f"{url}/git-upload-pack",
+            headers={
+                "Content-type": "application/x-git-upload-pack-request",
+                "Git-Protocol": "version=2",
+            },
+            data=request,
+            raise_for_status=True,
+        ) as resp,
+    ):
+        refs: Dict[str, str] = {}
+        async for line in read_pkt_lines(resp.content):
+            # "<sha> <ref>", followed by attributes we didn't ask for
+            sha, ref = line.split(" ")[:2]
+            refs[ref] = sha
+        return refs
+
+
+async def fetch_pack(
+    url: str,
+    want_shas: Iterable[str],
+    have_shas: Iterable[str],
+    username: Optional[str] = None,
+    password: Optional[str] = None,
+) -> Optional[AsyncIterator[bytes]]:
+    """
+    Download one packfile holding every object reachable from `want_shas`
+    which isn't reachable from `have_shas`.
+
+    This is repligit's fetch_pack with support for more than one want, so a
+    batch of ref updates can be served by a single upload-pack session.
+    Returns an async iterator over the packfile, or None if the server
+    response was unrecognized. The connection stays open until the iterator
+    is exhausted or closed, so callers must do either.
+
+    Every have costs the remote a lookup during negotiation, so callers
+    should send only the tips relevant to the wants rather than every ref
+    of the destination.
+    """
+    want_cmds = encode_lines([f"want {sha}".encode() for sha in set(want_shas)])
+    have_cmds = encode_lines([f"have {sha}".encode() for sha in set(have_shas)])
+    request = want_cmds + b"0000" + have_cmds + encode_lines([b"done"])
+
+    session = aiohttp.ClientSession(auth=_basic_auth(username, password))
+    try:
+        resp = await session.post(
+            f"{url}/git-upload-pack",
+            headers={"Content-type": "application/x-git-upload-pack-request"},
+            data=request,
+            raise_for_status=True,
+            timeout=TRANSFER_TIMEOUT,
+        )
+
+        # consume NAK/ACK negotiation lines until the packfile signature
+        while True:
+            prefix = await resp.content.readexactly(4)
+            if prefix == b"PACK":
+                break
+
+            line_length = int(prefix, 16)
+            if line_length == 0:
+                continue
+
+            line = await resp.content.readexactly(line_length - 4)
+            if line[:3] == b"ERR":
+                raise RemoteError(line.decode("utf-8").strip())
+
+            if line[:3] not in (b"NAK", b"ACK"):
+                await session.close()
+                return None
+    except BaseException:
+        await session.close()
+        raise
+
+    async def _stream() -> AsyncIterator[bytes]:
+        try:
+            yield prefix
+            async for chunk in resp.content.iter_any():
+                yield chunk
+        finally:
+            await session.close()
+
+    return _stream()
+
+
+async def send_pack(
+    url: str,
+    updates: List[RefUpdate],
+    packfile: Union[bytes, AsyncIterable[bytes]],
+    username: Optional[str] = None,
+    password: Optional[str] = None,
+) -> Dict[str, Optional[str]]:
+    """
+    Apply several ref updates and deletions in a single receive-pack session.
+
+    Returns a mapping of each ref to None if it was updated, or the reason
+    the remote gave for rejecting it. Raises UnpackFailed if the remote
+    couldn't unpack the packfile, in which case no ref was updated.
+    """
+    commands = [f"{u.from_sha} {u.to_sha} {u.ref}" for u in updates]
+    commands[0] += "\x00 report-status"
+    header = encode_lines(commands) + b"0000"
+
+    # receive-pack doesn't read a pack when every command is a deletion
+    if all(u.is_delete for u in updates):
+        packfile = b""
+
+    async def _receive_pack_request() -> AsyncIterator[bytes]:
+        yield header
+        if isinstance(packfile, bytes):
+            yield packfile
+        else:
+            async for chunk in packfile:
+                yield chunk
+
+    async with (
+        aiohttp.ClientSession(auth=_basic_auth(username, password)) as session,
+        session.post(
+            f"{url}/git-receive-pack",
+            headers={"Content-type": "application/x-git-receive-pack-request"},
+            data=_receive_pack_request(),
+            raise_for_status=True,
+            timeout=TRANSFER_TIMEOUT,
+        ) as resp,
+    ):
+        lines = read_pkt_lines(resp.content)
+        unpack_status = await anext(lines)
+        if unpack_status != "unpack ok":
+            raise UnpackFailed(unpack_status)
+
+        results: Dict[str, Optional[str]] = {}
+        async for line in lines:
+            status, _, rest = line.partition(" ")
+            if status == "ok":
+                results[rest] = None
+            elif status == "ng":
+                ref, _, reason = rest.partition(" ")
+                results[ref] = reason
+            else:
+                raise UnexpectedResponse(f"unexpected ref status line: {line!r}")
+
+    for u in updates:
+        if u.ref not in results:
+            raise UnexpectedResponse(f"no status reported for ref {u.ref}")
+    return results
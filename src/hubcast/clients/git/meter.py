@@ -0,0 +1,89 @@
+import time
+from typing import AsyncIterator, Optional
+
+from hubcast import metrics
+
+pack_size = metrics.histogram(
+    "hubcast_pack_size_bytes",
+    "Size of the packs fetched from source repositories.",
+    buckets=(1 << 10, 1 << 14, 1 << 17, 1 << 20, 1 << 23, 1 << 26, 1 << 28, 1 << 30),
+)
+pack_objects = metrics.histogram(
+    "hubcast_pack_objects",
+    "Number of objects in the packs fetched from source repositories.",
+    buckets=(1, 10, 100, 1000, 10000, 100000, 1000000),
+)
+pack_transfer = metrics.histogram(
+    "hubcast_pack_transfer_seconds",
+    "Time taken to stream a pack from its source repository.",
+)
+packs_refused = metrics.counter(
+    "hubcast_packs_refused_total",
+    "Packs cut off for growing past the size allowed for their repository.",
+)
+
+
+class PackTooLarge(Exception):
+    """A pack grew past the size allowed for its repository."""
+
+    def __init__(self, repo: str, limit: int):
+        super().__init__(f"Pack exceeds the limit of {limit} bytes. repo={repo}")
+        self.repo = repo
+        self.limit = limit
+
+
+class PackMeter:
+    """
+    Measures a pack while it's streamed, recording its size, object count
+    and transfer time under the repository it came from once it's done.
+
+    The stream is cut off with PackTooLarge as soon as it passes `limit`
+    bytes, so an oversized pack isn't downloaded, or uploaded, in full.
+
+    Attributes
+    ----------
+    repo: str
+        The source repository, labelling the recorded metrics.
+    limit: int
+        Bytes a pack may have, 0 for no limit.
+    size: int
+        Bytes streamed so far.
+    error: PackTooLarge
+        Set once the pack is cut off.
+    """
+
+    def __init__(self, repo: str, limit: int = 0):
+        self.repo = repo
+        self.limit = limit
+        self.size = 0
+        self.error: Optional[PackTooLarge] = None
+        self._header = b""
+
+    @property
+    def objects(self) -> Optional[int]:
+        # "PACK", a version and the number of objects, 4 bytes each
+        if len(self._header) < 12 or not self._header.startswith(b"PACK"):
+            return None
+        return int.from_bytes(self._header[8:12], "big")
+
+    async def wrap(self, chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        start = time.monotonic()
+        try:
+            async for chunk in chunks:
+                if len(self._header) < 12:
+                    self._header += chunk[: 12 - len(self._header)]
+
+                self.size += len(chunk)
+                if self.limit and self.size > self.limit:
+                    self.error = PackTooLarge(self.repo, self.limit)
+                    packs_refused.inc(repo=self.repo)
+                    raise self.error
+                yield chunk
+        finally:
+            # stop the download when the pack is cut off or abandoned
+            await chunks.aclose()
+
+        pack_transfer.observe(time.monotonic() - start, repo=self.repo)
+        pack_size.observe(self.size, repo=self.repo)
+        if self.objects is not None:
+            pack_objects.observe(self.objects, repo=self.repo)
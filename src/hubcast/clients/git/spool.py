@@ -0,0 +1,193 @@
+import asyncio
+import os
+import tempfile
+import time
+from collections import deque
+from typing import AsyncIterable, AsyncIterator, Deque, List, Optional, Tuple
+
+from hubcast import metrics
+
+# bytes written to or read from a spilled pack at once
+CHUNK_SIZE = 1 << 20
+
+pack_buffer_bytes = metrics.gauge(
+    "hubcast_pack_buffer_bytes",
+    "Bytes of the pack memory budget reserved by packs buffered in memory.",
+)
+pack_spills = metrics.counter(
+    "hubcast_pack_spills_total",
+    "Packs too large to buffer in memory, written to a temporary file instead.",
+)
+pack_budget_wait = metrics.histogram(
+    "hubcast_pack_budget_wait_seconds",
+    "Time packs waited for room in the pack memory budget before downloading.",
+)
+
+
+class PackBudget:
+    """
+    A limit on the bytes of packs buffered in memory across the process.
+
+    Reservations wait until there's room for them, and are granted in the
+    order they were requested so a large one isn't starved by smaller ones.
+
+    Attributes
+    ----------
+    limit: int
+        Bytes which may be reserved at once.
+    used: int
+        Bytes currently reserved.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.used = 0
+        self._waiters: Deque[Tuple[int, asyncio.Future]] = deque()
+
+    async def reserve(self, size: int) -> None:
+        """Wait until `size` bytes can be reserved, then reserve them."""
+        if not self._waiters and self.used + size <= self.limit:
+            self._take(size)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        waiter = (size, future)
+        self._waiters.append(waiter)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # granted just as we were cancelled
+                self.release(size)
+            else:
+                self._waiters.remove(waiter)
+                self._wake()
+            raise
+
+    def release(self, size: int) -> None:
+        self.used -= size
+        pack_buffer_bytes.dec(size)
+        self._wake()
+
+    def _take(self, size: int) -> None:
+        self.used += size
+        pack_buffer_bytes.inc(size)
+
+    def _wake(self) -> None:
+        while self._waiters and self.used + self._waiters[0][0] <= self.limit:
+            size, future = self._waiters.popleft()
+            if not future.done():
+                self._take(size)
+                future.set_result(None)
+
+
+class PackSpool:
+    """
+    A pack downloaded once to be uploaded to several destinations.
+
+    Before downloading, room for up to `spill_threshold` bytes is reserved
+    from the budget, waiting for it if other packs are using it, so packs
+    wait rather than take the process past its memory limit. A pack growing
+    past that is written to an unnamed temporary file instead, and read
+    back in chunks by each upload. Whatever part of the reservation a pack
+    doesn't use is handed back once it's downloaded.
+
+    Attributes
+    ----------
+    budget: PackBudget
+        The budget in-memory packs reserve their bytes from.
+    spill_threshold: int
+        Bytes above which a pack is spilled to disk.
+    spill_dir: str
+        Where spilled packs are written, the system temp dir if None.
+    size: int
+        Bytes downloaded so far.
+    """
+
+    def __init__(
+        self,
+        budget: PackBudget,
+        spill_threshold: int,
+        spill_dir: Optional[str] = None,
+    ):
+        self.budget = budget
+        self.spill_threshold = min(spill_threshold, budget.limit)
+        self.spill_dir = spill_dir
+        self.size = 0
+        self._chunks: List[bytes] = []
+        self._file = None
+        self._reserved = 0
+
+    @property
+    def spilled(self) -> bool:
+        return self._file is not None
+
+    async def fill(self, chunks: AsyncIterable[bytes]) -> None:
+        """Download a pack into the spool."""
+        start = time.monotonic()
+        await self.budget.reserve(self.spill_threshold)
+        self._reserved = self.spill_threshold
+        pack_budget_wait.observe(time.monotonic() - start)
+
+        # spilled chunks are gathered into larger writes
+        pending: List[bytes] = []
+        pending_size = 0
+        async for chunk in chunks:
+            self.size += len(chunk)
+            if self._file is None and self.size > self._reserved:
+                await self._spill()
+
+            if self._file is None:
+                self._chunks.append(chunk)
+                continue
+
+            pending.append(chunk)
+            pending_size += len(chunk)
+            if pending_size >= CHUNK_SIZE:
+                await asyncio.to_thread(self._file.write, b"".join(pending))
+                pending, pending_size = [], 0
+
+        if self._file is None:
+            self._resize(self.size)
+        else:
+            await asyncio.to_thread(self._write_all, b"".join(pending))
+
+    async def chunks(self) -> AsyncIterator[bytes]:
+        """Read the pack back, each caller reading independently."""
+        if self._file is None:
+            for chunk in self._chunks:
+                yield chunk
+            return
+
+        fd = self._file.fileno()
+        offset = 0
+        while offset < self.size:
+            chunk = await asyncio.to_thread(os.pread, fd, CHUNK_SIZE, offset)
+            if not chunk:
+                break
+            offset += len(chunk)
+            yield chunk
+
+    def close(self) -> None:
+        """Drop the pack, handing its reservation back and deleting its file."""
+        self._chunks = []
+        self._resize(0)
+        if self._file is not None:
+            self._file.close()
+
+    async def _spill(self) -> None:
+        self._file = await asyncio.to_thread(tempfile.TemporaryFile, dir=self.spill_dir)
+        data = b"".join(self._chunks)
+        self._chunks = []
+        await asyncio.to_thread(self._file.write, data)
+        self._resize(0)
+        pack_spills.inc()
+
+    def _write_all(self, data: bytes) -> None:
+        self._file.write(data)
+        self._file.flush()
+
+    def _resize(self, size: int) -> None:
+        if size < self._reserved:
+            self.budget.release(self._reserved - size)
+            self._reserved = size
@@ -1,11 +1,12 @@
 import time
-from typing import Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
 import aiohttp
 import gidgethub.apps as gha
 from gidgethub import aiohttp as gh_aiohttp
 
-from hubcast.clients.utils import TokenCache
+from hubcast.cache.abc import CacheBackend
+from hubcast.clients.utils import LookupCache, TokenCache
 
 # location for authenticated app to get a token for one of its installations
 # bandit thinks this is a hardcoded password, we ignore security checks on this line
@@ -25,17 +26,35 @@ class GitHubAuthenticator:
         which is used to generate JWTs and other access tokens.
     app_id: str
         A string of the numeric GitHub App's ID.
+    cache: CacheBackend
+        Where tokens and installation ids are cached, in-process by default.
+    cache_ttl: float
+        Seconds installation ids are cached for, or None to keep them.
     """
 
-    def __init__(self, requester: str, private_key: str, app_id: str) -> None:
+    def __init__(
+        self,
+        requester: str,
+        private_key: str,
+        app_id: str,
+        cache: Optional[CacheBackend] = None,
+        cache_ttl: Optional[float] = None,
+    ) -> None:
         self.requester = requester
         self.private_key = private_key
         self.app_id = app_id
-        self._tokens = TokenCache()
-        self._id_dict = {}
+        # tokens and installation ids belong to the app, keep them apart from
+        # those of other apps sharing the backend
+        self._tokens = TokenCache(f"github_tokens:{app_id}", cache)
+        self._ids = LookupCache(f"installation_ids:{app_id}", cache, cache_ttl)
+
+    def caches(self) -> Dict[str, Any]:
+        """The caches kept by the authenticator, by name."""
+        return {"github_tokens": self._tokens, "installation_ids": self._ids}
 
     async def get_installation_id(self, owner: str, repo: str) -> str:
-        if (owner, repo) not in self._id_dict:
+        installation_id = await self._ids.get(f"{owner}/{repo}")
+        if installation_id is None:
             async with aiohttp.ClientSession() as session:
                 gh = gh_aiohttp.GitHubAPI(session, self.requester)
                 result = await gh.getitem(
@@ -43,9 +62,10 @@ class GitHubAuthenticator:
                     accept="application/vnd.github+json",
                     jwt=await self.get_jwt(),
                 )
-                self._id_dict[(owner, repo)] = result["id"]
+                installation_id = result["id"]
+                await self._ids.set(f"{owner}/{repo}", installation_id)
 
-        return self._id_dict[(owner, repo)]
+        return installation_id
 
     async def authenticate_installation(self, owner: str, repo: str) -> str:
         """
@@ -55,6 +75,10 @@ class GitHubAuthenticator:
         """
 
         installation_id = await self.get_installation_id(owner, repo)
+        return await self.get_installation_token(installation_id)
+
+    async def get_installation_token(self, installation_id: str) -> str:
+        """Get an installation access token for an installation id."""
 
         async def renew_installation_token():
             async with aiohttp.ClientSession() as session:
@@ -77,6 +101,38 @@ class GitHubAuthenticator:
 
         return await self._tokens.get(installation_id, renew_installation_token)
 
+    async def get_installed_repos(self) -> List[Dict]:
+        """
+        Return the repository data of every repository the app is installed
+        on, recording their installation ids along the way.
+        """
+        repos = []
+        async with aiohttp.ClientSession() as session:
+            gh = gh_aiohttp.GitHubAPI(session, self.requester)
+
+            installations = [
+                installation
+                async for installation in gh.getiter(
+                    "/app/installations",
+                    accept="application/vnd.github+json",
+                    jwt=await self.get_jwt(),
+                )
+            ]
+
+            for installation in installations:
+                installation_id = installation["id"]
+                token = await self.get_installation_token(installation_id)
+
+                async for repo in gh.getiter(
+                    "/installation/repositories",
+                    oauth_token=token,
+                    iterable_key="repositories",
+                ):
+                    await self._ids.set(repo["full_name"], installation_id)
+                    repos.append(repo)
+
+        return repos
+
     def parse_isotime(self, timestr: str) -> int:
         """Convert UTC ISO 8601 time stamp to seconds in epoch"""
         if timestr[-1] != "Z":
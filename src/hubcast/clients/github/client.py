@@ -1,9 +1,12 @@
-from urllib.parse import urlparse
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+from urllib.parse import quote, urlparse
 
 import aiohttp
 import yaml
 from gidgethub import aiohttp as gh_aiohttp
 
+from hubcast.clients import shadow
+
 from .auth import GitHubAuthenticator
 
 VALID_GH_REACTIONS = [
@@ -18,14 +21,100 @@ VALID_GH_REACTIONS = [
 ]
 
 
+# check statuses which complete a check run, the status becomes its conclusion
+CHECK_CONCLUSIONS = ("success", "failure", "cancelled", "skipped", "neutral")
+
+
+# GraphQL aliases per query, GitHub limits the nodes a query may request
+GRAPHQL_BATCH_SIZE = 100
+
+# the fields of a pull request Hubcast reads, see _rest_pr
+PR_FIELDS = """
+number
+headRefName
+headRefOid
+baseRefName
+headRepository { nameWithOwner url }
+baseRepository { nameWithOwner url }
+"""
+
+
 class InvalidConfigYAMLError(Exception):
     pass
 
 
+class RepoSnapshot(NamedTuple):
+    """Data of a repository read together in a GraphQL query."""
+
+    # the parsed .github/hubcast.yml of the default branch, None if missing
+    config: Optional[Dict]
+    # pull request number -> data, GitHub fails the whole query when any of
+    # the pull requests doesn't exist
+    prs: Dict[int, Dict]
+    # branch name -> head sha, None for those which don't exist
+    branches: Dict[str, Optional[str]]
+    # data of every open pull request, if requested
+    open_prs: List[Dict]
+
+
+def _rest_repo(repo: Optional[Dict]) -> Optional[Dict]:
+    if repo is None:
+        return None
+    return {"full_name": repo["nameWithOwner"], "clone_url": f"{repo['url']}.git"}
+
+
+def _rest_pr(pr: Dict) -> Dict:
+    """Shape a GraphQL pull request like the REST API's, with only the fields
+    Hubcast uses."""
+    return {
+        "number": pr["number"],
+        "head": {
+            "ref": pr["headRefName"],
+            "sha": pr["headRefOid"],
+            "repo": _rest_repo(pr["headRepository"]),
+        },
+        "base": {"ref": pr["baseRefName"], "repo": _rest_repo(pr["baseRepository"])},
+    }
+
+
+def _check_payload(
+    ref: str,
+    check_name: str,
+    status: Optional[str],
+    details_url: str,
+    text: Optional[str] = None,
+) -> Dict:
+    gitlab_netloc = urlparse(details_url).netloc
+
+    # construct upload payload
+    payload = {
+        "name": check_name,
+        "head_sha": ref,
+        "details_url": details_url,
+        "output": {
+            "title": "External Pipeline Run",
+            "summary": f"[View this pipeline on {gitlab_netloc}]({details_url})",
+        },
+    }
+    if text:
+        payload["output"]["text"] = text
+
+    # for success and failure status write out a conclusion
+    if status in CHECK_CONCLUSIONS:
+        payload["status"] = "completed"
+        payload["conclusion"] = status
+    elif status is not None:
+        payload["status"] = status
+
+    return payload
+
+
 class GitHubClientFactory:
-    def __init__(self, app_id, privkey, requester, bot_user):
+    def __init__(
+        self, app_id, privkey, requester, bot_user, cache=None, cache_ttl=None
+    ):
         self.requester = requester
-        self.auth = GitHubAuthenticator(requester, privkey, app_id)
+        self.auth = GitHubAuthenticator(requester, privkey, app_id, cache, cache_ttl)
         self.bot_user = bot_user
 
     def create_client(self, repo_owner, repo_name):
@@ -33,6 +122,10 @@ class GitHubClientFactory:
             self.auth, self.requester, repo_owner, repo_name, self.bot_user
         )
 
+    async def get_installed_repos(self):
+        """Return the data of every repository the app is installed on."""
+        return await self.auth.get_installed_repos()
+
 
 class GitHubClient:
     def __init__(self, auth, requester, repo_owner, repo_name, bot_user):
@@ -43,28 +136,23 @@ class GitHubClient:
         self.bot_user = bot_user
 
     async def set_check_status(
-        self, ref: str, check_name: str, status: str, details_url: str
+        self,
+        ref: str,
+        check_name: str,
+        status: str,
+        details_url: str,
+        text: Optional[str] = None,
     ):
-        gitlab_netloc = urlparse(details_url).netloc
-
-        # construct upload payload
-        payload = {
-            "name": check_name,
-            "head_sha": ref,
-            "details_url": details_url,
-            "output": {
-                "title": "External Pipeline Run",
-                "summary": f"[View this pipeline on {gitlab_netloc}]({details_url})",
-            },
-        }
-
-        # for success and failure status write out a conclusion
-        if status in ("success", "failure", "cancelled"):
-            payload["status"] = "completed"
-            payload["conclusion"] = status
-        else:
-            payload["status"] = status
+        await self.set_check_statuses(ref, [(check_name, status, details_url, text)])
 
+    async def set_check_statuses(
+        self, ref: str, checks: List[Tuple[str, str, str, Optional[str]]]
+    ):
+        """
+        Create or update several check runs of a commit, given as (name,
+        status, details url, output text) tuples, listing the commit's check
+        runs only once.
+        """
         gh_token = await self.auth.authenticate_installation(
             self.repo_owner, self.repo_name
         )
@@ -72,25 +160,217 @@ class GitHubClient:
         async with aiohttp.ClientSession() as session:
             gh = gh_aiohttp.GitHubAPI(session, self.requester, oauth_token=gh_token)
 
-            # get a list of the checks on a commit
-            url = f"/repos/{self.repo_owner}/{self.repo_name}/commits/{ref}/check-runs"
+            # get a list of the checks on a commit, the most recent check run
+            # of each name comes first
+            url = f"/repos/{self.repo_owner}/{self.repo_name}/commits/{ref}/check-runs?per_page=100"
+            if len(checks) == 1:
+                url += f"&check_name={quote(checks[0][0])}"
+            existing_checks = {}
+            async for check in gh.getiter(url, iterable_key="check_runs"):
+                existing_checks.setdefault(check["name"], check)
+
+            for check_name, status, details_url, text in checks:
+                payload = _check_payload(ref, check_name, status, details_url, text)
+                existing_check = existing_checks.get(check_name)
+
+                # create a new check if no previous check is found, or if the previous
+                # existing check was marked as completed. (This allows to check re-runs.)
+                create = (
+                    existing_check is None or existing_check["status"] == "completed"
+                )
+                if shadow.recorder is not None:
+                    await shadow.recorder.record(
+                        "set_check_status",
+                        repo=f"{self.repo_owner}/{self.repo_name}",
+                        ref=ref,
+                        check=check_name,
+                        status=status,
+                        action="create" if create else "update",
+                    )
+                elif create:
+                    url = f"/repos/{self.repo_owner}/{self.repo_name}/check-runs"
+                    await gh.post(url, data=payload)
+                else:
+                    url = f"/repos/{self.repo_owner}/{self.repo_name}/check-runs/{existing_check['id']}"
+                    await gh.patch(url, data=payload)
+
+    async def set_check_output(
+        self, ref: str, check_name: str, details_url: str, text: str
+    ) -> bool:
+        """
+        Replace the output text of the latest check run with a name, leaving
+        its status alone. Returns False if the commit has no such check run.
+        """
+        gh_token = await self.auth.authenticate_installation(
+            self.repo_owner, self.repo_name
+        )
+
+        async with aiohttp.ClientSession() as session:
+            gh = gh_aiohttp.GitHubAPI(session, self.requester, oauth_token=gh_token)
+
+            url = f"/repos/{self.repo_owner}/{self.repo_name}/commits/{ref}/check-runs?check_name={quote(check_name)}"
             data = await gh.getitem(url)
+            if not data["check_runs"]:
+                return False
+
+            check = data["check_runs"][0]
+            if shadow.recorder is not None:
+                await shadow.recorder.record(
+                    "set_check_output",
+                    repo=f"{self.repo_owner}/{self.repo_name}",
+                    ref=ref,
+                    check=check_name,
+                )
+                return True
+
+            payload = _check_payload(ref, check_name, None, details_url, text)
+            url = f"/repos/{self.repo_owner}/{self.repo_name}/check-runs/{check['id']}"
+            await gh.patch(url, data={"output": payload["output"]})
+            return True
+
+    async def fail_check(self, ref: str, check_name: str, title: str, summary: str):
+        """
+        Complete a new check run of a commit as failed without a pipeline
+        behind it, explaining why in its output.
+        """
+        if shadow.recorder is not None:
+            await shadow.recorder.record(
+                "fail_check",
+                repo=f"{self.repo_owner}/{self.repo_name}",
+                ref=ref,
+                check=check_name,
+                title=title,
+            )
+            return
+
+        gh_token = await self.auth.authenticate_installation(
+            self.repo_owner, self.repo_name
+        )
+
+        async with aiohttp.ClientSession() as session:
+            gh = gh_aiohttp.GitHubAPI(session, self.requester, oauth_token=gh_token)
+
+            url = f"/repos/{self.repo_owner}/{self.repo_name}/check-runs"
+            await gh.post(
+                url,
+                data={
+                    "name": check_name,
+                    "head_sha": ref,
+                    "status": "completed",
+                    "conclusion": "failure",
+                    "output": {"title": title, "summary": summary},
+                },
+            )
+
+    def _parse_config(self, config_str: str) -> Dict:
+        try:
+            return yaml.safe_load(config_str)
+        except yaml.YAMLError:
+            raise InvalidConfigYAMLError(
+                f"Failed to parse repo config. repo_owner={self.repo_owner} repo_name={self.repo_name}"
+            )
+
+    async def get_repo_snapshot(
+        self,
+        pr_numbers: Iterable[int] = (),
+        branches: Iterable[str] = (),
+        open_prs: bool = False,
+    ) -> RepoSnapshot:
+        """
+        Read the repo config, the given pull requests and branch heads, and
+        optionally every open pull request, with as few GraphQL queries as
+        possible: one, unless there are more than GRAPHQL_BATCH_SIZE pull
+        requests or branches.
+        """
+        gh_token = await self.auth.authenticate_installation(
+            self.repo_owner, self.repo_name
+        )
 
-            # search for existing check with GH_CHECK_NAME
-            existing_check = None
-            for check in data["check_runs"]:
-                if check["name"] == check_name:
-                    existing_check = check
-                    break
-
-            # create a new check if no previous check is found, or if the previous
-            # existing check was marked as completed. (This allows to check re-runs.)
-            if existing_check is None or existing_check["status"] == "completed":
-                url = f"/repos/{self.repo_owner}/{self.repo_name}/check-runs"
-                await gh.post(url, data=payload)
-            else:
-                url = f"/repos/{self.repo_owner}/{self.repo_name}/check-runs/{existing_check['id']}"
-                await gh.patch(url, data=payload)
+        # every pull request and branch is requested under its own alias
+        lookups = [("pr", n) for n in pr_numbers]
+        lookups += [("branch", f"refs/heads/{b}") for b in branches]
+        batches = [
+            lookups[i : i + GRAPHQL_BATCH_SIZE]
+            for i in range(0, len(lookups), GRAPHQL_BATCH_SIZE)
+        ] or [[]]
+
+        snapshot = RepoSnapshot(None, {}, {}, [])
+        async with aiohttp.ClientSession() as session:
+            gh = gh_aiohttp.GitHubAPI(session, self.requester, oauth_token=gh_token)
+
+            for i, batch in enumerate(batches):
+                first = i == 0
+                variables = {"owner": self.repo_owner, "name": self.repo_name}
+                params = ["$owner: String!", "$name: String!"]
+                fields = []
+                for j, (kind, value) in enumerate(batch):
+                    variables[f"v{j}"] = value
+                    if kind == "pr":
+                        params.append(f"$v{j}: Int!")
+                        fields.append(f"a{j}: pullRequest(number: $v{j}) {{ ...pr }}")
+                    else:
+                        params.append(f"$v{j}: String!")
+                        fields.append(
+                            f"a{j}: ref(qualifiedName: $v{j}) {{ target {{ oid }} }}"
+                        )
+                if first:
+                    fields.append(
+                        'config: object(expression: "HEAD:.github/hubcast.yml")'
+                        " { ... on Blob { text } }"
+                    )
+                if first and open_prs:
+                    fields.append(
+                        "open: pullRequests(states: OPEN, first: 100)"
+                        " { nodes { ...pr } pageInfo { hasNextPage endCursor } }"
+                    )
+
+                query = (
+                    f"query({', '.join(params)}) {{"
+                    f" repository(owner: $owner, name: $name) {{ {' '.join(fields)} }}"
+                    " }"
+                )
+                # GitHub refuses queries declaring fragments they don't use
+                if "...pr" in query:
+                    query += f" fragment pr on PullRequest {{ {PR_FIELDS} }}"
+                data = (await gh.graphql(query, **variables))["repository"]
+
+                for j, (kind, value) in enumerate(batch):
+                    node = data[f"a{j}"]
+                    if kind == "pr":
+                        snapshot.prs[value] = _rest_pr(node)
+                    else:
+                        name = value.removeprefix("refs/heads/")
+                        snapshot.branches[name] = (
+                            node["target"]["oid"] if node else None
+                        )
+
+                if first and data["config"] is not None:
+                    snapshot = snapshot._replace(
+                        config=self._parse_config(data["config"]["text"])
+                    )
+                if first and open_prs:
+                    page = data["open"]
+                    snapshot.open_prs.extend(_rest_pr(pr) for pr in page["nodes"])
+
+            # further pages of open pull requests, rarely needed
+            while open_prs and page["pageInfo"]["hasNextPage"]:
+                query = (
+                    "query($owner: String!, $name: String!, $after: String!) {"
+                    " repository(owner: $owner, name: $name) {"
+                    " open: pullRequests(states: OPEN, first: 100, after: $after)"
+                    " { nodes { ...pr } pageInfo { hasNextPage endCursor } } } }"
+                    f" fragment pr on PullRequest {{ {PR_FIELDS} }}"
+                )
+                data = await gh.graphql(
+                    query,
+                    owner=self.repo_owner,
+                    name=self.repo_name,
+                    after=page["pageInfo"]["endCursor"],
+                )
+                page = data["repository"]["open"]
+                snapshot.open_prs.extend(_rest_pr(pr) for pr in page["nodes"])
+
+        return snapshot
 
     async def get_repo_config(self):
         gh_token = await self.auth.authenticate_installation(
@@ -104,15 +384,7 @@ class GitHubClient:
             url = f"/repos/{self.repo_owner}/{self.repo_name}/contents/.github/hubcast.yml"
             # get raw contents rather than base64 encoded text
             config_str = await gh.getitem(url, accept="application/vnd.github.raw")
-
-            try:
-                config = yaml.safe_load(config_str)
-            except yaml.YAMLError:
-                raise InvalidConfigYAMLError(
-                    f"Failed to parse repo config. repo_owner={self.repo_owner} repo_name={self.repo_name}"
-                )
-
-            return config
+            return self._parse_config(config_str)
 
     async def get_pr(self, id):
         """Return individual PR data."""
@@ -145,7 +417,28 @@ class GitHubClient:
                 prs_res = await gh.getitem(url)
                 return [pr["number"] for pr in prs_res]
 
+    async def get_open_prs(self):
+        """Return the data of every open PR."""
+        gh_token = await self.auth.authenticate_installation(
+            self.repo_owner, self.repo_name
+        )
+
+        async with aiohttp.ClientSession() as session:
+            gh = gh_aiohttp.GitHubAPI(session, self.requester, oauth_token=gh_token)
+
+            url = f"/repos/{self.repo_owner}/{self.repo_name}/pulls?state=open&per_page=100"
+            return [pr async for pr in gh.getiter(url)]
+
     async def post_comment(self, issue_number: int, body: str):
+        if shadow.recorder is not None:
+            await shadow.recorder.record(
+                "post_comment",
+                repo=f"{self.repo_owner}/{self.repo_name}",
+                issue=issue_number,
+                body=body,
+            )
+            return
+
         payload = {"body": body}
 
         gh_token = await self.auth.authenticate_installation(
@@ -166,6 +459,15 @@ class GitHubClient:
         if reaction not in VALID_GH_REACTIONS:
             raise ValueError(f"{reaction} is not a valid reaction")
 
+        if shadow.recorder is not None:
+            await shadow.recorder.record(
+                "react_to_comment",
+                repo=f"{self.repo_owner}/{self.repo_name}",
+                comment=comment_id,
+                reaction=reaction,
+            )
+            return
+
         payload = {"content": reaction}
 
         gh_token = await self.auth.authenticate_installation(
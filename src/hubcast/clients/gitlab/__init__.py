@@ -1,3 +1,15 @@
-from .client import GitLabClient, GitLabClientFactory
+from .client import (
+    GitLabClient,
+    GitLabClientFactory,
+    GitLabClients,
+    GitLabInstances,
+    UnknownInstanceError,
+)
 
-__all__ = ["GitLabClient", "GitLabClientFactory"]
+__all__ = [
+    "GitLabClient",
+    "GitLabClientFactory",
+    "GitLabClients",
+    "GitLabInstances",
+    "UnknownInstanceError",
+]
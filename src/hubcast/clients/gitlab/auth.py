@@ -1,9 +1,10 @@
 from datetime import datetime, timedelta, timezone
-from typing import Tuple
+from typing import Any, Dict, Optional, Tuple
 
 import aiohttp
 import gidgetlab.aiohttp
 
+from hubcast.cache.abc import CacheBackend
 from hubcast.clients.utils import TokenCache
 
 TOKEN_NAME = "hubcast-impersonation"  # nosec B105
@@ -24,13 +25,25 @@ class GitLabAuthenticator:
         A string identifying who is responsible for the requests.
     admin_token: str
         A personal access token with `api` scope and created by an administrator.
+    cache: CacheBackend
+        Where impersonation tokens are cached, in-process by default.
     """
 
-    def __init__(self, instance_url: str, requester: str, admin_token: str):
+    def __init__(
+        self,
+        instance_url: str,
+        requester: str,
+        admin_token: str,
+        cache: Optional[CacheBackend] = None,
+    ):
         self.instance_url = instance_url
         self.requester = requester
         self.admin_token = admin_token
-        self._tokens = TokenCache()
+        self._tokens = TokenCache(f"gitlab_tokens:{instance_url}", cache)
+
+    def caches(self) -> Dict[str, Any]:
+        """The caches kept by the authenticator, by name."""
+        return {"gitlab_tokens": self._tokens}
 
     async def authenticate_user(
         self,
@@ -120,6 +133,10 @@ class GitLabSingleUserAuthenticator:
     def __init__(self, access_token: str):
         self.access_token = access_token
 
+    def caches(self) -> Dict[str, Any]:
+        """The caches kept by the authenticator, by name."""
+        return {}
+
     async def authenticate_user(self, username: str, *args, **kwargs) -> str:
         """Returns the pre-configured token. Keeps the same signature as GitLabAuthenticator for compatibility."""
         return self.access_token
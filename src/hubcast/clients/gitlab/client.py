@@ -1,12 +1,20 @@
 import urllib.parse
-from typing import Dict
+from typing import Any, Dict, Iterable, MutableMapping, Optional
 
 import aiohttp
 import gidgetlab.aiohttp
 
+from hubcast.cache.abc import CacheBackend
+from hubcast.clients import shadow
+from hubcast.config import DEFAULT_INSTANCE
+
 from .auth import GitLabAuthenticator, GitLabSingleUserAuthenticator
 
 
+class UnknownInstanceError(Exception):
+    pass
+
+
 class GitLabClientFactory:
     def __init__(
         self,
@@ -16,13 +24,16 @@ class GitLabClientFactory:
         callback_url: str,
         webhook_secret: str,
         token_type: str = "impersonation",  # nosec B107
+        cache: Optional[CacheBackend] = None,
+        name: str = DEFAULT_INSTANCE,
     ):
+        self.name = name
         self.requester = requester
 
         if token_type == "single":  # nosec B105
             self.auth = GitLabSingleUserAuthenticator(token)
         elif token_type == "impersonation":  # nosec B105
-            self.auth = GitLabAuthenticator(instance_url, requester, token)
+            self.auth = GitLabAuthenticator(instance_url, requester, token, cache)
         else:
             raise ValueError(f"Unknown GitLab token type: {token_type}")
 
@@ -38,9 +49,72 @@ class GitLabClientFactory:
             self.callback_url,
             self.webhook_secret,
             user,
+            self.name,
         )
 
 
+class GitLabInstances:
+    """
+    The client factories of every GitLab instance destinations may be on,
+    by instance name.
+
+    Attributes
+    ----------
+    factories: Dict[str, GitLabClientFactory]
+        The factory of each instance, including the default one.
+    """
+
+    def __init__(self, factories: Dict[str, GitLabClientFactory]):
+        self.factories = factories
+
+    def __getitem__(self, name: str) -> GitLabClientFactory:
+        try:
+            return self.factories[name]
+        except KeyError:
+            raise UnknownInstanceError(f"Unknown GitLab instance: {name}")
+
+    @property
+    def default(self) -> GitLabClientFactory:
+        return self.factories[DEFAULT_INSTANCE]
+
+    def create_client(self, user: str) -> "GitLabClients":
+        """creates the clients of every instance for a specific user"""
+        return GitLabClients(self, user)
+
+    def caches(self) -> Dict[str, Any]:
+        """The caches kept by the authenticators of every instance, by name."""
+        caches = {}
+        for name, factory in self.factories.items():
+            for cache_name, cache in factory.auth.caches().items():
+                if name != DEFAULT_INSTANCE:
+                    cache_name = f"{cache_name}:{name}"
+                caches[cache_name] = cache
+        return caches
+
+
+class GitLabClients:
+    """
+    A GitLab user's clients of every instance, created as they're needed.
+    The user has the same name on every instance.
+    """
+
+    def __init__(self, instances: GitLabInstances, user: str):
+        self.instances = instances
+        self.user = user
+        self._clients: Dict[str, "GitLabClient"] = {}
+
+    def instance(self, name: str) -> "GitLabClient":
+        """Return the client of an instance, raising UnknownInstanceError."""
+        client = self._clients.get(name)
+        if client is None:
+            client = self._clients[name] = self.instances[name].create_client(self.user)
+        return client
+
+    def for_dest(self, dest) -> "GitLabClient":
+        """Return the client of the instance a Destination is on."""
+        return self.instance(dest.instance)
+
+
 class GitLabClient:
     def __init__(
         self,
@@ -49,14 +123,21 @@ class GitLabClient:
         callback_url: str,
         webhook_secret: str,
         user: str,
+        instance: str = DEFAULT_INSTANCE,
     ):
         self.auth = auth
         self.instance_url = instance_url
         self.callback_url = callback_url
         self.webhook_secret = webhook_secret
         self.user = user
+        self.instance = instance
 
     async def set_webhook(self, gl_fullname: str, data: Dict):
+        # hooks of other instances say where they come from, so they're
+        # checked against that instance's secret
+        if self.instance != DEFAULT_INSTANCE:
+            data = {**data, "gl_instance": self.instance}
+
         gl_token = await self.auth.authenticate_user(username=self.user)
 
         new_hook = {
@@ -90,6 +171,11 @@ class GitLabClient:
 
             # if no existing hook is found add one and exit
             if not existing_hook:
+                if shadow.recorder is not None:
+                    await shadow.recorder.record(
+                        "set_webhook", project=gl_fullname, action="create"
+                    )
+                    return
                 await gl.post(url, data=new_hook)
                 return
 
@@ -103,6 +189,11 @@ class GitLabClient:
                     break
 
             if changed:
+                if shadow.recorder is not None:
+                    await shadow.recorder.record(
+                        "set_webhook", project=gl_fullname, action="update"
+                    )
+                    return
                 url = f"/projects/{repo_id}/hooks/{existing_hook['id']}"
                 await gl.put(url, data=new_hook)
 
@@ -130,11 +221,20 @@ class GitLabClient:
 
             return pipeline.get("id")
 
-    async def run_pipeline(self, gl_fullname: str, ref: str) -> str:
+    async def run_pipeline(self, gl_fullname: str, ref: str) -> Dict:
         """(re)-run a pipeline from an arbitrary GitLab repository and branch.
         Returns:
-            the new pipeline's url
+            the new pipeline
         """
+        if shadow.recorder is not None:
+            await shadow.recorder.record("run_pipeline", project=gl_fullname, ref=ref)
+            # reported as skipped, so nobody waits on a pipeline that won't run
+            return {
+                "id": None,
+                "sha": None,
+                "status": "skipped",
+                "web_url": f"{self.instance_url}/{gl_fullname}/-/pipelines",
+            }
 
         gl_token = await self.auth.authenticate_user(self.user)
 
@@ -148,9 +248,7 @@ class GitLabClient:
 
             repo_id = urllib.parse.quote_plus(gl_fullname)
 
-            pipeline = await gl.post(f"/projects/{repo_id}/pipeline?ref={ref}", data={})
-
-            return pipeline.get("web_url")
+            return await gl.post(f"/projects/{repo_id}/pipeline?ref={ref}", data={})
 
     async def retry_pipeline_jobs(self, gl_fullname: str, pipeline_id: int) -> str:
         """retries any failed jobs in a pipeline. if there are no jobs that meet this criteria,
@@ -158,6 +256,11 @@ class GitLabClient:
         Returns:
             the pipeline's url
         """
+        if shadow.recorder is not None:
+            await shadow.recorder.record(
+                "retry_pipeline_jobs", project=gl_fullname, pipeline=pipeline_id
+            )
+            return f"{self.instance_url}/{gl_fullname}/-/pipelines/{pipeline_id}"
 
         gl_token = await self.auth.authenticate_user(self.user)
 
@@ -176,3 +279,42 @@ class GitLabClient:
             )
 
             return pipeline.get("web_url")
+
+    async def get_pipelines(
+        self,
+        gl_fullname: str,
+        pipeline_ids: Iterable[int],
+        cache: Optional[MutableMapping] = None,
+    ) -> Dict[int, Dict]:
+        """gets several pipelines of an arbitrary GitLab repository, with as few
+        requests as possible. With a cache, requests are conditional, so
+        pipelines which haven't changed since the last call cost GitLab a 304.
+        Returns:
+            the pipelines found, by id
+        """
+
+        gl_token = await self.auth.authenticate_user(self.user)
+
+        async with aiohttp.ClientSession() as session:
+            gl = gidgetlab.aiohttp.GitLabAPI(
+                session,
+                requester=self.user,
+                access_token=gl_token,
+                url=self.instance_url,
+                cache=cache,
+            )
+
+            repo_id = urllib.parse.quote_plus(gl_fullname)
+
+            # the latest pipelines of the project cover recent ones in a
+            # single request, the url is fixed so the response can be cached
+            wanted = set(pipeline_ids)
+            recent = await gl.getitem(f"/projects/{repo_id}/pipelines?per_page=100")
+            pipelines = {p["id"]: p for p in recent if p["id"] in wanted}
+
+            for pipeline_id in wanted - pipelines.keys():
+                pipelines[pipeline_id] = await gl.getitem(
+                    f"/projects/{repo_id}/pipelines/{pipeline_id}"
+                )
+
+            return pipelines
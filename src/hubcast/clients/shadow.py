@@ -0,0 +1,99 @@
+import asyncio
+import logging
+from typing import AsyncIterable, Dict, List, Optional, Union
+
+from hubcast import metrics
+from hubcast.clients.git.client import RefUpdate
+
+log = logging.getLogger(__name__)
+
+shadow_calls = metrics.counter(
+    "hubcast_shadow_calls_total",
+    "Side effects recorded instead of performed in shadow mode.",
+)
+shadow_seconds = metrics.counter(
+    "hubcast_shadow_seconds_total",
+    "Seconds spent simulating the side effects recorded in shadow mode.",
+)
+shadow_bytes = metrics.counter(
+    "hubcast_shadow_pack_bytes_total",
+    "Bytes of packs which would have been pushed in shadow mode.",
+)
+
+
+class ShadowRecorder:
+    """
+    Stands in for every call to GitHub, GitLab or git which would change
+    something, so an instance can handle real traffic alongside the one
+    serving it without mirroring or posting anything twice.
+
+    Reads are still made, so a shadow instance does the same work and takes
+    the same decisions as the real one up to its side effects. Those are
+    logged instead, and the call takes as long as it would have, `latency`
+    plus the time to upload its pack at `upload_rate`, so the throughput of
+    both can be compared.
+
+    Attributes
+    ----------
+    latency: float
+        Seconds each recorded call is simulated to take.
+    upload_rate: int
+        Bytes per second packs are simulated to upload at, 0 to ignore
+        their size.
+    """
+
+    def __init__(self, latency: float = 0.2, upload_rate: int = 0):
+        self.latency = latency
+        self.upload_rate = upload_rate
+
+    async def record(self, call: str, size: int = 0, **details) -> None:
+        """Record a call which was skipped, taking its simulated cost."""
+        seconds = self.latency
+        if self.upload_rate:
+            seconds += size / self.upload_rate
+
+        shadow_calls.inc(call=call)
+        shadow_seconds.inc(seconds, call=call)
+        log.info(
+            "Shadowed call",
+            extra={
+                "call": call,
+                "simulated_seconds": round(seconds, 3),
+                **({"bytes": size} if size else {}),
+                **details,
+            },
+        )
+        if seconds > 0:
+            await asyncio.sleep(seconds)
+
+    async def send_pack(
+        self,
+        url: str,
+        updates: List[RefUpdate],
+        packfile: Union[bytes, AsyncIterable[bytes]],
+        username: Optional[str] = None,
+        password: Optional[str] = None,
+    ) -> Dict[str, Optional[str]]:
+        """
+        Take the place of send_pack, reading the pack through but pushing
+        nothing and reporting every ref as updated.
+        """
+        if isinstance(packfile, bytes):
+            size = len(packfile)
+        else:
+            size = 0
+            async for chunk in packfile:
+                size += len(chunk)
+
+        shadow_bytes.inc(size)
+        await self.record(
+            "send_pack",
+            size,
+            dest=url,
+            updates=[f"{u.from_sha} {u.to_sha} {u.ref}" for u in updates],
+        )
+        return {u.ref: None for u in updates}
+
+
+# records side effects in place of making them when set on startup
+recorder: Optional[ShadowRecorder] = None
@@ -1,18 +1,138 @@
+import asyncio
+import json
+import logging
 import time
-from typing import Awaitable, Callable, Tuple
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from hubcast import metrics
+from hubcast.cache.abc import CacheBackend, CacheError
+from hubcast.cache.memory import MemoryBackend
+
+log = logging.getLogger(__name__)
+
+cache_errors = metrics.counter(
+    "hubcast_cache_errors_total",
+    "Cache operations which failed because the cache backend was unavailable.",
+)
+
+
+class CacheStats:
+    """
+    Hit and miss counts of a cache.
+    """
+
+    def __init__(self) -> None:
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, hit: bool) -> None:
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    @property
+    def hit_rate(self) -> Optional[float]:
+        lookups = self.hits + self.misses
+        if not lookups:
+            return None
+        return self.hits / lookups
+
+
+class LookupCache:
+    """
+    Cache for values which don't change once looked up, such as ids.
+
+    Values are stored as JSON in a CacheBackend, in-process by default, or
+    shared by every replica using the same backend. When the backend can't
+    be reached lookups miss and values aren't stored, so callers fall back
+    to looking them up again.
+
+    Attributes
+    ----------
+    namespace: str
+        Prepended to the keys of this cache in the backend.
+    backend: CacheBackend
+        Where values are stored.
+    ttl: float
+        Seconds values are kept for, or None to keep them until invalidated.
+    """
+
+    def __init__(
+        self,
+        namespace: str,
+        backend: Optional[CacheBackend] = None,
+        ttl: Optional[float] = None,
+    ) -> None:
+        self.namespace = namespace
+        self.backend = backend or MemoryBackend()
+        self.ttl = ttl
+        self.stats = CacheStats()
+
+    async def size(self) -> int:
+        """Return the number of cached values."""
+        try:
+            return await self.backend.count(f"{self.namespace}:")
+        except CacheError as exc:
+            _cache_failed(self.namespace, exc)
+            return 0
+
+    async def get(self, key: Hashable) -> Optional[Any]:
+        """Get a cached value, or None if it hasn't been cached."""
+        value = await _get(self.backend, self.namespace, key)
+        self.stats.record(value is not None)
+        return value
+
+    async def set(self, key: Hashable, value: Any) -> None:
+        await _set(self.backend, self.namespace, key, value, self.ttl)
+
+    async def invalidate(self, key: str) -> bool:
+        """Remove a value, returning False if it wasn't cached."""
+        return await _delete(self.backend, self.namespace, key)
 
 
 class TokenCache:
     """
     Cache for web tokens with an expiration.
+
+    Tokens are stored in a CacheBackend like LookupCache values, expiring
+    from it along with the token. Renewals are shared by everyone needing
+    the same token in this process, replicas sharing a backend pick up each
+    other's tokens once they're stored.
+
+    Attributes
+    ----------
+    namespace: str
+        Prepended to the keys of this cache in the backend.
+    backend: CacheBackend
+        Where tokens are stored.
     """
 
-    def __init__(self) -> None:
-        self._tokens = {}
+    def __init__(self, namespace: str, backend: Optional[CacheBackend] = None) -> None:
+        self.namespace = namespace
+        self.backend = backend or MemoryBackend()
+        # renewals in progress, shared by everyone needing the same token
+        self._renewals: Dict[str, asyncio.Future] = {}
+        self.stats = CacheStats()
+
+    async def size(self) -> int:
+        """Return the number of cached tokens."""
+        try:
+            return await self.backend.count(f"{self.namespace}:")
+        except CacheError as exc:
+            _cache_failed(self.namespace, exc)
+            return 0
+
+    async def invalidate(self, name: str) -> bool:
+        """
+        Remove a token so it's renewed the next time it's needed, returning
+        False if it wasn't cached.
+        """
+        return await _delete(self.backend, self.namespace, name)
 
     async def get(
         self,
-        name: str,
+        name: Hashable,
         renew: Callable[[], Awaitable[Tuple[float, str]]],
         time_needed: int = 60,
     ) -> str:
@@ -21,8 +141,9 @@ class TokenCache:
 
         Parameters
         ---------
-        name: str
-            An identifying name of a token to get from the cache.
+        name: Hashable
+            An identifying name of a token to get from the cache, installation
+            ids are ints.
         renew: Callable[[], Awaitable[Tuple[float, str]]]
             A function to call in order to generate a new token if the cache
             is stale.
@@ -30,11 +151,65 @@ class TokenCache:
             The number of seconds a token will be needed. Thus any token that
             expires during this window should be disregarded and renewed.
         """
-        expires, token = self._tokens.get(name, (0, ""))
+        expires, token = await _get(self.backend, self.namespace, name) or (0, "")
 
         now = time.time()
-        if expires < now + time_needed:
-            expires, token = await renew()
-            self._tokens[name] = (expires, token)
+        stale = expires < now + time_needed
+        self.stats.record(not stale)
+        if stale:
+            # names are stored as strings, 1 and "1" are the same token
+            key = str(name)
+            renewal = self._renewals.get(key)
+            if renewal is None:
+                renewal = asyncio.ensure_future(self._renew(name, renew))
+                self._renewals[key] = renewal
+                renewal.add_done_callback(lambda _: self._renewals.pop(key, None))
+
+            # a caller being cancelled mustn't cancel the renewal for the others
+            token = await asyncio.shield(renewal)
 
         return token
+
+    async def _renew(
+        self, name: Hashable, renew: Callable[[], Awaitable[Tuple[float, str]]]
+    ) -> str:
+        expires, token = await renew()
+        ttl = expires - time.time()
+        if ttl > 0:
+            await _set(self.backend, self.namespace, name, [expires, token], ttl)
+        return token
+
+
+def _cache_failed(namespace: str, exc: CacheError) -> None:
+    log.warning("Cache unavailable", extra={"cache": namespace, "error": str(exc)})
+    cache_errors.inc(cache=namespace)
+
+
+async def _get(backend: CacheBackend, namespace: str, key: Hashable) -> Any:
+    try:
+        value = await backend.get(f"{namespace}:{key}")
+    except CacheError as exc:
+        _cache_failed(namespace, exc)
+        return None
+    return json.loads(value) if value is not None else None
+
+
+async def _set(
+    backend: CacheBackend,
+    namespace: str,
+    key: Hashable,
+    value: Any,
+    ttl: Optional[float],
+) -> None:
+    try:
+        await backend.set(f"{namespace}:{key}", json.dumps(value, default=str), ttl)
+    except CacheError as exc:
+        _cache_failed(namespace, exc)
+
+
+async def _delete(backend: CacheBackend, namespace: str, key: Hashable) -> bool:
+    try:
+        return await backend.delete(f"{namespace}:{key}")
+    except CacheError as exc:
+        _cache_failed(namespace, exc)
+        return False
@@ -1,5 +1,18 @@
 import os
-from typing import Optional
+import re
+import shlex
+from typing import Dict, Optional
+
+# values read from the config file, taking precedence over the environment
+# while a Config is being built by load_config
+_file_values: Dict[str, str] = {}
+
+# multipliers of the suffixes parse_size accepts
+SIZE_UNITS = {"": 1, "k": 1 << 10, "m": 1 << 20, "g": 1 << 30, "t": 1 << 40}
+
+# the name of the GitLab instance configured by the HC_GL_ settings, which
+# destinations naming no instance are mirrored to
+DEFAULT_INSTANCE = "default"
 
 
 class ConfigError(Exception):
@@ -13,9 +26,135 @@ class Config:
         self.account_map_type = env_get("HC_ACCOUNT_MAP_TYPE")
         self.account_map_path = env_get("HC_ACCOUNT_MAP_PATH")
         self.logging_config_path = env_get("HC_LOGGING_CONFIG_PATH")
+        # hand log records to a listener thread instead of writing them
+        # from the event loop
+        self.logging_async = env_get_bool("HC_LOGGING_ASYNC", default=False)
+        self.logging_queue_size = int(env_get("HC_LOGGING_QUEUE_SIZE", default="10000"))
+
+        # how many webhook deliveries to remember, and for how long (seconds),
+        # when dropping duplicate deliveries
+        self.dedup_size = int(env_get("HC_DEDUP_SIZE", default="50000"))
+        self.dedup_ttl = int(env_get("HC_DEDUP_TTL", default="86400"))
+
+        # ref updates arriving within batch_window seconds of each other are
+        # pushed in one receive-pack, up to batch_size updates at once
+        self.batch_window = float(env_get("HC_BATCH_WINDOW", default="0.05"))
+        self.batch_size = int(env_get("HC_BATCH_SIZE", default="100"))
+
+        # bytes of packs going to several destinations which may be held in
+        # memory at once, packs over pack_spill_threshold bytes are written
+        # to temporary files in pack_spill_dir instead
+        self.pack_memory_limit = int(
+            env_get("HC_PACK_MEMORY_LIMIT", default=str(512 << 20))
+        )
+        self.pack_spill_threshold = int(
+            env_get("HC_PACK_SPILL_THRESHOLD", default=str(64 << 20))
+        )
+        self.pack_spill_dir = env_get_optional("HC_PACK_SPILL_DIR")
+
+        # bytes a pack mirrored from a repository may have, unless its
+        # .github/hubcast.yml sets its own max_pack_size, 0 for no limit
+        self.max_pack_size = parse_size(env_get("HC_MAX_PACK_SIZE", default="0"))
+
+        # mirror operations allowed to run at once, across webhook events
+        # and reconciliation
+        self.mirror_concurrency = int(env_get("HC_MIRROR_CONCURRENCY", default="16"))
+
+        # periodic reconciliation of GitHub and GitLab refs, disabled when the
+        # interval (seconds) is 0
+        self.reconcile_interval = int(env_get("HC_RECONCILE_INTERVAL", default="0"))
+        self.reconcile_jitter = int(env_get("HC_RECONCILE_JITTER", default="60"))
+        self.reconcile_concurrency = int(
+            env_get("HC_RECONCILE_CONCURRENCY", default="4")
+        )
+        # the GitLab user reconciliation pushes as
+        self.reconcile_user = env_get_optional("HC_RECONCILE_USER")
+
+        # periodic deletion of destination branches no longer on GitHub,
+        # disabled when the interval (seconds) is 0
+        self.prune_interval = int(env_get("HC_PRUNE_INTERVAL", default="0"))
+        self.prune_batch_size = int(env_get("HC_PRUNE_BATCH_SIZE", default="50"))
+        self.prune_batch_delay = float(env_get("HC_PRUNE_BATCH_DELAY", default="1"))
+        # only reporting what would be deleted unless turned off
+        self.prune_dry_run = env_get_bool("HC_PRUNE_DRY_RUN", default=True)
+
+        # polling of unfinished pipelines in case their webhooks are lost,
+        # disabled when the minimum interval (seconds) is 0
+        self.pipeline_poll_min = float(env_get("HC_PIPELINE_POLL_MIN", default="15"))
+        self.pipeline_poll_max = float(env_get("HC_PIPELINE_POLL_MAX", default="300"))
+        self.pipeline_poll_max_age = float(
+            env_get("HC_PIPELINE_POLL_MAX_AGE", default="86400")
+        )
+
+        # how GitLab job statuses are shown on GitHub: "off", "summary" (a
+        # table in the pipeline's check) or "checks" (a check run per job, up
+        # to max_checks per pipeline), updates within the window (seconds)
+        # are sent together
+        self.job_status_mode = env_get("HC_JOB_STATUS", default="off")
+        self.job_status_window = float(env_get("HC_JOB_STATUS_WINDOW", default="2"))
+        self.job_status_max_checks = int(
+            env_get("HC_JOB_STATUS_MAX_CHECKS", default="20")
+        )
+
+        # on SIGTERM, seconds to keep accepting connections after reporting
+        # not-ready, then seconds to wait for running jobs to finish
+        self.drain_delay = float(env_get("HC_DRAIN_DELAY", default="5"))
+        self.drain_timeout = float(env_get("HC_DRAIN_TIMEOUT", default="30"))
+        # where jobs unfinished at shutdown are saved for the next instance
+        self.checkpoint_path = env_get_optional("HC_CHECKPOINT_PATH")
+
+        # webhook jobs running at once, and per repository unless it has a
+        # weight in repo_weights, given as "owner/repo=jobs,..."
+        self.job_concurrency = int(env_get("HC_JOB_CONCURRENCY", default="100"))
+        self.repo_concurrency = int(env_get("HC_REPO_CONCURRENCY", default="4"))
+        self.repo_weights = env_get_weights("HC_REPO_WEIGHTS")
+
+        # where tokens, installation ids and repo configs are cached: "memory"
+        # for this process only, "sqlite" for a database file at cache_path or
+        # "redis" for a Redis protocol server at cache_url, shared by the
+        # replicas using them. Keys start with cache_prefix, installation ids
+        # and repo configs are kept for cache_ttl seconds, 0 keeps them until
+        # invalidated.
+        self.cache_backend = env_get("HC_CACHE_BACKEND", default="memory")
+        self.cache_path = env_get_optional("HC_CACHE_PATH")
+        self.cache_url = env_get_optional("HC_CACHE_URL")
+        self.cache_prefix = env_get("HC_CACHE_PREFIX", default="hubcast:")
+        self.cache_ttl = float(env_get("HC_CACHE_TTL", default="0"))
+
+        # seconds a replica's lock on a destination ref lasts in a shared
+        # cache backend unless renewed, 0 only locks refs within a process
+        self.ref_lock_lease = float(env_get("HC_REF_LOCK_LEASE", default="30"))
+
+        # seconds the event loop may be blocked before the stack blocking it
+        # is logged, 0 disables the loop lag monitor
+        self.loop_lag_threshold = float(env_get("HC_LOOP_LAG_THRESHOLD", default="0.5"))
+        # where profiling sessions started by SIGUSR1 or /admin/profile write
+        # their results, and how long they run by default
+        self.profile_dir = env_get_optional("HC_PROFILE_DIR")
+        self.profile_seconds = float(env_get("HC_PROFILE_SECONDS", default="30"))
+        # commits followed from their GitHub event to their check at once,
+        # and seconds each is followed for
+        self.latency_size = int(env_get("HC_LATENCY_SIZE", default="10000"))
+        self.latency_ttl = float(env_get("HC_LATENCY_TTL", default="3600"))
+
+        # shadow mode handles events as usual but only logs the pushes,
+        # checks, comments, webhooks and pipelines it would have made, each
+        # taking shadow_latency seconds plus the time to upload its pack at
+        # shadow_upload_rate bytes per second, 0 to ignore pack sizes
+        self.shadow = env_get_bool("HC_SHADOW", default=False)
+        self.shadow_latency = float(env_get("HC_SHADOW_LATENCY", default="0.2"))
+        self.shadow_upload_rate = parse_size(
+            env_get("HC_SHADOW_UPLOAD_RATE", default="0")
+        )
+
+        # bearer token for the /admin endpoints, which are disabled when unset
+        self.admin_token = env_get_optional("HC_ADMIN_TOKEN")
 
         self.gh = GitHubConfig()
         self.gl = GitLabConfig()
+        # every GitLab instance destinations may be on by name, the default
+        # one and those listed in HC_GL_INSTANCES
+        self.gl_instances = gitlab_instances(self.gl)
 
 
 class GitHubConfig:
@@ -28,20 +167,147 @@ class GitHubConfig:
 
 
 class GitLabConfig:
-    def __init__(self):
-        self.instance_url = env_get("HC_GL_URL")
+    def __init__(
+        self, prefix: str = "HC_GL_", defaults: Optional["GitLabConfig"] = None
+    ):
+        self.instance_url = env_get(f"{prefix}URL")
         # requester identifies the app making requests, it doesn't
         # perform any auth function but is included in user-agent
-        self.requester = env_get("HC_GL_REQUESTER")
-        self.token = env_get("HC_GL_TOKEN")
-        self.token_type = env_get("HC_GL_TOKEN_TYPE", default="impersonation")
-        self.webhook_secret = env_get("HC_GL_SECRET")
-        self.callback_url = env_get("HC_GL_CALLBACK_URL")
+        self.requester = env_get(
+            f"{prefix}REQUESTER", default=defaults.requester if defaults else None
+        )
+        self.token = env_get(f"{prefix}TOKEN")
+        self.token_type = env_get(
+            f"{prefix}TOKEN_TYPE",
+            default=defaults.token_type if defaults else "impersonation",
+        )
+        self.webhook_secret = env_get(f"{prefix}SECRET")
+        self.callback_url = env_get(
+            f"{prefix}CALLBACK_URL",
+            default=defaults.callback_url if defaults else None,
+        )
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, GitLabConfig) and vars(self) == vars(other)
+
+
+def gitlab_instances(default: GitLabConfig) -> Dict[str, GitLabConfig]:
+    """
+    Read the GitLab instances named in HC_GL_INSTANCES, as "name,...", each
+    configured by HC_GL_<NAME>_URL, _TOKEN and _SECRET, and optionally
+    _REQUESTER, _TOKEN_TYPE and _CALLBACK_URL which default to the default
+    instance's.
+    """
+    instances = {DEFAULT_INSTANCE: default}
+    for name in (_lookup("HC_GL_INSTANCES") or "").split(","):
+        name = name.strip()
+        if not name:
+            continue
+        if not re.fullmatch(r"[A-Za-z0-9_]+", name) or name in instances:
+            raise ConfigError(
+                f"Invalid GitLab instance name in HC_GL_INSTANCES: {name}"
+            )
+
+        instances[name] = GitLabConfig(f"HC_GL_{name.upper()}_", default)
+
+    return instances
+
+
+def load_config(path: Optional[str] = None) -> Config:
+    """
+    Read the configuration from the environment, with the settings of the
+    config file at `path`, if given, taking precedence. Unlike the
+    environment the file can change while Hubcast runs, so settings can be
+    reloaded from it.
+    """
+    global _file_values
+
+    values = read_config_file(path) if path else {}
+    _file_values = values
+    try:
+        return Config()
+    finally:
+        _file_values = {}
+
+
+def read_config_file(path: str) -> Dict[str, str]:
+    """
+    Read a file of KEY=value lines, as written for the environment: blank
+    lines, comments and a leading "export" are ignored, values may be quoted.
+    """
+    values = {}
+    try:
+        with open(path) as f:
+            for lineno, line in enumerate(f, 1):
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                line = line.removeprefix("export ").lstrip()
+
+                key, sep, value = line.partition("=")
+                if not sep or not key.strip():
+                    raise ConfigError(
+                        f"Invalid line in config file. path={path} line={lineno}"
+                    )
+                words = shlex.split(value, comments=True)
+                values[key.strip()] = " ".join(words)
+    except OSError as exc:
+        raise ConfigError(f"Failed to read config file. path={path}: {exc}")
+    except ValueError as exc:
+        raise ConfigError(f"Failed to parse config file. path={path}: {exc}")
+
+    return values
+
+
+def _lookup(key: str) -> Optional[str]:
+    return _file_values.get(key) or os.environ.get(key)
 
 
 def env_get(key: str, default: Optional[str] = None) -> str:
-    value = os.environ.get(key) or default
+    value = _lookup(key) or default
     if not value:
         raise ConfigError(f"Required environment variable not found: {key}")
 
     return value
+
+
+def env_get_optional(key: str) -> Optional[str]:
+    return _lookup(key) or None
+
+
+def env_get_bool(key: str, default: bool) -> bool:
+    value = env_get(key, default=str(default)).lower()
+    if value in ("1", "true", "yes", "on"):
+        return True
+    if value in ("0", "false", "no", "off"):
+        return False
+
+    raise ConfigError(f"Invalid boolean for environment variable: {key}={value}")
+
+
+def parse_size(value) -> int:
+    """Parse a number of bytes, such as 1048576, "512M" or "2GiB"."""
+    if isinstance(value, int) and not isinstance(value, bool) and value >= 0:
+        return value
+
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([kmgt]?)(?:i?b)?\s*", str(value), re.I)
+    if match is None:
+        raise ValueError(f"Invalid size: {value}")
+    return int(float(match[1]) * SIZE_UNITS[match[2].lower()])
+
+
+def env_get_weights(key: str) -> Dict[str, int]:
+    weights = {}
+    for item in (_lookup(key) or "").split(","):
+        if not item.strip():
+            continue
+
+        name, sep, weight = item.rpartition("=")
+        try:
+            if not sep or not name.strip():
+                raise ValueError(item)
+            weights[name.strip()] = int(weight)
+        except ValueError:
+            raise ConfigError(f"Invalid weight for environment variable: {key}={item}")
+
+    return weights
@@ -1,6 +1,16 @@
+import copy
 import datetime as dt
 import json
 import logging
+import logging.config
+import logging.handlers
+import os
+import queue
+import threading
+import time
+from typing import List, Optional
+
+from hubcast import metrics
 
 LOG_RECORD_BUILTIN_ATTRS = frozenset(
     {
@@ -30,26 +40,94 @@ LOG_RECORD_BUILTIN_ATTRS = frozenset(
     }
 )
 
+# keys always populated by HubcastJSONFormatter before fmt_keys are mapped
+JSON_FIXED_KEYS = frozenset({"timestamp", "level", "logger"})
+
+log_records_dropped = metrics.counter(
+    "hubcast_log_records_dropped_total",
+    "Log records dropped because the logging queue was full.",
+)
+
+
+class LoggingConfigError(Exception):
+    pass
+
+
+def configure_logging(path: str) -> None:
+    """
+    Configure logging from the JSON dictConfig at `path`, falling back to
+    INFO level console logging when there's no such file.
+    """
+    if not os.path.exists(path):
+        logging.basicConfig(level=logging.INFO)
+        return
+
+    try:
+        with open(path) as f:
+            logging_config = json.load(f)
+        logging.config.dictConfig(logging_config)
+    except (
+        # json.decoder.JSONDecodeError is a ValueError, calls to
+        # logging.config.dictConfig will raise the following exceptions (cf
+        # stdlib docs)
+        ValueError,
+        TypeError,
+        AttributeError,
+        ImportError,
+    ) as exc:
+        raise LoggingConfigError(f"Failed to apply logging config. path={path}: {exc}")
+
 
 class HubcastJSONFormatter(logging.Formatter):
     def __init__(self, *, fmt_keys=None):
         super().__init__()
         self.fmt_keys = fmt_keys or {}
 
+        # everything that only depends on fmt_keys is computed once here
+        # rather than for every record
+        self._mapped_keys = tuple(
+            (output_key, attr_name)
+            for output_key, attr_name in self.fmt_keys.items()
+            if output_key not in JSON_FIXED_KEYS
+        )
+        self._suppress_access_message = "message" in self.fmt_keys
+        self._encode = json.JSONEncoder(default=str).encode
+
+        # records arrive in bursts within the same second, so the
+        # second-resolution part of the timestamp is cached. Handlers may
+        # format from several threads, the second and its prefix are kept in
+        # one tuple so they're always read and replaced together.
+        self._ts_cache = (None, "")
+
+    def _timestamp(self, created: float) -> str:
+        second = int(created)
+        cached_second, prefix = self._ts_cache
+        if second != cached_second:
+            prefix = dt.datetime.fromtimestamp(second, tz=dt.timezone.utc).strftime(
+                "%Y-%m-%dT%H:%M:%S"
+            )
+            self._ts_cache = (second, prefix)
+
+        usec = round((created - second) * 1_000_000)
+        if usec >= 1_000_000:
+            # rounded up into the next second, let datetime carry it over
+            return dt.datetime.fromtimestamp(created, tz=dt.timezone.utc).isoformat(
+                timespec="microseconds"
+            )
+        return f"{prefix}.{usec:06d}+00:00"
+
     def format(self, record: logging.LogRecord) -> str:
         record_dict = record.__dict__
 
         # fields that are only included
         log_data = {
-            "timestamp": dt.datetime.fromtimestamp(
-                record.created, tz=dt.timezone.utc
-            ).isoformat(timespec="microseconds"),
+            "timestamp": self._timestamp(record.created),
             "level": record.levelname,
             "logger": record.name,
         }
 
         # exclude suppressed messages
-        if not (record.name == "aiohttp.access" and "message" in self.fmt_keys):
+        if not (record.name == "aiohttp.access" and self._suppress_access_message):
             log_data["message"] = record.getMessage()
 
         # add exception info
@@ -59,18 +137,20 @@ class HubcastJSONFormatter(logging.Formatter):
             log_data["stack_info"] = self.formatStack(record.stack_info)
 
         # map additional fields via fmt_keys
-        for output_key, attr_name in self.fmt_keys.items():
+        for output_key, attr_name in self._mapped_keys:
             if output_key in log_data:
                 continue  # already populated
-            if hasattr(record, attr_name):
-                log_data[output_key] = getattr(record, attr_name)
+            if attr_name in record_dict:
+                log_data[output_key] = record_dict[attr_name]
 
-        # add any user-defined extra fields (from logger(..., extra={...}))
-        for key, val in record_dict.items():
-            if key not in LOG_RECORD_BUILTIN_ATTRS and key not in log_data:
-                log_data[key] = val
+        # add any user-defined extra fields (from logger(..., extra={...})),
+        # the set difference is done in C so records without extras are cheap
+        if record_dict.keys() - LOG_RECORD_BUILTIN_ATTRS:
+            for key, val in record_dict.items():
+                if key not in LOG_RECORD_BUILTIN_ATTRS and key not in log_data:
+                    log_data[key] = val
 
-        return json.dumps(log_data, default=str)
+        return self._encode(log_data)
 
 
 class HubcastConsoleFormatter(logging.Formatter):
@@ -109,3 +189,172 @@ class HubcastConsoleFormatter(logging.Formatter):
             extra_str = ""
 
         return base + extra_str
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    A token bucket filter limiting how often a single log statement may emit.
+
+    Records are keyed by their call site (logger, file and line) so a flood of
+    one repeated error, or of aiohttp.access lines, can't crowd out everything
+    else. The number of records dropped for a call site is attached to the
+    next record it emits as `suppressed`.
+
+    Attributes
+    ----------
+    rate: float
+        Records per second each call site is allowed on average.
+    burst: int
+        Records a call site may emit at once before being limited.
+    """
+
+    def __init__(self, rate: float = 10.0, burst: int = 50):
+        super().__init__()
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = (record.name, record.pathname, record.lineno)
+        now = time.monotonic()
+
+        with self._lock:
+            tokens, last, suppressed = self._buckets.get(key, (self.burst, now, 0))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+
+            if tokens < 1:
+                self._buckets[key] = (tokens, now, suppressed + 1)
+                return False
+
+            self._buckets[key] = (tokens - 1, now, 0)
+
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    A filter keeping a deterministic fraction of low severity records.
+
+    Records at or above `min_level` always pass, everything below passes
+    once every 1/`sample_rate` records per logger.
+    """
+
+    def __init__(self, sample_rate: float = 1.0, min_level: str = "WARNING"):
+        super().__init__()
+        if not 0 < sample_rate <= 1:
+            raise ValueError(f"sample_rate must be in (0, 1], got {sample_rate}")
+
+        self.every = max(1, round(1 / sample_rate))
+        self.min_level = logging.getLevelName(min_level)
+        self._counts = {}
+        # records are logged from the event loop and from worker threads
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= self.min_level or self.every == 1:
+            return True
+
+        with self._lock:
+            count = self._counts.get(record.name, 0)
+            self._counts[record.name] = count + 1
+        return count % self.every == 0
+
+
+class HubcastQueueHandler(logging.handlers.QueueHandler):
+    """
+    A non-blocking queue handler which drops records when the queue is full.
+
+    Messages are rendered before enqueuing so mutable arguments can't change
+    before the listener thread gets to them, but exception info is left on
+    the record for the downstream formatter.
+
+    Attributes
+    ----------
+    dropped: int
+        Records dropped by this handler, also counted in
+        hubcast_log_records_dropped_total.
+    hoisted: List[logging.Filter]
+        Filters moved here from the handlers behind the queue.
+    """
+
+    def __init__(self, q: queue.Queue):
+        super().__init__(q)
+        self.dropped = 0
+        self.hoisted: List[logging.Filter] = []
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            log_records_dropped.inc()
+
+
+def start_queue_logging(
+    max_size: int = 10000, logger: Optional[logging.Logger] = None
+) -> logging.handlers.QueueListener:
+    """
+    Move the handlers of a logger (the root logger by default) behind a queue.
+
+    The configured handlers run on a listener thread, so slow streams or log
+    shippers no longer block the event loop. Filters every handler has, like
+    rate limits, are moved onto the queue handler, so the records they drop
+    are dropped before taking up room in the queue. The returned listener is
+    already started and should be stopped on shutdown to flush remaining
+    records.
+    """
+    logger = logger or logging.getLogger()
+
+    handlers: List[logging.Handler] = list(logger.handlers)
+    q: queue.Queue = queue.Queue(max_size)
+    queue_handler = HubcastQueueHandler(q)
+
+    # a filter only some handlers have has to stay with them
+    if handlers:
+        queue_handler.hoisted = [
+            f
+            for f in handlers[0].filters
+            if all(f in handler.filters for handler in handlers[1:])
+        ]
+    for f in queue_handler.hoisted:
+        queue_handler.addFilter(f)
+        for handler in handlers:
+            handler.removeFilter(f)
+
+    for handler in handlers:
+        logger.removeHandler(handler)
+    logger.addHandler(queue_handler)
+
+    listener = logging.handlers.QueueListener(q, *handlers, respect_handler_level=True)
+    listener.start()
+    return listener
+
+
+def stop_queue_logging(
+    listener: logging.handlers.QueueListener, logger: Optional[logging.Logger] = None
+) -> None:
+    """
+    Stop a listener started by start_queue_logging, flushing its queue, and
+    move the handlers behind it, and their filters, back onto the logger in
+    place of the queue.
+    """
+    logger = logger or logging.getLogger()
+
+    listener.stop()
+    for handler in list(logger.handlers):
+        if isinstance(handler, HubcastQueueHandler):
+            logger.removeHandler(handler)
+            for f in handler.hoisted:
+                for behind in listener.handlers:
+                    behind.addFilter(f)
+    for handler in listener.handlers:
+        logger.addHandler(handler)
@@ -1,3 +1,41 @@
+from typing import List, Optional
+
+from hubcast.config import DEFAULT_INSTANCE
+
+
+class Destination:
+    """
+    A GitLab repository a GitHub repository is mirrored into.
+
+    Attributes
+    ----------
+    org: str
+        The GitLab group or user owning the repository.
+    name: str
+        The name of the GitLab repository.
+    check_name: str
+        The name of the GitHub check reporting this destination's pipelines.
+    instance: str
+        The name of the GitLab instance the repository is on.
+    """
+
+    def __init__(
+        self,
+        org: str,
+        name: str,
+        check_name: str = "gitlab-ci",
+        instance: str = DEFAULT_INSTANCE,
+    ):
+        self.org = org
+        self.name = name
+        self.check_name = check_name
+        self.instance = instance
+
+    @property
+    def fullname(self) -> str:
+        return f"{self.org}/{self.name}"
+
+
 class RepoConfig:
     def __init__(
         self,
@@ -8,6 +46,9 @@ class RepoConfig:
         check_type: str = "pipeline",
         create_mr: bool = False,
         delete_closed: bool = True,
+        destinations: Optional[List[Destination]] = None,
+        max_pack_size: Optional[int] = None,
+        prune_branches: bool = False,
     ):
         self.fullname = fullname
         self.dest_org = dest_org
@@ -16,3 +57,15 @@ class RepoConfig:
         self.check_type = check_type
         self.create_mr = create_mr
         self.delete_closed = delete_closed
+        # bytes a pack mirrored from the repository may have, 0 for no
+        # limit, None for the configured default
+        self.max_pack_size = max_pack_size
+        # whether the pruner may delete destination branches other than the
+        # pr-<number> branches hubcast creates
+        self.prune_branches = prune_branches
+
+        # the first destination is always the one described by dest_org,
+        # dest_name and check_name
+        self.destinations = destinations or [
+            Destination(dest_org, dest_name, check_name)
+        ]
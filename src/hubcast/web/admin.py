@@ -0,0 +1,188 @@
+import hmac
+import logging
+import time
+from typing import Any, Dict
+
+from aiohttp import web
+
+from hubcast.web import latency
+from hubcast.web.diagnostics import ProfilerBusy
+from hubcast.web.jobs import JobTracker
+from hubcast.web.reload import ReloadError
+
+log = logging.getLogger(__name__)
+
+
+class AdminHandler:
+    """
+    Introspection endpoints for the jobs, caches and latency of a running
+    instance.
+
+    Every endpoint requires the admin token as a bearer token. Responses are
+    built from in-memory state and the cache backend only, no request waits
+    on GitHub or GitLab.
+
+    Attributes
+    ----------
+    token: str
+        The token admin requests must present.
+    jobs: JobTracker
+        The tracker of webhook jobs.
+    caches: Dict[str, Any]
+        The caches to report on by name. Each provides a `stats` CacheStats
+        and coroutines `size()` and `invalidate(key)`.
+    reloader: Reloader
+        Reloads the configuration on request, set once it's been created.
+    profiler: Profiler
+        Runs profiling sessions on request, if set.
+    """
+
+    def __init__(self, token: str, jobs: JobTracker, caches: Dict[str, Any]):
+        self.token = token
+        self.jobs = jobs
+        self.caches = caches
+        self.reloader = None
+        self.profiler = None
+
+    def authorize(self, request):
+        auth = request.headers.get("Authorization", "")
+        scheme, _, token = auth.partition(" ")
+        if scheme.lower() != "bearer" or not hmac.compare_digest(
+            token.encode(), self.token.encode()
+        ):
+            raise web.HTTPUnauthorized()
+
+    async def list_jobs(self, request):
+        self.authorize(request)
+
+        now = time.time()
+        jobs = []
+        for job in list(self.jobs.jobs.values()):
+            # queued jobs are waiting their turn in the shard queue, pending
+            # ones for a slot in the scheduler
+            if job.handle is None:
+                state = "queued"
+            elif job.handle.pending:
+                state = "pending"
+            else:
+                state = "active"
+            jobs.append(
+                {
+                    "id": job.id,
+                    "source": job.source,
+                    "event_type": job.event_type,
+                    "repo": job.repo,
+                    "delivery_id": job.delivery_id,
+                    "state": state,
+                    "step": job.step,
+                    "age": round(now - job.created, 3),
+                }
+            )
+
+        # an idle scheduler is empty, and so falsy
+        scheduler = self.jobs.scheduler
+        started = scheduler is not None
+        shards = self.jobs.shards
+        return web.json_response(
+            {
+                "draining": self.jobs.draining,
+                "active": scheduler.active_count if started else 0,
+                "pending": scheduler.pending_count if started else 0,
+                "queued": shards.queued,
+                "limit": scheduler.limit if started else None,
+                "shards": [
+                    {"source": source, "repo": repo, "queued": depth}
+                    for (source, repo), depth in shards.depths().items()
+                    if depth
+                ],
+                "jobs": jobs,
+            }
+        )
+
+    async def cancel_job(self, request):
+        self.authorize(request)
+
+        try:
+            job_id = int(request.match_info["job_id"])
+        except ValueError:
+            raise web.HTTPBadRequest(text="job id must be an integer")
+
+        if not await self.jobs.cancel(job_id):
+            raise web.HTTPNotFound(text=f"no job {job_id}")
+
+        return web.json_response({"cancelled": job_id})
+
+    async def list_caches(self, request):
+        self.authorize(request)
+
+        caches = {}
+        for name, cache in self.caches.items():
+            stats = cache.stats
+            caches[name] = {
+                "size": await cache.size(),
+                "hits": stats.hits,
+                "misses": stats.misses,
+                "hit_rate": stats.hit_rate,
+            }
+
+        return web.json_response(caches)
+
+    async def invalidate(self, request):
+        self.authorize(request)
+
+        name = request.match_info["cache"]
+        key = request.match_info["key"]
+        cache = self.caches.get(name)
+        if cache is None:
+            raise web.HTTPNotFound(text=f"no cache {name}")
+
+        if not await cache.invalidate(key):
+            raise web.HTTPNotFound(text=f"no entry {key} in {name}")
+
+        log.info("Invalidated cache entry", extra={"cache": name, "key": key})
+        return web.json_response({"cache": name, "invalidated": key})
+
+    async def reload(self, request):
+        self.authorize(request)
+
+        if self.reloader is None:
+            raise web.HTTPNotFound(text="reloading isn't available")
+
+        try:
+            result = await self.reloader.reload()
+        except ReloadError as exc:
+            log.error("Configuration reload failed", extra={"error": str(exc)})
+            raise web.HTTPBadRequest(text=str(exc))
+
+        return web.json_response(result)
+
+    async def list_latency(self, request):
+        self.authorize(request)
+
+        try:
+            limit = int(request.query.get("limit", 20))
+        except ValueError:
+            raise web.HTTPBadRequest(text="limit must be an integer")
+
+        return web.json_response({"slowest": latency.tracker.slowest(limit)})
+
+    async def profile(self, request):
+        self.authorize(request)
+
+        if self.profiler is None:
+            raise web.HTTPNotFound(text="profiling isn't available")
+
+        seconds = None
+        if "seconds" in request.query:
+            try:
+                seconds = float(request.query["seconds"])
+            except ValueError:
+                raise web.HTTPBadRequest(text="seconds must be a number")
+
+        try:
+            paths = self.profiler.start(seconds)
+        except ProfilerBusy as exc:
+            raise web.HTTPConflict(text=str(exc))
+
+        # the session runs on, its results are written when it's over
+        return web.json_response(paths, status=202)
@@ -0,0 +1,52 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterator
+
+
+class EventContext:
+    """
+    Reads made while processing one webhook event, so however many handlers
+    and helpers need a resource it's fetched at most once per event.
+
+    A context lives only as long as its event, so unlike the global caches
+    it never serves data from before the event: explicit refreshes bypass
+    the global caches as before, but happen once per event. Reads are
+    shared between concurrent callers, a failed read is retried by the
+    next caller.
+    """
+
+    def __init__(self):
+        self._reads: Dict[Hashable, asyncio.Future] = {}
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._reads
+
+    def __iter__(self) -> Iterator[Hashable]:
+        return iter(list(self._reads))
+
+    async def memo(self, key: Hashable, read: Callable[[], Awaitable[Any]]) -> Any:
+        """Return the result of `read()`, calling it only for the first caller."""
+        future = self._reads.get(key)
+        if future is None:
+            future = asyncio.ensure_future(read())
+            self._reads[key] = future
+
+            def forget_failed(done):
+                if (done.cancelled() or done.exception()) and self._reads.get(
+                    key
+                ) is done:
+                    del self._reads[key]
+
+            future.add_done_callback(forget_failed)
+
+        # a caller being cancelled mustn't cancel the read for the others
+        return await asyncio.shield(future)
+
+    def remember(self, key: Hashable, value: Any) -> None:
+        """Record a value read some other way, such as along with other data."""
+        future = asyncio.get_running_loop().create_future()
+        future.set_result(value)
+        self._reads[key] = future
+
+    def forget(self, key: Hashable) -> None:
+        """Drop a value the event has since changed, so it's read again."""
+        self._reads.pop(key, None)
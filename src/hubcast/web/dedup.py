@@ -0,0 +1,57 @@
+import hashlib
+
+from cachetools import TTLCache
+
+from hubcast import metrics
+from hubcast.clients.utils import CacheStats
+
+webhooks_received = metrics.counter(
+    "hubcast_webhooks_received_total", "Webhook deliveries received."
+)
+webhooks_duplicate = metrics.counter(
+    "hubcast_webhooks_duplicate_total",
+    "Webhook deliveries acknowledged and dropped as duplicates.",
+)
+
+
+class DeliveryCache:
+    """
+    A bounded set of recently seen webhook deliveries.
+
+    Entries expire after `ttl` seconds, and the oldest entries are evicted
+    once `maxsize` deliveries are being tracked.
+    """
+
+    def __init__(self, maxsize: int = 50000, ttl: float = 86400):
+        self._seen = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.stats = CacheStats()
+
+    def __len__(self) -> int:
+        return len(self._seen)
+
+    def add(self, key: str) -> bool:
+        """Record a delivery, returning False if it was already seen."""
+        seen = key in self._seen
+        self.stats.record(seen)
+        if seen:
+            return False
+
+        self._seen[key] = True
+        return True
+
+    def discard(self, key: str) -> None:
+        """Forget a delivery so a redelivery of it will be processed."""
+        self._seen.pop(key, None)
+
+    async def size(self) -> int:
+        return len(self._seen)
+
+    async def invalidate(self, key: str) -> bool:
+        """Forget a delivery, returning False if it wasn't being tracked."""
+        return self._seen.pop(key, None) is not None
+
+
+def content_key(source: str, event_type: str, body: bytes) -> str:
+    """Return a delivery key for sources which don't identify their deliveries."""
+    digest = hashlib.sha256(body).hexdigest()
+    return f"{source}:{event_type}:{digest}"
@@ -0,0 +1,191 @@
+import asyncio
+import cProfile
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import tracemalloc
+from typing import Dict, Optional
+
+from hubcast import metrics
+
+log = logging.getLogger(__name__)
+
+loop_lag = metrics.histogram(
+    "hubcast_loop_lag_seconds",
+    "How late the event loop ran a callback scheduled at a fixed interval.",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+loop_stalls = metrics.counter(
+    "hubcast_loop_stalls_total",
+    "Times the event loop was blocked for longer than the lag threshold.",
+)
+
+# frames of allocation tracebacks kept by tracemalloc while profiling
+TRACEMALLOC_FRAMES = 25
+
+
+class ProfilerBusy(Exception):
+    pass
+
+
+class LoopMonitor:
+    """
+    Watches the event loop for synchronous work holding it up.
+
+    A coroutine wakes every `interval` seconds and records how late it was
+    woken. A watchdog thread checks when it last woke, and if the loop has
+    been blocked for longer than `threshold` seconds it logs the stack the
+    loop is stuck in, once per stall, while the culprit is still running.
+
+    Attributes
+    ----------
+    threshold: float
+        Seconds the loop may be blocked before the stack is logged.
+    interval: float
+        Seconds between samples of the loop's lag.
+    """
+
+    def __init__(self, threshold: float = 0.5, interval: float = 0.1):
+        self.threshold = threshold
+        self.interval = interval
+        self._last_tick = time.monotonic()
+        self._stop = threading.Event()
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        self._last_tick = time.monotonic()
+        self._stop.clear()
+        watchdog = threading.Thread(
+            target=self._watch,
+            args=(threading.get_ident(),),
+            name="hubcast-loop-watchdog",
+            daemon=True,
+        )
+        watchdog.start()
+
+        try:
+            while True:
+                expected = loop.time() + self.interval
+                await asyncio.sleep(self.interval)
+                loop_lag.observe(max(0.0, loop.time() - expected))
+                self._last_tick = time.monotonic()
+        finally:
+            self._stop.set()
+            watchdog.join(timeout=1)
+
+    def _watch(self, thread_id: int) -> None:
+        reported = False
+        while not self._stop.wait(self.interval):
+            blocked = time.monotonic() - self._last_tick - self.interval
+            if blocked < self.threshold:
+                reported = False
+                continue
+            if reported:
+                continue
+
+            reported = True
+            loop_stalls.inc()
+            frame = sys._current_frames().get(thread_id)
+            log.warning(
+                "Event loop blocked",
+                extra={
+                    "blocked_seconds": round(blocked, 3),
+                    "stack": "".join(traceback.format_stack(frame)) if frame else None,
+                },
+            )
+
+
+class Profiler:
+    """
+    Time-boxed profiling sessions of the event loop thread.
+
+    A session runs cProfile for a number of seconds, then writes its stats
+    and a tracemalloc snapshot of the memory allocated meanwhile to
+    `directory`, to be read offline with pstats and tracemalloc. Only one
+    session runs at a time.
+
+    Attributes
+    ----------
+    directory: str
+        Where results are written, the system temp dir if None.
+    seconds: float
+        How long sessions run unless asked otherwise.
+    max_seconds: float
+        The longest session which may be requested.
+    """
+
+    def __init__(
+        self,
+        directory: Optional[str] = None,
+        seconds: float = 30,
+        max_seconds: float = 600,
+    ):
+        self.directory = directory
+        self.seconds = seconds
+        self.max_seconds = max_seconds
+        self._task: Optional[asyncio.Task] = None
+        self._sessions = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self, seconds: Optional[float] = None) -> Dict[str, str]:
+        """
+        Start a session, returning the paths its results will be written to.
+        Raises ProfilerBusy if one is already running.
+        """
+        if self.running:
+            raise ProfilerBusy("a profiling session is already running")
+
+        if seconds is None:
+            seconds = self.seconds
+        seconds = min(max(seconds, 0.0), self.max_seconds)
+        self._sessions += 1
+        stamp = time.strftime("%Y%m%dT%H%M%S")
+        base = os.path.join(
+            self.directory or tempfile.gettempdir(),
+            f"hubcast-{os.getpid()}-{stamp}-{self._sessions}",
+        )
+        paths = {"profile": f"{base}.pstats", "memory": f"{base}.tracemalloc"}
+
+        # memory may already be traced by PYTHONTRACEMALLOC, leave it running
+        trace_memory = not tracemalloc.is_tracing()
+        if trace_memory:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        profile = cProfile.Profile()
+        profile.enable()
+
+        log.info("Profiling started", extra={"seconds": seconds, **paths})
+        self._task = asyncio.create_task(
+            self._finish(profile, trace_memory, seconds, paths)
+        )
+        return paths
+
+    async def _finish(
+        self,
+        profile: cProfile.Profile,
+        trace_memory: bool,
+        seconds: float,
+        paths: Dict[str, str],
+    ) -> None:
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            # also written when shutting down in the middle of a session
+            profile.disable()
+            snapshot = tracemalloc.take_snapshot()
+            if trace_memory:
+                tracemalloc.stop()
+
+            try:
+                profile.dump_stats(paths["profile"])
+                snapshot.dump(paths["memory"])
+            except OSError as exc:
+                log.error("Failed to write profile", extra={"error": str(exc)})
+            else:
+                log.info("Profiling finished", extra=paths)
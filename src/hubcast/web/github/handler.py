@@ -1,24 +1,76 @@
 import logging
+from typing import Optional, Tuple
 
 from aiohttp import web
-from aiojobs.aiohttp import spawn
 from gidgethub import sansio
 
+from hubcast.web import latency
+from hubcast.web.context import EventContext
+from hubcast.web.dedup import DeliveryCache, webhooks_duplicate, webhooks_received
+from hubcast.web.jobs import EventJob, JobTracker
+
 from .routes import router
 
 log = logging.getLogger(__name__)
 
 
+def ordering(event: sansio.Event) -> Tuple[Optional[str], bool]:
+    """
+    Return the lane an event is processed in order within, and whether it
+    supersedes the earlier events of its lane still waiting.
+    """
+    data = event.data
+    if event.event == "push":
+        # the last push or deletion of a ref decides where it ends up
+        return data["ref"], True
+    if event.event == "pull_request":
+        lane = f"pull/{data['pull_request']['number']}"
+        return lane, data.get("action") in ("opened", "reopened", "synchronize")
+    if event.event == "issue_comment":
+        return f"pull/{data['issue']['number']}", False
+    if event.event == "check_run":
+        branch = data["check_run"]["check_suite"]["head_branch"]
+        return f"refs/heads/{branch}", False
+    return None, False
+
+
+def announced(event: sansio.Event) -> Optional[str]:
+    """Return the sha of the commit an event asks to be mirrored, if any."""
+    data = event.data
+    if event.event == "push" and not data.get("deleted"):
+        return data["after"]
+    if event.event == "pull_request" and data.get("action") in (
+        "opened",
+        "reopened",
+        "synchronize",
+    ):
+        return data["pull_request"]["head"]["sha"]
+    return None
+
+
 class GitHubHandler:
     def __init__(
-        self, webhook_secret, account_map, github_client_factory, gitlab_client_factory
+        self,
+        webhook_secret,
+        account_map,
+        github_client_factory,
+        gitlab_client_factory,
+        deliveries: DeliveryCache,
+        jobs: JobTracker,
     ):
         self.webhook_secret = webhook_secret
         self.account_map = account_map
         self.gh = github_client_factory
         self.gl = gitlab_client_factory
+        self.deliveries = deliveries
+        self.jobs = jobs
 
     async def handle(self, request):
+        # stop taking on new work once we're shutting down
+        if self.jobs.draining:
+            return web.Response(status=503)
+
+        delivery_key = None
         try:
             # read the GitHub webhook payload
             body = await request.read()
@@ -30,24 +82,71 @@ class GitHubHandler:
                 "GitHub webhook received",
                 extra={"event_type": event.event, "delivery_id": event.delivery_id},
             )
+            webhooks_received.inc(source="github")
 
-            github_user = event.data["sender"]["login"]
-            gitlab_user = self.account_map(github_user)
-
-            if gitlab_user is None:
-                log.info("Unauthorized GitHub user", extra={"github_user": github_user})
-                return web.Response(status=200)
-
-            gh_repo_owner = event.data["repository"]["owner"]["login"]
-            gh_repo = event.data["repository"]["name"]
+            # GitHub redelivers on timeouts (and we redeliver by hand), only the
+            # first delivery of an id needs to be processed
+            if event.delivery_id:
+                delivery_key = f"github:{event.delivery_id}"
+                if not self.deliveries.add(delivery_key):
+                    log.info(
+                        "Duplicate GitHub webhook dropped",
+                        extra={
+                            "event_type": event.event,
+                            "delivery_id": event.delivery_id,
+                        },
+                    )
+                    webhooks_duplicate.inc(source="github")
+                    return web.Response(status=200)
 
-            gh = self.gh.create_client(gh_repo_owner, gh_repo)
-            gl = self.gl.create_client(gitlab_user)
-
-            await spawn(request, router.dispatch(event, gh, gl, gitlab_user))
+            await self.process(event, delivery_key)
 
             # return a "Success"
             return web.Response(status=200)
         except Exception:
             log.exception("Failed to handle Github webhook")
+            # let a redelivery of this webhook be processed
+            if delivery_key:
+                self.deliveries.discard(delivery_key)
             return web.Response(status=500)
+
+    async def process(self, event: sansio.Event, delivery_key: Optional[str] = None):
+        """Start processing a verified GitHub event in the background."""
+        github_user = event.data["sender"]["login"]
+        gitlab_user = self.account_map(github_user)
+
+        if gitlab_user is None:
+            log.info("Unauthorized GitHub user", extra={"github_user": github_user})
+            return
+
+        gh_repo_owner = event.data["repository"]["owner"]["login"]
+        gh_repo = event.data["repository"]["name"]
+
+        gh = self.gh.create_client(gh_repo_owner, gh_repo)
+        gl = self.gl.create_client(gitlab_user)
+
+        sha = announced(event)
+        if sha is not None:
+            latency.tracker.received(event.data["repository"]["full_name"], sha)
+
+        lane, supersedes = ordering(event)
+        job = EventJob(
+            "github",
+            event.event,
+            event.data,
+            delivery_id=event.delivery_id,
+            repo=event.data["repository"]["full_name"],
+            lane=lane,
+            supersedes=supersedes,
+            delivery_key=delivery_key,
+        )
+        # reads made while handling the event are shared by its callbacks
+        ctx = EventContext()
+        await self.jobs.spawn(router.dispatch(event, gh, gl, gitlab_user, ctx=ctx), job)
+
+    async def replay(self, job: EventJob):
+        """Process an event checkpointed by a previous instance."""
+        event = sansio.Event(
+            job.data, event=job.event_type, delivery_id=job.delivery_id
+        )
+        await self.process(event)
@@ -0,0 +1,412 @@
+import asyncio
+import logging
+from typing import Dict, Iterable, List, Optional, Set
+
+from repligit.exceptions import RefUpdateRejected
+
+from hubcast import metrics
+from hubcast.clients.git import NULL_SHA, PackTooLarge, RefBatcher, RefUpdate, ls_refs
+from hubcast.clients.gitlab import GitLabClients
+from hubcast.repos.config import Destination
+from hubcast.web import latency
+from hubcast.web.context import EventContext
+from hubcast.web.github.utils import gather_or_cancel
+from hubcast.web.jobs import set_step
+from hubcast.web.locks import RefLocks
+
+log = logging.getLogger(__name__)
+
+# shared by every event so bursts of ref updates are pushed together,
+# replaced on startup with one using the configured batching window
+batcher = RefBatcher()
+
+# the mirror operations allowed to run at once, shared by webhook events and
+# the reconciler so background work draws from the same budget
+mirror_slots = asyncio.Semaphore(16)
+
+# held from reading a destination ref until it's been updated, replaced on
+# startup with locks shared through the cache backend
+ref_locks = RefLocks()
+
+# times an update rejected because the destination ref moved since it was
+# read is retried from a fresh read
+STALE_RETRIES = 2
+
+stale_retries = metrics.counter(
+    "hubcast_ref_update_retries_total",
+    "Ref updates retried because the destination ref moved since it was read.",
+)
+pull_sources = metrics.counter(
+    "hubcast_pull_sources_total",
+    "Fork pull requests mirrored, by whether they were fetched from the base "
+    "repository or the fork.",
+)
+
+
+class MirrorError(Exception):
+    pass
+
+
+class MirrorRefused(MirrorError):
+    """A ref wasn't mirrored because its pack was larger than allowed."""
+
+    def __init__(self, message: str, limit: int):
+        super().__init__(message)
+        self.limit = limit
+
+
+def dest_remote_url(gl: GitLabClients, dest: Destination) -> str:
+    return f"{gl.for_dest(dest).instance_url}/{dest.fullname}.git"
+
+
+async def _authenticate(
+    gl: GitLabClients, gl_user: str, destinations: List[Destination]
+) -> List[str]:
+    """Return the token of `gl_user` for each destination's instance."""
+    names = list(dict.fromkeys(dest.instance for dest in destinations))
+    tokens = await asyncio.gather(
+        *(gl.instance(name).auth.authenticate_user(gl_user) for name in names)
+    )
+    by_name = dict(zip(names, tokens))
+    return [by_name[dest.instance] for dest in destinations]
+
+
+def pull_ref(number: int) -> str:
+    return f"refs/pull/{number}/head"
+
+
+async def pull_source(
+    base_url: str, fork_url: Optional[str], number: int, want_sha: str
+) -> Optional[str]:
+    """
+    Return where to fetch the head of a pull request from a fork.
+
+    GitHub keeps the head of every pull request as refs/pull/<number>/head
+    in the base repository, so it's fetched from there, sharing the
+    connections and the batches of the rest of the repository's traffic,
+    and still working once the fork is deleted. The fork is used instead
+    while that ref is behind, as GitHub updates it shortly after the event,
+    and None is returned if there is no fork to fall back on.
+    """
+    refs = await ls_refs(base_url, [pull_ref(number)])
+    if refs.get(pull_ref(number)) == want_sha:
+        pull_sources.inc(source="base")
+        return base_url
+
+    if fork_url is not None:
+        pull_sources.inc(source="fork")
+    return fork_url
+
+
+async def mirror_ref(
+    gl: GitLabClients,
+    gl_user: str,
+    src_fullname: str,
+    src_repo_url: str,
+    target_ref: str,
+    want_sha: str,
+    destinations: List[Destination],
+    base_ref: Optional[str] = None,
+    ctx: Optional[EventContext] = None,
+    max_pack_size: Optional[int] = None,
+):
+    """
+    Mirror a ref from GitHub into every destination repository.
+
+    Only the target ref, the destination's default branch and `base_ref`, the
+    branch a pull request targets, are offered to GitHub as haves. They're
+    the tips a new pack is most likely to build on, and keeps negotiation
+    from walking the thousands of fork branches a destination accumulates.
+
+    Updates are handed to the shared RefBatcher, which fetches the packfile
+    from GitHub once and pushes it to every destination which needs it
+    concurrently, together with any other updates arriving at the same time.
+    A failed push doesn't stop the others, a MirrorError is raised once every
+    push has finished. A pack larger than `max_pack_size` bytes, or the
+    batcher's default when None, is cut off and MirrorRefused raised.
+
+    The destination refs are locked from being read until they're updated,
+    and an update rejected because a ref moved in the meantime anyway, by
+    something else pushing to it, is retried from where it is now.
+    """
+    set_step("waiting for ref lock")
+    async with ref_locks.hold(_lock_keys(gl, destinations, target_ref)):
+        set_step("waiting for mirror slot")
+        async with mirror_slots:
+            await _mirror_ref(
+                gl,
+                gl_user,
+                src_fullname,
+                src_repo_url,
+                target_ref,
+                want_sha,
+                destinations,
+                base_ref,
+                ctx,
+                max_pack_size,
+            )
+
+
+async def _mirror_ref(
+    gl: GitLabClients,
+    gl_user: str,
+    src_fullname: str,
+    src_repo_url: str,
+    target_ref: str,
+    want_sha: str,
+    destinations: List[Destination],
+    base_ref: Optional[str],
+    ctx: Optional[EventContext],
+    max_pack_size: Optional[int],
+):
+    set_step(f"listing destination refs for {target_ref}")
+    wanted = {target_ref, "HEAD"}
+    if base_ref:
+        wanted.add(base_ref)
+
+    # the tokens are almost always cached, so getting them alongside the
+    # listings costs nothing when no push turns out to be needed
+    urls = [dest_remote_url(gl, dest) for dest in destinations]
+    tokens, *all_refs = await gather_or_cancel(
+        _authenticate(gl, gl_user, destinations),
+        *(_list_dest_refs(ctx, url, wanted) for url in urls),
+    )
+    all_refs = [_exact(refs, wanted) for refs in all_refs]
+
+    pending = []
+    for url, gl_token, gl_refs in zip(urls, tokens, all_refs):
+        if gl_refs.get(target_ref) == want_sha:
+            log.info(
+                "Target ref already up-to-date",
+                extra={"repo": src_fullname, "dest": url, "target_ref": target_ref},
+            )
+            continue
+        pending.append((url, gl_token, gl_refs))
+
+    if not pending:
+        latency.tracker.mark(want_sha, "mirrored")
+        return
+
+    set_step(f"pushing {target_ref}")
+
+    async def push(url, gl_token, gl_refs):
+        from_sha = gl_refs.get(target_ref) or NULL_SHA
+
+        log.info(
+            "Mirroring refs",
+            extra={
+                "repo": src_fullname,
+                "dest": url,
+                "from_sha": from_sha,
+                "want_sha": want_sha,
+            },
+        )
+        await _update_ref(
+            src_repo_url,
+            url,
+            RefUpdate(target_ref, from_sha, want_sha),
+            gl_refs.values(),
+            wanted,
+            gl_user,
+            gl_token,
+            src_fullname,
+            max_pack_size,
+        )
+
+    results = await asyncio.gather(
+        *(push(*dest) for dest in pending), return_exceptions=True
+    )
+    _forget_dest_refs(ctx, [url for url, _, _ in pending])
+    _check_results(src_fullname, target_ref, [url for url, _, _ in pending], results)
+    latency.tracker.mark(want_sha, "mirrored")
+
+
+async def delete_ref(
+    gl: GitLabClients,
+    gl_user: str,
+    src_fullname: str,
+    src_repo_url: str,
+    target_ref: str,
+    destinations: List[Destination],
+    ctx: Optional[EventContext] = None,
+):
+    """Delete a ref from every destination repository it exists in."""
+    set_step("waiting for ref lock")
+    async with ref_locks.hold(_lock_keys(gl, destinations, target_ref)):
+        set_step("waiting for mirror slot")
+        async with mirror_slots:
+            await _delete_ref(
+                gl, gl_user, src_fullname, src_repo_url, target_ref, destinations, ctx
+            )
+
+
+async def _delete_ref(
+    gl: GitLabClients,
+    gl_user: str,
+    src_fullname: str,
+    src_repo_url: str,
+    target_ref: str,
+    destinations: List[Destination],
+    ctx: Optional[EventContext],
+):
+    set_step(f"listing destination refs for {target_ref}")
+    urls = [dest_remote_url(gl, dest) for dest in destinations]
+    tokens, *all_refs = await gather_or_cancel(
+        _authenticate(gl, gl_user, destinations),
+        *(_list_dest_refs(ctx, url, {target_ref}) for url in urls),
+    )
+    all_refs = [_exact(refs, {target_ref}) for refs in all_refs]
+
+    pending = [
+        (url, gl_token, gl_refs[target_ref])
+        for url, gl_token, gl_refs in zip(urls, tokens, all_refs)
+        if target_ref in gl_refs
+    ]
+    if not pending:
+        return
+
+    set_step(f"deleting {target_ref}")
+
+    async def delete(url, gl_token, head_sha):
+        log.info(
+            "Deleting ref",
+            extra={"repo": src_fullname, "dest": url, "target_ref": target_ref},
+        )
+        await _update_ref(
+            src_repo_url,
+            url,
+            RefUpdate(target_ref, head_sha, NULL_SHA),
+            (),
+            {target_ref},
+            gl_user,
+            gl_token,
+            src_fullname,
+        )
+
+    results = await asyncio.gather(
+        *(delete(*dest) for dest in pending), return_exceptions=True
+    )
+    _forget_dest_refs(ctx, [url for url, _, _ in pending])
+    _check_results(src_fullname, target_ref, [url for url, _, _ in pending], results)
+
+
+async def _update_ref(
+    src_repo_url: str,
+    url: str,
+    update: RefUpdate,
+    have_shas: Iterable[str],
+    wanted: Set[str],
+    gl_user: str,
+    gl_token: str,
+    repo: str,
+    max_pack_size: Optional[int] = None,
+):
+    """
+    Apply a ref update through the batcher. If it's rejected because the
+    ref is no longer at `update.from_sha`, the destination is read again and
+    the update retried from there, unless the ref already got where it was
+    going. Any other rejection is raised.
+    """
+    for attempt in range(STALE_RETRIES + 1):
+        try:
+            await batcher.update(
+                src_repo_url,
+                url,
+                update,
+                have_shas,
+                username=gl_user,
+                password=gl_token,
+                repo=repo,
+                max_pack_size=max_pack_size,
+            )
+            return
+        except RefUpdateRejected:
+            if attempt == STALE_RETRIES:
+                raise
+
+            refs = _exact(await ls_refs(url, wanted), wanted)
+            current = refs.get(update.ref, NULL_SHA)
+            if current == update.to_sha:
+                return
+            if current == update.from_sha:
+                raise
+
+            log.warning(
+                "Destination ref moved since it was read, retrying",
+                extra={
+                    "dest": url,
+                    "target_ref": update.ref,
+                    "expected_sha": update.from_sha,
+                    "found_sha": current,
+                },
+            )
+            stale_retries.inc()
+            update = update._replace(from_sha=current)
+            if not update.is_delete:
+                have_shas = refs.values()
+
+
+def _lock_keys(
+    gl: GitLabClients, destinations: List[Destination], target_ref: str
+) -> List[str]:
+    return [f"{dest_remote_url(gl, dest)} {target_ref}" for dest in destinations]
+
+
+async def _list_dest_refs(
+    ctx: Optional[EventContext], url: str, wanted: Set[str]
+) -> Dict[str, str]:
+    if ctx is None:
+        return await ls_refs(url, wanted)
+    return await ctx.memo(
+        ("dest_refs", url, frozenset(wanted)), lambda: ls_refs(url, wanted)
+    )
+
+
+def _forget_dest_refs(ctx: Optional[EventContext], urls: List[str]):
+    """Drop the listings of destinations the event has since pushed to."""
+    if ctx is None:
+        return
+    for url in urls:
+        for key in [k for k in ctx if k[0] == "dest_refs" and k[1] == url]:
+            ctx.forget(key)
+
+
+def _exact(refs: Dict[str, str], wanted: Set[str]) -> Dict[str, str]:
+    """Drop refs which only matched one of the wanted refs as a prefix."""
+    return {ref: sha for ref, sha in refs.items() if ref in wanted}
+
+
+def _check_results(src_fullname: str, target_ref: str, urls: List[str], results):
+    failed = []
+    refused = None
+    for url, result in zip(urls, results):
+        if isinstance(result, PackTooLarge):
+            refused = result
+        elif isinstance(result, BaseException):
+            log.error(
+                "Failed to update destination ref",
+                exc_info=result,
+                extra={"repo": src_fullname, "dest": url, "target_ref": target_ref},
+            )
+            failed.append(url)
+
+    if refused is not None:
+        log.warning(
+            "Refused to mirror pack larger than allowed",
+            extra={
+                "repo": src_fullname,
+                "target_ref": target_ref,
+                "max_pack_size": refused.limit,
+            },
+        )
+        raise MirrorRefused(
+            f"Refused to mirror {target_ref}, its pack exceeds {refused.limit} "
+            f"bytes. repo={src_fullname}",
+            refused.limit,
+        )
+
+    if failed:
+        raise MirrorError(
+            f"Failed to update {target_ref} on {len(failed)} of {len(urls)} "
+            f"destinations. repo={src_fullname}"
+        )
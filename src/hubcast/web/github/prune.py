@@ -0,0 +1,230 @@
+import asyncio
+import logging
+import random
+import re
+from typing import Dict, List, Optional
+
+from gidgethub import BadRequest
+
+from hubcast import metrics
+from hubcast.clients.git import NULL_SHA, RefUpdate, ls_refs, send_pack
+from hubcast.clients.github import GitHubClientFactory
+from hubcast.clients.gitlab import GitLabClient, GitLabInstances
+from hubcast.web.github.mirror import dest_remote_url
+from hubcast.web.github.reconcile import fork_branches, list_branches
+from hubcast.web.github.utils import get_repo_config
+
+log = logging.getLogger(__name__)
+
+prune_deleted = metrics.counter(
+    "hubcast_prune_deleted_total",
+    "Stale destination branches deleted by the pruner.",
+)
+prune_failed = metrics.counter(
+    "hubcast_prune_failed_total",
+    "Stale destination branches the pruner failed to delete.",
+)
+
+# the branches hubcast creates for pull requests, always its own to delete
+PR_BRANCH = re.compile(r"refs/heads/pr-[0-9]+")
+
+# repo full name -> destination full name -> stale refs
+PruneReport = Dict[str, Dict[str, List[str]]]
+
+
+class Pruner:
+    """
+    Deletes destination branches which are no longer mirrored: pr-<number>
+    branches of closed pull requests, and branches deleted on GitHub, left
+    behind when the webhook removing them was missed.
+
+    Only pr-<number> branches are deleted unless a repository's
+    .github/hubcast.yml sets prune_branches, as other branches of its
+    destinations may have been pushed there by someone other than hubcast.
+
+    Attributes
+    ----------
+    gl_user: str
+        The GitLab user branches are deleted as.
+    interval: float
+        Seconds between the end of one pass and the start of the next.
+    jitter: float
+        Up to this many seconds are randomly added to each interval so
+        replicas don't prune in lockstep.
+    batch_size: int
+        Number of branches deleted by each push.
+    batch_delay: float
+        Seconds to wait between pushes, limiting the load put on GitLab.
+    dry_run: bool
+        Only report stale branches, without deleting them.
+    """
+
+    def __init__(
+        self,
+        github_client_factory: GitHubClientFactory,
+        gitlab_client_factory: GitLabInstances,
+        gl_user: str,
+        interval: float = 86400,
+        jitter: float = 60,
+        batch_size: int = 50,
+        batch_delay: float = 1,
+        dry_run: bool = True,
+    ):
+        self.gh = github_client_factory
+        self.gl = gitlab_client_factory
+        self.gl_user = gl_user
+        self.interval = interval
+        self.jitter = jitter
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.dry_run = dry_run
+
+    async def run(self):
+        """Prune every installed repository forever, starting right away."""
+        while True:
+            await asyncio.sleep(random.uniform(0, self.jitter))  # nosec B311
+
+            try:
+                await self.prune_all()
+            except Exception:
+                log.exception("Pruning pass failed")
+
+            await asyncio.sleep(self.interval)
+
+    async def prune_all(self, only: Optional[List[str]] = None) -> PruneReport:
+        """
+        Prune every installed repository, or only those whose full name is
+        in `only`. Repositories are pruned one at a time. Returns the stale
+        branches found, deleted unless this is a dry run.
+        """
+        repos = await self.gh.get_installed_repos()
+        if only is not None:
+            repos = [repo for repo in repos if repo["full_name"] in only]
+
+        report = {}
+        for repo in repos:
+            try:
+                stale = await self.prune_repo(repo)
+            except Exception:
+                log.exception("Failed to prune repo", extra={"repo": repo["full_name"]})
+                continue
+
+            if stale:
+                report[repo["full_name"]] = stale
+
+        log.info(
+            "Pruning pass finished",
+            extra={
+                "repos": len(repos),
+                "stale": sum(len(refs) for r in report.values() for refs in r.values()),
+                "dry_run": self.dry_run,
+            },
+        )
+        return report
+
+    async def prune_repo(self, repo: Dict) -> Dict[str, List[str]]:
+        """Delete the stale branches of one repository's destinations."""
+        src_fullname = repo["full_name"]
+
+        gh = self.gh.create_client(repo["owner"]["login"], repo["name"])
+        gl = self.gl.create_client(self.gl_user)
+
+        try:
+            repo_config = await get_repo_config(gh, src_fullname, refresh=True)
+        except BadRequest:
+            # most likely no .github/hubcast.yml, so nothing to mirror
+            log.debug("Skipping repo without config", extra={"repo": src_fullname})
+            return {}
+
+        # list the destinations before GitHub, so a branch mirrored while
+        # we're listing is always found on GitHub too and isn't deleted
+        destinations = repo_config.destinations
+        all_dest_refs = await asyncio.gather(
+            *(
+                ls_refs(dest_remote_url(gl, dest), ["refs/heads/"])
+                for dest in destinations
+            )
+        )
+        branches, prs = await asyncio.gather(
+            list_branches(repo["clone_url"]), gh.get_open_prs()
+        )
+
+        # a repository always has a branch, an empty listing means something
+        # went wrong on GitHub's side, not that every branch should go
+        if not branches:
+            log.warning(
+                "No branches found on GitHub, not pruning", extra={"repo": src_fullname}
+            )
+            return {}
+
+        # an open pull request keeps its branch even when its head can't be
+        # fetched anymore, like after its fork was deleted
+        wanted = set(branches) | fork_branches(src_fullname, prs)
+
+        report = {}
+        for dest, dest_refs in zip(destinations, all_dest_refs):
+            stale = {
+                ref: sha
+                for ref, sha in sorted(dest_refs.items())
+                if ref not in wanted
+                and (repo_config.prune_branches or PR_BRANCH.fullmatch(ref))
+            }
+            if not stale:
+                continue
+
+            report[dest.fullname] = list(stale)
+            log.info(
+                "Found stale destination branches",
+                extra={
+                    "repo": src_fullname,
+                    "dest": dest.fullname,
+                    "refs": len(stale),
+                    "dry_run": self.dry_run,
+                },
+            )
+            if not self.dry_run:
+                await self._delete(
+                    gl.for_dest(dest), src_fullname, dest_remote_url(gl, dest), stale
+                )
+
+        return report
+
+    async def _delete(
+        self, gl: GitLabClient, src_fullname: str, url: str, stale: Dict[str, str]
+    ):
+        gl_token = await gl.auth.authenticate_user(self.gl_user)
+
+        # deleting from the sha we listed means a branch pushed to since is
+        # rejected by GitLab instead of deleted
+        updates = [RefUpdate(ref, sha, NULL_SHA) for ref, sha in stale.items()]
+        for i in range(0, len(updates), self.batch_size):
+            if i:
+                await asyncio.sleep(self.batch_delay)
+
+            batch = updates[i : i + self.batch_size]
+            try:
+                results = await send_pack(
+                    url, batch, b"", username=self.gl_user, password=gl_token
+                )
+            except Exception:
+                log.exception(
+                    "Failed to delete stale branches",
+                    extra={"repo": src_fullname, "dest": url, "refs": len(batch)},
+                )
+                prune_failed.inc(len(batch), repo=src_fullname)
+                continue
+
+            for ref, reason in results.items():
+                if reason is None:
+                    prune_deleted.inc(repo=src_fullname)
+                else:
+                    log.warning(
+                        "Stale branch deletion rejected",
+                        extra={
+                            "repo": src_fullname,
+                            "dest": url,
+                            "target_ref": ref,
+                            "reason": reason,
+                        },
+                    )
+                    prune_failed.inc(repo=src_fullname)
@@ -0,0 +1,210 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Dict, List, Optional, Set
+
+from gidgethub import BadRequest
+
+from hubcast import metrics
+from hubcast.clients.git import ls_refs
+from hubcast.clients.github import GitHubClientFactory
+from hubcast.clients.gitlab import GitLabInstances
+from hubcast.web.github.mirror import dest_remote_url, mirror_ref
+from hubcast.web.github.utils import load_repo_config
+
+log = logging.getLogger(__name__)
+
+reconcile_syncs = metrics.counter(
+    "hubcast_reconcile_syncs_total",
+    "Refs found out of date by the reconciler and synced.",
+)
+reconcile_failures = metrics.counter(
+    "hubcast_reconcile_failures_total",
+    "Refs found out of date by the reconciler which failed to sync.",
+)
+reconcile_duration = metrics.histogram(
+    "hubcast_reconcile_duration_seconds",
+    "Time taken by a full reconciliation pass.",
+    buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1800),
+)
+
+
+def fork_branches(src_fullname: str, prs: List[Dict]) -> Set[str]:
+    """
+    Return the pr-<number> destination branch of every open pull request
+    from a fork, whether or not its head can still be fetched.
+    """
+    return {
+        f"refs/heads/pr-{pr['number']}"
+        for pr in prs
+        if pr["head"]["repo"] is None or pr["head"]["repo"]["full_name"] != src_fullname
+    }
+
+
+async def list_branches(src_repo_url: str) -> Dict[str, str]:
+    """Return the head of every branch of a repository, by ref."""
+    return await ls_refs(src_repo_url, ["refs/heads/"])
+
+
+class Reconciler:
+    """
+    Compares the branch heads of every repository the GitHub App is
+    installed on against their destination refs, and syncs those that
+    differ. This catches up on any webhooks missed during downtime.
+
+    Only the repository's own branches are reconciled, which only those
+    with write access to it can push to. Pull requests from forks are left
+    to their webhooks and to approval comments, so no commit is mirrored,
+    and has CI run on it, without someone in the account map having sent
+    or approved it.
+
+    Attributes
+    ----------
+    gl_user: str
+        The GitLab user reconciliation syncs are pushed as.
+    interval: float
+        Seconds between the end of one pass and the start of the next.
+    jitter: float
+        Up to this many seconds are randomly added to each interval so
+        replicas don't reconcile in lockstep.
+    concurrency: int
+        Number of repositories and of syncs within a repository processed
+        at once.
+    """
+
+    def __init__(
+        self,
+        github_client_factory: GitHubClientFactory,
+        gitlab_client_factory: GitLabInstances,
+        gl_user: str,
+        interval: float = 3600,
+        jitter: float = 60,
+        concurrency: int = 4,
+    ):
+        self.gh = github_client_factory
+        self.gl = gitlab_client_factory
+        self.gl_user = gl_user
+        self.interval = interval
+        self.jitter = jitter
+        self.concurrency = concurrency
+
+    async def run(self):
+        """Reconcile every installed repository forever, starting right away."""
+        while True:
+            await asyncio.sleep(random.uniform(0, self.jitter))  # nosec B311
+
+            try:
+                await self.reconcile_all()
+            except Exception:
+                log.exception("Reconciliation pass failed")
+
+            await asyncio.sleep(self.interval)
+
+    async def reconcile_all(self, only: Optional[List[str]] = None) -> int:
+        """
+        Reconcile every installed repository, or only those whose full name
+        is in `only`. Returns the number of refs synced.
+        """
+        start = time.monotonic()
+        repos = await self.gh.get_installed_repos()
+        if only is not None:
+            repos = [repo for repo in repos if repo["full_name"] in only]
+
+        slots = asyncio.Semaphore(self.concurrency)
+
+        async def reconcile(repo):
+            async with slots:
+                try:
+                    return await self.reconcile_repo(repo)
+                except Exception:
+                    log.exception(
+                        "Failed to reconcile repo", extra={"repo": repo["full_name"]}
+                    )
+                    return 0
+
+        synced = sum(await asyncio.gather(*(reconcile(repo) for repo in repos)))
+
+        elapsed = time.monotonic() - start
+        reconcile_duration.observe(elapsed)
+        log.info(
+            "Reconciliation pass finished",
+            extra={"repos": len(repos), "synced": synced, "seconds": elapsed},
+        )
+        return synced
+
+    async def reconcile_repo(self, repo: Dict) -> int:
+        """
+        Sync the refs of one repository which differ from its destinations,
+        returning the number synced.
+        """
+        src_fullname = repo["full_name"]
+        src_repo_url = repo["clone_url"]
+
+        gh = self.gh.create_client(repo["owner"]["login"], repo["name"])
+        gl = self.gl.create_client(self.gl_user)
+
+        snapshot = await gh.get_repo_snapshot()
+        try:
+            repo_config = await load_repo_config(gh, src_fullname, snapshot.config)
+        except BadRequest:
+            # most likely no .github/hubcast.yml, so nothing to mirror
+            log.debug("Skipping repo without config", extra={"repo": src_fullname})
+            return 0
+
+        destinations = repo_config.destinations
+        # only branches are compared, so leave the pull request and merge
+        # request refs out of the advertisements
+        branches, *all_dest_refs = await asyncio.gather(
+            list_branches(src_repo_url),
+            *(
+                ls_refs(dest_remote_url(gl, dest), ["refs/heads/"])
+                for dest in destinations
+            ),
+        )
+
+        stale = [
+            (ref, sha)
+            for ref, sha in branches.items()
+            if any(dest_refs.get(ref) != sha for dest_refs in all_dest_refs)
+        ]
+        if not stale:
+            return 0
+
+        log.info(
+            "Reconciling out of date refs",
+            extra={"repo": src_fullname, "refs": len(stale)},
+        )
+
+        slots = asyncio.Semaphore(self.concurrency)
+
+        async def sync(ref, sha):
+            async with slots:
+                await mirror_ref(
+                    gl,
+                    self.gl_user,
+                    src_fullname,
+                    src_repo_url,
+                    ref,
+                    sha,
+                    destinations,
+                    max_pack_size=repo_config.max_pack_size,
+                )
+
+        results = await asyncio.gather(
+            *(sync(ref, sha) for ref, sha in stale), return_exceptions=True
+        )
+        failed = 0
+        for (ref, _), result in zip(stale, results):
+            if isinstance(result, Exception):
+                failed += 1
+                log.error(
+                    "Failed to reconcile ref",
+                    exc_info=result,
+                    extra={"repo": src_fullname, "target_ref": ref},
+                )
+
+        reconcile_syncs.inc(len(stale) - failed, repo=src_fullname)
+        if failed:
+            reconcile_failures.inc(failed, repo=src_fullname)
+        return len(stale) - failed
@@ -1,12 +1,25 @@
+import asyncio
 import logging
 import re
-from typing import Any
+from typing import Any, Optional
 
 from gidgethub import routing, sansio
-from repligit.asyncio import fetch_pack, ls_remote, send_pack
 
 from hubcast.web import comments
-from hubcast.web.github.utils import get_repo_config
+from hubcast.web.context import EventContext
+from hubcast.web.github.mirror import (
+    MirrorRefused,
+    delete_ref,
+    mirror_ref,
+    pull_source,
+)
+from hubcast.web.github.utils import (
+    gather_or_cancel,
+    get_repo_config,
+    load_repo_config,
+)
+from hubcast.web.gitlab import pipelines
+from hubcast.web.jobs import set_failed, set_step
 
 log = logging.getLogger(__name__)
 
@@ -18,12 +31,15 @@ class GitHubRouter(routing.Router):
 
     async def dispatch(self, event: sansio.Event, *args: Any, **kwargs: Any) -> None:
         """Dispatch an event to all registered function(s)."""
+        # every callback of the event shares its reads
+        kwargs.setdefault("ctx", EventContext())
         found_callbacks = self.fetch(event)
         for callback in found_callbacks:
             try:
                 await callback(event, *args, **kwargs)
             except Exception:
                 # this catches errors related to processing of webhook events
+                set_failed()
                 log.exception(
                     "Failed to process GitHub webhook event",
                     extra={
@@ -40,7 +56,7 @@ router = GitHubRouter()
 # Push Events
 # -----------------------------------
 @router.register("push", deleted=False)
-async def sync_branch(event, gh, gl, gl_user, *arg, **kwargs):
+async def sync_branch(event, gh, gl, gl_user, *arg, ctx, **kwargs):
     """Sync the git branch referenced to GitLab."""
     src_repo_url = event.data["repository"]["clone_url"]
     src_fullname = event.data["repository"]["full_name"]
@@ -48,87 +64,81 @@ async def sync_branch(event, gh, gl, gl_user, *arg, **kwargs):
     want_sha = event.data["head_commit"]["id"]
     target_ref = event.data["ref"]
 
-    # skip branches from push events that are also pull requests
-    if await gh.get_prs(branch=target_ref):
+    # skip branches from push events that are also pull requests, the config
+    # is read at the same time as it's needed in every other case
+    prs, repo_config = await gather_or_cancel(
+        gh.get_prs(branch=target_ref),
+        get_repo_config(gh, src_fullname, refresh=True, ctx=ctx),
+    )
+    if prs:
         return
 
-    repo_config = await get_repo_config(gh, src_fullname, refresh=True)
-
-    dest_fullname = f"{repo_config.dest_org}/{repo_config.dest_name}"
-    dest_remote_url = f"{gl.instance_url}/{dest_fullname}.git"
-
-    # setup callback webhook on GitLab
-    webhook_data = {
-        "gh_owner": src_owner,
-        "gh_repo": src_repo_name,
-        "gh_check": repo_config.check_name,
-    }
-    await gl.set_webhook(dest_fullname, webhook_data)
-
-    # sync commits from GitHub -> GitLab
-    gl_refs = await ls_remote(dest_remote_url)
-    have_shas = set(gl_refs.values())
-    from_sha = gl_refs.get(target_ref) or ("0" * 40)
-
-    if want_sha in have_shas:
-        log.info(
-            "Target ref already up-to-date",
-            extra={"repo": src_fullname, "target_ref": target_ref},
+    # setup callback webhooks on GitLab before syncing commits from GitHub ->
+    # GitLab, so the pipeline the push starts reports to each destination's
+    # own check
+    await set_webhooks(gl, src_owner, src_repo_name, repo_config.destinations)
+
+    try:
+        await mirror_ref(
+            gl,
+            gl_user,
+            src_fullname,
+            src_repo_url,
+            target_ref,
+            want_sha,
+            repo_config.destinations,
+            ctx=ctx,
+            max_pack_size=repo_config.max_pack_size,
         )
-        return
+    except MirrorRefused as exc:
+        await report_refused(gh, repo_config.destinations, want_sha, exc)
 
-    packfile = await fetch_pack(
-        src_repo_url,
-        want_sha,
-        have_shas,
-    )
-
-    gl_token = await gl.auth.authenticate_user(gl_user)
 
-    log.info(
-        "Mirroring refs",
-        extra={
-            "repo": src_fullname,
-            "from_sha": from_sha,
-            "want_sha": want_sha,
-        },
-    )
-    await send_pack(
-        dest_remote_url,
-        target_ref,
-        from_sha,
-        want_sha,
-        packfile,
-        username=gl_user,
-        password=gl_token,
+async def set_webhooks(gl, src_owner, src_repo_name, destinations):
+    """
+    Set the webhook of every destination at once. A destination whose
+    webhook can't be set is still mirrored, its pipelines are then only
+    picked up by the pipeline poller.
+    """
+    results = await asyncio.gather(
+        *(
+            gl.for_dest(dest).set_webhook(
+                dest.fullname,
+                {
+                    "gh_owner": src_owner,
+                    "gh_repo": src_repo_name,
+                    "gh_check": dest.check_name,
+                },
+            )
+            for dest in destinations
+        ),
+        return_exceptions=True,
     )
+    for dest, result in zip(destinations, results):
+        if isinstance(result, Exception):
+            log.error(
+                "Failed to set GitLab webhook",
+                exc_info=result,
+                extra={"dest": dest.fullname},
+            )
 
 
 @router.register("push", deleted=True)
-async def remove_branch(event, gh, gl, gl_user, *arg, **kwargs):
+async def remove_branch(event, gh, gl, gl_user, *arg, ctx, **kwargs):
+    src_repo_url = event.data["repository"]["clone_url"]
     src_fullname = event.data["repository"]["full_name"]
     target_ref = event.data["ref"]
 
-    repo_config = await get_repo_config(gh, src_fullname, refresh=True)
-
-    dest_fullname = f"{repo_config.dest_org}/{repo_config.dest_name}"
-    dest_remote_url = f"{gl.instance_url}/{dest_fullname}.git"
-
-    gl_refs = await ls_remote(dest_remote_url)
-    head_sha = gl_refs.get(target_ref)
-    null_sha = "0" * 40
-
-    gl_token = await gl.auth.authenticate_user(gl_user)
+    repo_config = await get_repo_config(gh, src_fullname, refresh=True, ctx=ctx)
 
-    log.info("Deleting ref", extra={"repo": src_fullname, "target_ref": target_ref})
-    await send_pack(
-        dest_remote_url,
+    await delete_ref(
+        gl,
+        gl_user,
+        src_fullname,
+        src_repo_url,
         target_ref,
-        head_sha,
-        null_sha,
-        b"",
-        username=gl_user,
-        password=gl_token,
+        repo_config.destinations,
+        ctx=ctx,
     )
 
 
@@ -137,124 +147,180 @@ async def remove_branch(event, gh, gl, gl_user, *arg, **kwargs):
 # -----------------------------------
 
 
-async def sync_pr(pull_request, gh, gl, gl_user):
+def is_fork(pull_request) -> bool:
+    """Return whether a PR comes from a fork, which may since have been deleted."""
+    head_repo = pull_request["head"]["repo"]
+    return (
+        head_repo is None
+        or head_repo["full_name"] != pull_request["base"]["repo"]["full_name"]
+    )
+
+
+def head_fullname(pull_request) -> str:
+    """Return the name of a PR's head repository, the base's if it's gone."""
+    head_repo = pull_request["head"]["repo"] or pull_request["base"]["repo"]
+    return head_repo["full_name"]
+
+
+async def sync_pr(pull_request, gh, gl, gl_user, ctx=None):
     """Sync the git fork/branch referenced in a PR to GitLab.
 
     This isn't technically an event handler, but is used a couple different ways in this file.
     """
     pull_request_id = pull_request["number"]
 
-    src_repo_url = pull_request["head"]["repo"]["clone_url"]
-    src_fullname = pull_request["head"]["repo"]["full_name"]
+    head_repo = pull_request["head"]["repo"]
+    src_fullname = head_fullname(pull_request)
     want_sha = pull_request["head"]["sha"]
 
     # pull requests coming from forks are pushed as branches in the form of
     # pr-<pr-number> instead of as their branch name as conflicts could occur
     # between multiple repositories
-    is_pull_request_fork = src_fullname != pull_request["base"]["repo"]["full_name"]
-    if is_pull_request_fork:
+    if is_fork(pull_request):
         target_ref = f"refs/heads/pr-{pull_request_id}"
+        src_repo_url = await pull_source(
+            pull_request["base"]["repo"]["clone_url"],
+            head_repo["clone_url"] if head_repo else None,
+            pull_request_id,
+            want_sha,
+        )
+        if src_repo_url is None:
+            log.warning(
+                "Pull request head not found",
+                extra={"repo": src_fullname, "pr": pull_request_id, "sha": want_sha},
+            )
+            return
     else:
+        src_repo_url = head_repo["clone_url"]
         target_ref = f"refs/heads/{pull_request['head']['ref']}"
 
     # get the repository configuration from .github/hubcast.yml
-    repo_config = await get_repo_config(gh, src_fullname)
+    repo_config = await get_repo_config(gh, src_fullname, ctx=ctx)
+
+    try:
+        # named after the base repository, which forks' packs are fetched
+        # from and which their metrics belong to
+        await mirror_ref(
+            gl,
+            gl_user,
+            pull_request["base"]["repo"]["full_name"],
+            src_repo_url,
+            target_ref,
+            want_sha,
+            repo_config.destinations,
+            base_ref=f"refs/heads/{pull_request['base']['ref']}",
+            ctx=ctx,
+            max_pack_size=repo_config.max_pack_size,
+        )
+    except MirrorRefused as exc:
+        await report_refused(gh, repo_config.destinations, want_sha, exc)
 
-    dest_fullname = f"{repo_config.dest_org}/{repo_config.dest_name}"
-    dest_remote_url = f"{gl.instance_url}/{dest_fullname}.git"
 
-    gl_refs = await ls_remote(dest_remote_url)
-    have_shas = set(gl_refs.values())
-    from_sha = gl_refs.get(target_ref) or ("0" * 40)
+def format_size(size: int) -> str:
+    for unit in ("bytes", "KiB", "MiB"):
+        if size < 1024:
+            return f"{size:.4g} {unit}"
+        size /= 1024
+    return f"{size:.4g} GiB"
 
-    if want_sha in have_shas:
-        log.info(
-            "Target ref already up-to-date",
-            extra={"repo": src_fullname, "target_ref": target_ref},
-        )
-        return
 
-    # fetch differential packfile with all new commits
-    packfile = await fetch_pack(
-        src_repo_url,
-        want_sha,
-        have_shas,
+async def report_refused(gh, destinations, sha, exc: MirrorRefused):
+    """Fail the checks of a commit which was too large to mirror, saying why."""
+    summary = (
+        f"This commit wasn't mirrored to GitLab, the objects it adds come to "
+        f"more than the {format_size(exc.limit)} allowed for this "
+        f"repository. The limit can be changed with `max_pack_size` in "
+        f"`.github/hubcast.yml`."
+    )
+    await gather_or_cancel(
+        *(
+            gh.fail_check(sha, dest.check_name, "Commit too large to mirror", summary)
+            for dest in destinations
+        )
     )
 
-    gl_token = await gl.auth.authenticate_user(gl_user)
 
-    # upload packfile to gitlab repository
-    log.info(
-        "Mirroring refs",
-        extra={
-            "repo": src_fullname,
-            "from_sha": from_sha,
-            "want_sha": want_sha,
-        },
+async def run_pipeline(gh, gl, dest, branch) -> Optional[str]:
+    """Run a pipeline on a destination branch, returning its url."""
+    pipeline = await gl.for_dest(dest).run_pipeline(dest.fullname, branch)
+
+    # watch the pipeline from the start, in case its webhooks never arrive
+    pipelines.tracker.observe(
+        dest.fullname,
+        pipeline["id"],
+        pipeline["sha"],
+        pipeline["status"],
+        pipeline["web_url"],
+        gh.repo_owner,
+        gh.repo_name,
+        dest.check_name,
+        gl.user,
+        dest.instance,
     )
-    await send_pack(
-        dest_remote_url,
-        target_ref,
-        from_sha,
-        want_sha,
-        packfile,
-        username=gl_user,
-        password=gl_token,
+
+    return pipeline.get("web_url")
+
+
+async def get_pr_and_config(gh, pull_request_id, ctx):
+    """
+    Read a PR and the repo config in one request, caching the config for
+    sync_pr.
+    """
+    set_step("reading pull request and repo config")
+    snapshot = await ctx.memo(
+        ("pr", pull_request_id),
+        lambda: gh.get_repo_snapshot(pr_numbers=[pull_request_id]),
     )
+    pull_request = snapshot.prs[pull_request_id]
+
+    # sync_pr looks the config up by the name of the PR's head repository
+    src_fullname = head_fullname(pull_request)
+    repo_config = await load_repo_config(gh, src_fullname, snapshot.config, ctx)
+    return pull_request, repo_config
 
 
 @router.register("pull_request", action="opened")
 @router.register("pull_request", action="reopened")
 @router.register("pull_request", action="synchronize")
-async def sync_pr_event(event, gh, gl, gl_user, *arg, **kwargs):
+async def sync_pr_event(event, gh, gl, gl_user, *arg, ctx, **kwargs):
     """Sync the git fork/branch referenced in a PR to GitLab."""
     pull_request = event.data["pull_request"]
-    await sync_pr(pull_request, gh, gl, gl_user)
+    await sync_pr(pull_request, gh, gl, gl_user, ctx)
 
 
 @router.register("pull_request", action="closed")
-async def remove_pr(event, gh, gl, gl_user, *arg, **kwargs):
+async def remove_pr(event, gh, gl, gl_user, *arg, ctx, **kwargs):
     pull_request = event.data["pull_request"]
-    src_fullname = pull_request["head"]["repo"]["full_name"]
+    src_repo_url = pull_request["base"]["repo"]["clone_url"]
+    src_fullname = head_fullname(pull_request)
 
     # if the pull request comes from a fork we should clean up
     # the branch upon closing or merging the PR. However, if the
     # pull request comes from an internal branch we should wait
     # to clean up the branch when the branch is deleted from the
     # internal repository
-    is_pull_request_fork = src_fullname != pull_request["base"]["repo"]["full_name"]
-    if not is_pull_request_fork:
+    if not is_fork(pull_request):
         return
 
     pull_request_id = pull_request["number"]
     target_ref = f"refs/heads/pr-{pull_request_id}"
 
     # get the repository configuration from .github/hubcast.yml
-    repo_config = await get_repo_config(gh, src_fullname)
-
-    dest_fullname = f"{repo_config.dest_org}/{repo_config.dest_name}"
-    dest_remote_url = f"{gl.instance_url}/{dest_fullname}.git"
-
-    gl_refs = await ls_remote(dest_remote_url)
-    head_sha = gl_refs.get(target_ref)
-    null_sha = "0" * 40
+    repo_config = await get_repo_config(gh, src_fullname, ctx=ctx)
 
-    gl_token = await gl.auth.authenticate_user(gl_user)
-
-    log.info("Deleting ref", extra={"repo": src_fullname, "target_ref": target_ref})
-    await send_pack(
-        dest_remote_url,
+    await delete_ref(
+        gl,
+        gl_user,
+        src_fullname,
+        src_repo_url,
         target_ref,
-        head_sha,
-        null_sha,
-        b"",
-        username=gl_user,
-        password=gl_token,
+        repo_config.destinations,
+        ctx=ctx,
     )
 
 
 @router.register("issue_comment", action="created")
-async def respond_comment(event, gh, gl, gl_user, *arg, **kwargs):
+async def respond_comment(event, gh, gl, gl_user, *arg, ctx, **kwargs):
     # differentiate issue vs PR comment
     if "pull_request" not in event.data["issue"]:
         return
@@ -270,8 +336,8 @@ async def respond_comment(event, gh, gl, gl_user, *arg, **kwargs):
         # syncs PR changes to the destination on behalf of the commenter
         # this does not handle PR deletions, those will need to be manually cleaned by project maintainers
         pull_request_id = event.data["issue"]["number"]
-        pull_request = await gh.get_pr(pull_request_id)
-        await sync_pr(pull_request, gh, gl, gl_user)
+        pull_request, _ = await get_pr_and_config(gh, pull_request_id, ctx)
+        await sync_pr(pull_request, gh, gl, gl_user, ctx)
 
         # note: the user will see a +1 regardless of whether a sync truly occurred
         plus_one = True
@@ -280,28 +346,31 @@ async def respond_comment(event, gh, gl, gl_user, *arg, **kwargs):
         f"@{gh.bot_user} (re[-]?)?(run|start) pipeline", comment, re.IGNORECASE
     ):
         pull_request_id = event.data["issue"]["number"]
-        pull_request = await gh.get_pr(pull_request_id)
+        pull_request, repo_config = await get_pr_and_config(gh, pull_request_id, ctx)
         # sync the PR in case it fell out of sync
-        await sync_pr(pull_request, gh, gl, gl_user)
+        await sync_pr(pull_request, gh, gl, gl_user, ctx)
 
         # get the branch this PR belongs to
-        src_fullname = pull_request["head"]["repo"]["full_name"]
         # pull requests coming from forks are pushed as branches in the form of
         # pr-<pr-number> instead of as their branch name as conflicts could occur
         # between multiple repositories
-        is_pull_request_fork = src_fullname != pull_request["base"]["repo"]["full_name"]
-        if is_pull_request_fork:
+        if is_fork(pull_request):
             branch = f"pr-{pull_request_id}"
         else:
             branch = pull_request["head"]["ref"]
 
-        # get the gitlab repo information and run the pipeline
-        repo_config = await get_repo_config(gh, src_fullname, refresh=True)
-        dest_fullname = f"{repo_config.dest_org}/{repo_config.dest_name}"
-        pipeline_url = await gl.run_pipeline(dest_fullname, branch)
+        # run a pipeline on each destination
+        pipeline_urls = await gather_or_cancel(
+            *(run_pipeline(gh, gl, dest, branch) for dest in repo_config.destinations)
+        )
 
-        if pipeline_url:
-            response = f"I've started a new [pipeline]({pipeline_url}) for you!"
+        started = [url for url in pipeline_urls if url]
+        if len(started) == 1 and len(pipeline_urls) == 1:
+            response = f"I've started a new [pipeline]({started[0]}) for you!"
+            plus_one = True
+        elif started and len(started) == len(pipeline_urls):
+            links = ", ".join(f"[pipeline]({url})" for url in started)
+            response = f"I've started new pipelines for you! {links}"
             plus_one = True
         else:
             response = "I had a problem starting the pipeline."
@@ -310,49 +379,60 @@ async def respond_comment(event, gh, gl, gl_user, *arg, **kwargs):
         f"@{gh.bot_user} restart failed(?:[- ]?jobs)?", comment, re.IGNORECASE
     ):
         pull_request_id = event.data["issue"]["number"]
-        pull_request = await gh.get_pr(pull_request_id)
+        pull_request, repo_config = await get_pr_and_config(gh, pull_request_id, ctx)
         # if a pipeline failed, we give the user the option to restart any failed jobs
         # we don't want to re-sync the branch, as a new pipeline would be created
         # and would defeat the purpose of individually restarting failed jobs
 
         # get the branch this PR belongs to
-        src_fullname = pull_request["head"]["repo"]["full_name"]
         # pull requests coming from forks are pushed as branches in the form of
         # pr-<pr-number> instead of as their branch name as conflicts could occur
         # between multiple repositories
-        is_pull_request_fork = src_fullname != pull_request["base"]["repo"]["full_name"]
-        if is_pull_request_fork:
+        if is_fork(pull_request):
             branch = f"pr-{pull_request_id}"
         else:
             branch = pull_request["head"]["ref"]
 
-        # get the gitlab repo information and run the pipeline
-        repo_config = await get_repo_config(gh, src_fullname, refresh=True)
-        dest_fullname = f"{repo_config.dest_org}/{repo_config.dest_name}"
-        pipeline_id = await gl.get_latest_pipeline(dest_fullname, branch)
-
-        if pipeline_id:
-            pipeline_url = await gl.retry_pipeline_jobs(dest_fullname, pipeline_id)
+        # retry the latest pipeline on each destination
+        async def retry_latest(dest):
+            dest_gl = gl.for_dest(dest)
+            pipeline_id = await dest_gl.get_latest_pipeline(dest.fullname, branch)
+            if not pipeline_id:
+                return None, None
+            pipeline_url = await dest_gl.retry_pipeline_jobs(dest.fullname, pipeline_id)
+            return pipeline_id, pipeline_url
+
+        results = await gather_or_cancel(
+            *(retry_latest(dest) for dest in repo_config.destinations)
+        )
 
-            if pipeline_url:
-                response = (
-                    f"I've retried any failed jobs in the [pipeline]({pipeline_url})!"
-                )
-                plus_one = True
-            else:
-                response = "I had a problem retrying jobs in the pipeline."
-        else:
+        pipeline_urls = [url for pipeline_id, url in results if pipeline_id]
+        if not pipeline_urls:
             response = "No pipeline exists."
+        elif not all(pipeline_urls):
+            response = "I had a problem retrying jobs in the pipeline."
+        elif len(pipeline_urls) == 1:
+            response = (
+                f"I've retried any failed jobs in the [pipeline]({pipeline_urls[0]})!"
+            )
+            plus_one = True
+        else:
+            links = ", ".join(f"[pipeline]({url})" for url in pipeline_urls)
+            response = f"I've retried any failed jobs in the pipelines! {links}"
+            plus_one = True
 
+    replies = []
     if response:
-        await gh.post_comment(event.data["issue"]["number"], response)
+        replies.append(gh.post_comment(event.data["issue"]["number"], response))
 
     if plus_one:
-        await gh.react_to_comment(event.data["comment"]["id"], "+1")
+        replies.append(gh.react_to_comment(event.data["comment"]["id"], "+1"))
+
+    await gather_or_cancel(*replies)
 
 
 @router.register("check_run", action="rerequested")
-async def rerun_check(event, gh, gl, gl_user, *arg, **kwargs):
+async def rerun_check(event, gh, gl, gl_user, *arg, ctx, **kwargs):
     """
     Handles a user re-running a check run for the latest commit in the branch.
     See https://docs.github.com/en/webhooks/webhook-events-and-payloads?actionType=rerequested#check_run.
@@ -360,17 +440,23 @@ async def rerun_check(event, gh, gl, gl_user, *arg, **kwargs):
     src_fullname = event.data["repository"]["full_name"]
     branch = event.data["check_run"]["check_suite"]["head_branch"]
     check_run_commit = event.data["check_run"]["head_sha"]
+    check_name = event.data["check_run"]["name"]
 
-    # get the latest commit on the branch from GH
-    branch_data = await gh.get_branch(branch)
-    latest_commit = branch_data["commit"]["sha"]
+    # get the latest commit on the branch and the repo config from GH at once
+    set_step("reading branch and repo config")
+    snapshot = await gh.get_repo_snapshot(branches=[branch])
+    latest_commit = snapshot.branches[branch]
 
     # only rerun if this commit is the head of the branch
     if check_run_commit != latest_commit:
         log.info("user tried to re-run check for old commit")
         return
 
-    # get the GL repo info and run the pipeline
-    repo_config = await get_repo_config(gh, src_fullname, refresh=True)
-    dest_fullname = f"{repo_config.dest_org}/{repo_config.dest_name}"
-    await gl.run_pipeline(dest_fullname, branch)
+    # run the pipeline of the destination reporting to this check
+    repo_config = await load_repo_config(gh, src_fullname, snapshot.config, ctx)
+    for dest in repo_config.destinations:
+        if dest.check_name == check_name:
+            await run_pipeline(gh, gl, dest, branch)
+            return
+
+    log.info("no destination reports to check", extra={"check_name": check_name})
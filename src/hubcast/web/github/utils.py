@@ -1,32 +1,140 @@
+import asyncio
 import logging
-from typing import Dict
+from typing import Any, Awaitable, Dict, List, Optional
 
 from hubcast.clients.github import GitHubClient
 from hubcast.clients.github.client import InvalidConfigYAMLError
-from hubcast.repos.config import RepoConfig
+from hubcast.clients.utils import LookupCache
+from hubcast.config import DEFAULT_INSTANCE, parse_size
+from hubcast.repos.config import Destination, RepoConfig
+from hubcast.web.context import EventContext
+from hubcast.web.jobs import set_step
 
-config_cache = dict()
+# the repo config files read, replaced on startup with the configured backend
+config_cache = LookupCache("repo_config")
 log = logging.getLogger(__name__)
 
 
+async def gather_or_cancel(*aws: Awaitable) -> List[Any]:
+    """
+    Run awaitables concurrently and return their results in order, like
+    asyncio.gather, except that as soon as one fails the others are
+    cancelled, and its error is raised once they've all stopped.
+    """
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    if not tasks:
+        return []
+
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+    finally:
+        # only cancels the tasks still running, also when we're cancelled
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    for task in tasks:
+        if not task.cancelled() and task.exception() is not None:
+            raise task.exception()
+    return [task.result() for task in tasks]
+
+
 def create_config(fullname: str, data: Dict) -> RepoConfig:
+    # Repo may be a single destination or a list of them
+    repos = data["Repo"]
+    if isinstance(repos, dict):
+        repos = [repos]
+
+    destinations = []
+    for i, repo in enumerate(repos):
+        # every destination reports to its own check, later destinations
+        # default to a check name including the destination repository
+        default_check = "gitlab-ci"
+        if i > 0:
+            default_check = f"gitlab-ci ({repo['owner']}/{repo['name']})"
+
+        destinations.append(
+            Destination(
+                org=repo["owner"],
+                name=repo["name"],
+                check_name=repo.get("check_name", default_check),
+                instance=str(repo.get("instance", DEFAULT_INSTANCE)),
+            )
+        )
+
+    max_pack_size = data.get("max_pack_size")
+    if max_pack_size is not None:
+        try:
+            max_pack_size = parse_size(max_pack_size)
+        except ValueError:
+            log.warning(
+                "Ignoring invalid max_pack_size in repo config",
+                extra={"repo": fullname, "max_pack_size": str(max_pack_size)},
+            )
+            max_pack_size = None
+
     return RepoConfig(
         fullname=fullname,
-        dest_org=data["Repo"]["owner"],
-        dest_name=data["Repo"]["name"],
+        dest_org=destinations[0].org,
+        dest_name=destinations[0].name,
+        check_name=destinations[0].check_name,
+        destinations=destinations,
+        max_pack_size=max_pack_size,
+        prune_branches=bool(data.get("prune_branches", False)),
     )
 
 
-async def get_repo_config(gh: GitHubClient, fullname: str, refresh: bool = False):
-    if fullname in config_cache and not refresh:
-        config = config_cache[fullname]
-    else:
+async def get_repo_config(
+    gh: GitHubClient,
+    fullname: str,
+    refresh: bool = False,
+    ctx: Optional[EventContext] = None,
+):
+    # a config read during the event is as fresh as a refresh would be
+    key = ("repo_config", fullname)
+    if ctx is not None and (refresh or key in ctx):
+        return await ctx.memo(key, lambda: _read_repo_config(gh, fullname, True))
+
+    return await _read_repo_config(gh, fullname, refresh)
+
+
+async def _read_repo_config(gh: GitHubClient, fullname: str, refresh: bool):
+    # the file's data is cached rather than the RepoConfig, so it can be
+    # stored as JSON and shared
+    data = None
+    if not refresh:
+        data = await config_cache.get(fullname)
+
+    if data is None:
+        set_step("reading repo config")
         try:
             data = await gh.get_repo_config()
         except InvalidConfigYAMLError:
             log.exception("Repo config parse failed")
 
         config = create_config(fullname, data)
-        config_cache[fullname] = config
+        await config_cache.set(fullname, data)
+        return config
+
+    return create_config(fullname, data)
+
+
+async def load_repo_config(
+    gh: GitHubClient,
+    fullname: str,
+    data: Optional[Dict],
+    ctx: Optional[EventContext] = None,
+) -> RepoConfig:
+    """
+    Cache and return a repo config read along with other data, as by
+    GitHubClient.get_repo_snapshot. When none was found it's requested on
+    its own, failing the same way get_repo_config does.
+    """
+    if data is None:
+        return await get_repo_config(gh, fullname, refresh=True, ctx=ctx)
 
+    config = create_config(fullname, data)
+    await config_cache.set(fullname, data)
+    if ctx is not None:
+        ctx.remember(("repo_config", fullname), config)
     return config
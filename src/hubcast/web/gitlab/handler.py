@@ -1,46 +1,81 @@
 import logging
+from typing import Dict, Mapping, Optional, Tuple
 
 from aiohttp import web
-from aiojobs.aiohttp import spawn
 from gidgetlab import sansio
 from gidgetlab.exceptions import ValidationFailure
 
 from hubcast.clients.github import GitHubClientFactory
+from hubcast.config import DEFAULT_INSTANCE
+from hubcast.web.context import EventContext
+from hubcast.web.dedup import (
+    DeliveryCache,
+    content_key,
+    webhooks_duplicate,
+    webhooks_received,
+)
+from hubcast.web.jobs import EventJob, JobTracker
 
 from .routes import router
 
 log = logging.getLogger(__name__)
 
 
+def ordering(event: sansio.Event) -> Tuple[Optional[str], bool]:
+    """
+    Return the lane an event is processed in order within, and whether it
+    supersedes the earlier events of its lane still waiting.
+    """
+    if event.event == "Pipeline Hook":
+        # every hook carries the pipeline's whole status, the latest wins
+        return f"pipeline/{event.data['object_attributes']['id']}", True
+    # job hooks are batched by the relay, which needs them to arrive together
+    return None, False
+
+
 class GitLabHandler:
-    def __init__(self, webhook_secret: str, github_client_factory: GitHubClientFactory):
-        self.webhook_secret = webhook_secret
+    def __init__(
+        self,
+        webhook_secrets: Dict[str, str],
+        github_client_factory: GitHubClientFactory,
+        deliveries: DeliveryCache,
+        jobs: JobTracker,
+    ):
+        # the secret of each GitLab instance's webhooks, by instance name
+        self.webhook_secrets = webhook_secrets
         self.github_client_factory = github_client_factory
+        self.deliveries = deliveries
+        self.jobs = jobs
 
     async def handle(self, request):
+        # stop taking on new work once we're shutting down
+        if self.jobs.draining:
+            return web.Response(status=503)
+
+        delivery_key = None
         try:
             # read the GitLab webhook payload
             body = await request.read()
-            event = sansio.Event.from_http(
-                request.headers, body, secret=self.webhook_secret
-            )
+            instance = request.rel_url.query.get("gl_instance", DEFAULT_INSTANCE)
+            secret = self.webhook_secrets.get(instance)
+            if secret is None:
+                raise ValidationFailure(f"unknown GitLab instance {instance}")
+            event = sansio.Event.from_http(request.headers, body, secret=secret)
             log.info("GitLab webhook received", extra={"event_type": event.event})
+            webhooks_received.inc(source="gitlab")
 
-            # get coorisponding GitHub repo owner and name from event
-            # request variables
-            gh_repo_owner = request.rel_url.query["gh_owner"]
-            gh_repo = request.rel_url.query["gh_repo"]
+            # GitLab deliveries carry no id we can rely on, but a redelivered
+            # hook has an identical payload
+            delivery_key = content_key("gitlab", event.event, body)
+            if not self.deliveries.add(delivery_key):
+                log.info(
+                    "Duplicate GitLab webhook dropped",
+                    extra={"event_type": event.event},
+                )
+                webhooks_duplicate.inc(source="gitlab")
+                return web.Response(status=200)
 
-            github_client = self.github_client_factory.create_client(
-                gh_repo_owner, gh_repo
-            )
-
-            gh_check_name = request.rel_url.query["gh_check"]
-
-            await spawn(
-                request,
-                router.dispatch(event, github_client, gh_check_name),
-            )
+            await self.process(event, request.rel_url.query, delivery_key)
 
             # return a "Success"
             return web.Response(status=200)
@@ -52,4 +87,49 @@ class GitLabHandler:
 
         except Exception:
             log.exception("Failed to handle GitLab webhook")
+            # let a redelivery of this webhook be processed
+            if delivery_key:
+                self.deliveries.discard(delivery_key)
             return web.Response(status=500)
+
+    async def process(
+        self,
+        event: sansio.Event,
+        query: Mapping[str, str],
+        delivery_key: Optional[str] = None,
+    ):
+        """Start processing a verified GitLab event in the background."""
+        # get coorisponding GitHub repo owner and name from event
+        # request variables
+        gh_repo_owner = query["gh_owner"]
+        gh_repo = query["gh_repo"]
+
+        github_client = self.github_client_factory.create_client(gh_repo_owner, gh_repo)
+
+        gh_check_name = query["gh_check"]
+        instance = query.get("gl_instance", DEFAULT_INSTANCE)
+
+        lane, supersedes = ordering(event)
+        job = EventJob(
+            "gitlab",
+            event.event,
+            event.data,
+            query=query,
+            repo=f"{gh_repo_owner}/{gh_repo}",
+            lane=lane,
+            supersedes=supersedes,
+            delivery_key=delivery_key,
+        )
+        # reads made while handling the event are shared by its callbacks
+        ctx = EventContext()
+        await self.jobs.spawn(
+            router.dispatch(
+                event, github_client, gh_check_name, ctx=ctx, instance=instance
+            ),
+            job,
+        )
+
+    async def replay(self, job: EventJob):
+        """Process an event checkpointed by a previous instance."""
+        event = sansio.Event(job.data, event=job.event_type)
+        await self.process(event, job.query)
@@ -0,0 +1,281 @@
+import asyncio
+import logging
+from typing import Dict, List, Optional, Set
+
+from cachetools import TTLCache
+
+from hubcast.clients.github import GitHubClient
+from hubcast.config import DEFAULT_INSTANCE
+
+log = logging.getLogger(__name__)
+
+# GitLab job statuses and the check status each translates to, jobs in any
+# other status (created, manual, ...) haven't been started
+JOB_STATUSES = {
+    "pending": "queued",
+    "running": "in_progress",
+    "success": "success",
+    "failed": "failure",
+    "canceled": "cancelled",
+    "skipped": "skipped",
+}
+
+# GitHub refuses check run output text longer than this
+MAX_TEXT_LENGTH = 65535
+
+MODES = ("off", "summary", "checks")
+
+
+class _Job:
+    def __init__(self, job_id: int, name: str, stage: str, url: str):
+        self.job_id = job_id
+        self.name = name
+        self.stage = stage
+        self.url = url
+        self.status = "created"
+        self.allow_failure = False
+        # the status of the job's own check run last sent, in "checks" mode
+        self.sent: Optional[str] = None
+
+
+class _Pipeline:
+    def __init__(
+        self, pipeline_id: int, gh: GitHubClient, gh_check: str, sha: str, url: str
+    ):
+        self.pipeline_id = pipeline_id
+        self.gh = gh
+        self.gh_check = gh_check
+        self.sha = sha
+        self.url = url
+        self.jobs: Dict[int, _Job] = {}
+        # jobs whose status changed since the last flush
+        self.changed: Set[int] = set()
+        # jobs given their own check run in "checks" mode, the others are
+        # listed in the pipeline's check run instead
+        self.checked: Set[int] = set()
+        self.waiters: List[asyncio.Future] = []
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+class JobStatusRelay:
+    """
+    Relays the status of GitLab jobs to GitHub, gathering the updates of a
+    pipeline arriving within a short window into one flush.
+
+    In "summary" mode a table of every job is written to the output of the
+    pipeline's check run. In "checks" mode each job gets its own check run,
+    named after the pipeline's check and the job. Either way a job changing
+    status several times within a window is only sent once.
+
+    In "checks" mode a job's check run is only sent when its status differs
+    from the one last sent, and only the first `max_checks` jobs of a
+    pipeline get one. The jobs past those are collapsed into a table in the
+    pipeline's check run, as in "summary" mode, so large pipelines don't
+    cost a request per job.
+
+    Attributes
+    ----------
+    mode: str
+        "off", "summary" or "checks".
+    window: float
+        Seconds to wait for more job updates after the first one of a flush.
+    max_checks: int
+        Jobs of a pipeline given their own check run in "checks" mode.
+    """
+
+    def __init__(self, mode: str = "off", window: float = 2.0, max_checks: int = 20):
+        if mode not in MODES:
+            raise ValueError(f"Unknown job status mode: {mode}")
+
+        self.mode = mode
+        self.window = window
+        self.max_checks = max_checks
+        # (instance, pipeline id) -> jobs, pipeline ids are only unique
+        # within a GitLab instance
+        self._pipelines = TTLCache(maxsize=1000, ttl=86400)
+        self._tasks: Set[asyncio.Task] = set()
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != "off"
+
+    async def update(
+        self,
+        gh: GitHubClient,
+        gh_check: str,
+        data: Dict,
+        instance: str = DEFAULT_INSTANCE,
+    ) -> None:
+        """Queue the status of a job from a Job Hook payload of a GitLab
+        instance, waiting for it to be relayed."""
+        if not self.enabled:
+            return
+
+        pipeline_id = data["pipeline_id"]
+        job_url = f"{data['repository']['homepage']}/-/jobs/{data['build_id']}"
+
+        pipeline = self._pipelines.get((instance, pipeline_id))
+        if pipeline is None:
+            pipeline_url = f"{data['repository']['homepage']}/-/pipelines/{pipeline_id}"
+            pipeline = _Pipeline(pipeline_id, gh, gh_check, data["sha"], pipeline_url)
+            self._pipelines[(instance, pipeline_id)] = pipeline
+
+        job = pipeline.jobs.get(data["build_id"])
+        if job is None:
+            job = _Job(
+                data["build_id"], data["build_name"], data["build_stage"], job_url
+            )
+            pipeline.jobs[job.job_id] = job
+        job.status = data["build_status"]
+        job.allow_failure = data.get("build_allow_failure", False)
+        pipeline.changed.add(job.job_id)
+
+        loop = asyncio.get_running_loop()
+        if pipeline.timer is None:
+            # the pipeline itself is flushed, it may have been evicted by then
+            pipeline.timer = loop.call_later(self.window, self._flush, pipeline)
+
+        future = loop.create_future()
+        pipeline.waiters.append(future)
+        await future
+
+    def summary(
+        self, pipeline_id: int, instance: str = DEFAULT_INSTANCE
+    ) -> Optional[str]:
+        """
+        Return the table of job statuses written to a pipeline's check, of
+        every job in "summary" mode, or of those without their own check run
+        in "checks" mode.
+        """
+        if not self.enabled:
+            return None
+
+        pipeline = self._pipelines.get((instance, pipeline_id))
+        if pipeline is None:
+            return None
+        return self._table(pipeline)
+
+    def _table(self, pipeline: _Pipeline) -> Optional[str]:
+        jobs = list(pipeline.jobs.values())
+        if self.mode == "checks":
+            jobs = [job for job in jobs if job.job_id not in pipeline.checked]
+        if not jobs:
+            return None
+
+        # failed jobs first, then in the order GitLab runs them
+        jobs.sort(key=lambda job: (job.status != "failed", job.job_id))
+
+        lines = ["| Job | Stage | Status |", "| --- | --- | --- |"]
+        length = sum(len(line) + 1 for line in lines)
+        for i, job in enumerate(jobs):
+            status = job.status
+            if status == "failed" and job.allow_failure:
+                status = "failed (allowed to fail)"
+            line = f"| [{job.name}]({job.url}) | {job.stage} | {status} |"
+
+            length += len(line) + 1
+            if length > MAX_TEXT_LENGTH - 100:
+                lines.append(f"\n{len(jobs) - i} more jobs not shown.")
+                break
+            lines.append(line)
+
+        return "\n".join(lines)
+
+    def _flush(self, pipeline: _Pipeline) -> None:
+        changed = [pipeline.jobs[job_id] for job_id in pipeline.changed]
+        waiters = pipeline.waiters
+        pipeline.changed = set()
+        pipeline.waiters = []
+        pipeline.timer = None
+
+        task = asyncio.create_task(self._send(pipeline, changed, waiters))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send(
+        self,
+        pipeline: _Pipeline,
+        changed: List[_Job],
+        waiters: List[asyncio.Future],
+    ) -> None:
+        try:
+            if self.mode == "summary":
+                # the check itself is created by the pipeline's own webhook,
+                # which includes the summary when it arrives
+                await pipeline.gh.set_check_output(
+                    pipeline.sha,
+                    pipeline.gh_check,
+                    pipeline.url,
+                    self._table(pipeline),
+                )
+            else:
+                await self._send_checks(pipeline, changed)
+
+            log.info(
+                "Relayed job statuses",
+                extra={
+                    "pipeline_id": pipeline.pipeline_id,
+                    "jobs": len(changed),
+                    "waiters": len(waiters),
+                },
+            )
+        except BaseException as exc:
+            for future in waiters:
+                if not future.done():
+                    future.set_exception(exc)
+            if not isinstance(exc, Exception):
+                raise
+        else:
+            for future in waiters:
+                if not future.done():
+                    future.set_result(None)
+
+    async def _send_checks(self, pipeline: _Pipeline, changed: List[_Job]) -> None:
+        sent = []
+        collapsed = False
+        for job in changed:
+            if job.status not in JOB_STATUSES:
+                continue
+
+            if job.job_id not in pipeline.checked:
+                if len(pipeline.checked) >= self.max_checks:
+                    collapsed = True
+                    continue
+                pipeline.checked.add(job.job_id)
+
+            # a job redelivered, or changing status and back within a
+            # window, is already shown as it is
+            if self._check_status(job) != job.sent:
+                sent.append(job)
+
+        checks = [
+            (
+                f"{pipeline.gh_check} / {job.name}",
+                self._check_status(job),
+                job.url,
+                None,
+            )
+            for job in sent
+        ]
+        if checks:
+            await pipeline.gh.set_check_statuses(pipeline.sha, checks)
+            for job in sent:
+                job.sent = self._check_status(job)
+
+        if collapsed:
+            await pipeline.gh.set_check_output(
+                pipeline.sha,
+                pipeline.gh_check,
+                pipeline.url,
+                self._table(pipeline),
+            )
+
+    @staticmethod
+    def _check_status(job: _Job) -> str:
+        if job.status == "failed" and job.allow_failure:
+            return "neutral"
+        return JOB_STATUSES[job.status]
+
+
+# shared by every Job Hook, replaced on startup with the configured mode
+relay = JobStatusRelay()
@@ -0,0 +1,315 @@
+import asyncio
+import logging
+import time
+from typing import Dict, Optional, Tuple
+
+from cachetools import LRUCache
+
+from hubcast import metrics
+from hubcast.clients.github import GitHubClient, GitHubClientFactory
+from hubcast.clients.gitlab import GitLabInstances
+from hubcast.config import DEFAULT_INSTANCE
+from hubcast.web import latency
+from hubcast.web.gitlab import job_status
+
+log = logging.getLogger(__name__)
+
+# GitLab pipeline statuses relayed to GitHub, and the check status each
+# translates to
+# https://docs.gitlab.com/api/pipelines/#list-project-pipelines -> status description
+RELAYED_STATUSES = {
+    "pending": "queued",
+    "running": "in_progress",
+    "success": "success",
+    "failed": "failure",
+    "canceled": "cancelled",
+}
+FINAL_STATUSES = {"success", "failed", "canceled", "skipped"}
+
+pipelines_tracked = metrics.gauge(
+    "hubcast_pipelines_tracked",
+    "Unfinished GitLab pipelines being watched for status changes.",
+)
+pipeline_polls = metrics.counter(
+    "hubcast_pipeline_polls_total",
+    "Polled pipelines, by whether their status had changed since last seen.",
+)
+
+
+async def relay_status(
+    gh: GitHubClient,
+    gh_check_name: str,
+    pipeline_id: int,
+    sha: str,
+    ci_status: str,
+    pipeline_url: str,
+    instance: str = DEFAULT_INSTANCE,
+):
+    """Relay the status of a GitLab pipeline of an instance to its GitHub
+    check."""
+    # https://docs.github.com/en/rest/guides/using-the-rest-api-to-interact-with-checks#about-check-suites
+    status = RELAYED_STATUSES.get(ci_status)
+    if status is None:
+        return
+
+    # keep the job summary, if there is one, as the check's output
+    text = job_status.relay.summary(pipeline_id, instance)
+    await gh.set_check_status(sha, gh_check_name, status, pipeline_url, text)
+    latency.tracker.mark(sha, "check")
+
+
+class TrackedPipeline:
+    """A pipeline whose last known status isn't final."""
+
+    def __init__(
+        self,
+        project: str,
+        pipeline_id: int,
+        sha: str,
+        status: str,
+        url: str,
+        gh_owner: str,
+        gh_repo: str,
+        gh_check: str,
+        gl_user: str,
+        instance: str = DEFAULT_INSTANCE,
+    ):
+        self.instance = instance
+        self.project = project
+        self.pipeline_id = pipeline_id
+        self.sha = sha
+        self.status = status
+        self.url = url
+        self.gh_owner = gh_owner
+        self.gh_repo = gh_repo
+        self.gh_check = gh_check
+        self.gl_user = gl_user
+        self.first_seen = time.monotonic()
+        self.next_poll = self.first_seen
+
+
+class PipelineTracker:
+    """
+    Watches every pipeline Hubcast started or heard about until it finishes,
+    polling GitLab for the ones whose webhooks stop arriving so their GitHub
+    checks don't stay queued or in progress forever.
+
+    Pipelines are polled less often as they age, from every `min_interval`
+    seconds up to every `max_interval` seconds. Every due pipeline of a
+    project is fetched together, with conditional requests so unchanged
+    responses are cheap for GitLab. A webhook reporting a final status stops
+    the polling of its pipeline.
+
+    Pipelines are polled as the GitLab user Hubcast started them as. Those
+    only heard about through webhooks are polled as `service_user`, never as
+    a user named in the webhook, and aren't polled at all without one.
+
+    Attributes
+    ----------
+    min_interval: float
+        Seconds before a pipeline is first polled, and the shortest time
+        between polls. Tracking is disabled when this is 0.
+    max_interval: float
+        The longest time between polls of a pipeline.
+    max_age: float
+        Seconds after which a pipeline is no longer tracked.
+    concurrency: int
+        Number of projects polled at once.
+    service_user: Optional[str]
+        The GitLab user pipelines Hubcast didn't start are polled as.
+    """
+
+    def __init__(
+        self,
+        github_client_factory: Optional[GitHubClientFactory] = None,
+        gitlab_client_factory: Optional[GitLabInstances] = None,
+        min_interval: float = 15,
+        max_interval: float = 300,
+        max_age: float = 86400,
+        concurrency: int = 4,
+        service_user: Optional[str] = None,
+    ):
+        self.gh = github_client_factory
+        self.gl = gitlab_client_factory
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.max_age = max_age
+        self.concurrency = concurrency
+        self.service_user = service_user
+        # by instance, project and pipeline id
+        self.pipelines: Dict[Tuple[str, str, int], TrackedPipeline] = {}
+        # etags and responses of previous polls, for conditional requests
+        self._http_cache = LRUCache(maxsize=1024)
+
+    @property
+    def enabled(self) -> bool:
+        return self.min_interval > 0
+
+    def observe(
+        self,
+        project: str,
+        pipeline_id: int,
+        sha: str,
+        status: str,
+        url: str,
+        gh_owner: str,
+        gh_repo: str,
+        gh_check: str,
+        gl_user: Optional[str],
+        instance: str = DEFAULT_INSTANCE,
+    ) -> None:
+        """
+        Record the latest known status of a pipeline. `gl_user` is the user
+        Hubcast started it as, None when it's only known from a webhook.
+        """
+        if not self.enabled:
+            return
+
+        key = (instance, project, pipeline_id)
+        if status in FINAL_STATUSES:
+            self.pipelines.pop(key, None)
+        elif key in self.pipelines:
+            pipeline = self.pipelines[key]
+            pipeline.status = status
+            # a webhook just arrived, so no need to poll for a while
+            pipeline.next_poll = time.monotonic() + self._interval(pipeline)
+        else:
+            gl_user = gl_user or self.service_user
+            if gl_user is None:
+                log.debug(
+                    "Not tracking pipeline without a user to poll as",
+                    extra={"project": project, "url": url},
+                )
+                return
+
+            pipeline = TrackedPipeline(
+                project,
+                pipeline_id,
+                sha,
+                status,
+                url,
+                gh_owner,
+                gh_repo,
+                gh_check,
+                gl_user,
+                instance,
+            )
+            pipeline.next_poll += self.min_interval
+            self.pipelines[key] = pipeline
+
+        pipelines_tracked.set(len(self.pipelines))
+
+    def _interval(self, pipeline: TrackedPipeline) -> float:
+        age = time.monotonic() - pipeline.first_seen
+        return min(self.max_interval, max(self.min_interval, age / 10))
+
+    async def run(self):
+        """Poll due pipelines forever."""
+        while True:
+            await asyncio.sleep(self.min_interval / 3)
+
+            try:
+                await self.poll()
+            except Exception:
+                log.exception("Pipeline polling failed")
+
+    async def poll(self):
+        """Poll every pipeline which is due, project by project."""
+        now = time.monotonic()
+
+        by_project: Dict[Tuple[str, str, str], Dict[int, TrackedPipeline]] = {}
+        for key, pipeline in list(self.pipelines.items()):
+            if now - pipeline.first_seen > self.max_age:
+                log.info(
+                    "Giving up on unfinished pipeline",
+                    extra={"project": pipeline.project, "url": pipeline.url},
+                )
+                del self.pipelines[key]
+                continue
+
+            if pipeline.next_poll <= now:
+                project = by_project.setdefault(
+                    (pipeline.instance, pipeline.project, pipeline.gl_user), {}
+                )
+                project[pipeline.pipeline_id] = pipeline
+
+        pipelines_tracked.set(len(self.pipelines))
+
+        slots = asyncio.Semaphore(self.concurrency)
+
+        async def poll_project(instance, project, gl_user, due):
+            async with slots:
+                try:
+                    await self._poll_project(instance, project, gl_user, due)
+                except Exception:
+                    log.exception(
+                        "Failed to poll pipelines", extra={"project": project}
+                    )
+                    for pipeline in due.values():
+                        pipeline.next_poll = time.monotonic() + self._interval(pipeline)
+
+        await asyncio.gather(
+            *(
+                poll_project(instance, project, gl_user, due)
+                for (instance, project, gl_user), due in by_project.items()
+            )
+        )
+
+    async def _poll_project(
+        self,
+        instance: str,
+        project: str,
+        gl_user: str,
+        due: Dict[int, TrackedPipeline],
+    ):
+        gl = self.gl[instance].create_client(gl_user)
+        latest = await gl.get_pipelines(project, due.keys(), cache=self._http_cache)
+
+        for pipeline_id, pipeline in due.items():
+            data = latest.get(pipeline_id)
+            pipeline.next_poll = time.monotonic() + self._interval(pipeline)
+            # a webhook may have finished the pipeline while we were polling
+            if data is None or (instance, project, pipeline_id) not in self.pipelines:
+                continue
+
+            if data["status"] == pipeline.status:
+                pipeline_polls.inc(changed="false")
+                continue
+
+            pipeline_polls.inc(changed="true")
+            log.info(
+                "Pipeline status changed without a webhook",
+                extra={
+                    "project": project,
+                    "url": pipeline.url,
+                    "status": data["status"],
+                },
+            )
+
+            gh = self.gh.create_client(pipeline.gh_owner, pipeline.gh_repo)
+            await relay_status(
+                gh,
+                pipeline.gh_check,
+                pipeline_id,
+                pipeline.sha,
+                data["status"],
+                pipeline.url,
+                instance,
+            )
+            self.observe(
+                project,
+                pipeline_id,
+                pipeline.sha,
+                data["status"],
+                pipeline.url,
+                pipeline.gh_owner,
+                pipeline.gh_repo,
+                pipeline.gh_check,
+                gl_user,
+                instance,
+            )
+
+
+# shared by webhook handlers and the poller, replaced on startup with one
+# using the configured intervals
+tracker = PipelineTracker(min_interval=0)
@@ -3,6 +3,12 @@ from typing import Any
 
 from gidgetlab import routing, sansio
 
+from hubcast.web import latency
+from hubcast.web.context import EventContext
+from hubcast.web.gitlab import job_status, pipelines
+from hubcast.web.gitlab.pipelines import relay_status
+from hubcast.web.jobs import set_failed
+
 log = logging.getLogger(__name__)
 
 
@@ -13,6 +19,8 @@ class GitLabRouter(routing.Router):
 
     async def dispatch(self, event: sansio.Event, *args: Any, **kwargs: Any) -> None:
         """Dispatch an event to all registered function(s)."""
+        # every callback of the event shares its reads
+        kwargs.setdefault("ctx", EventContext())
 
         found_callbacks = []
         try:
@@ -34,6 +42,7 @@ class GitLabRouter(routing.Router):
                 await callback(event, *args, **kwargs)
             except Exception:
                 # this catches errors related to processing of webhook events
+                set_failed()
                 log.exception(
                     "Failed to process GitLab webhook event",
                     extra={
@@ -50,28 +59,39 @@ router = GitLabRouter()
 @router.register("Pipeline Hook", status="success")
 @router.register("Pipeline Hook", status="failed")
 @router.register("Pipeline Hook", status="canceled")
-async def status_relay(event, gh, gh_check_name, *arg, **kwargs):
+async def status_relay(event, gh, gh_check_name, *arg, instance, **kwargs):
     """Relay status of a GitLab pipeline back to GitHub."""
-    # get ref from event
-    ref = event.data["object_attributes"]["sha"]
+    attributes = event.data["object_attributes"]
+    latency.tracker.mark(attributes["sha"], "pipeline")
 
-    # get status from event
-    ci_status = event.data["object_attributes"]["status"]
-    pipeline_url = event.data["object_attributes"]["url"]
+    await relay_status(
+        gh,
+        gh_check_name,
+        attributes["id"],
+        attributes["sha"],
+        attributes["status"],
+        attributes["url"],
+        instance,
+    )
 
-    # https://docs.github.com/en/rest/guides/using-the-rest-api-to-interact-with-checks#about-check-suites
-    # https://docs.gitlab.com/api/pipelines/#list-project-pipelines -> status description
+    # keep watching the pipeline in case its later webhooks are lost
+    pipelines.tracker.observe(
+        event.data["project"]["path_with_namespace"],
+        attributes["id"],
+        attributes["sha"],
+        attributes["status"],
+        attributes["url"],
+        gh.repo_owner,
+        gh.repo_name,
+        gh_check_name,
+        # never poll as the user the webhook names, only as the one hubcast
+        # started the pipeline as or its service user
+        None,
+        instance,
+    )
 
-    # translate between GitLab and GitHub statuses
-    if ci_status == "pending":
-        status = "queued"
-    elif ci_status == "running":
-        status = "in_progress"
-    elif ci_status == "failed":
-        status = "failure"
-    elif ci_status == "canceled":
-        status = "cancelled"
-    else:
-        status = ci_status
 
-    await gh.set_check_status(ref, gh_check_name, status, pipeline_url)
+@router.register("Job Hook")
+async def job_relay(event, gh, gh_check_name, *arg, instance, **kwargs):
+    """Relay status of a GitLab job back to GitHub, when enabled."""
+    await job_status.relay.update(gh, gh_check_name, event.data, instance)
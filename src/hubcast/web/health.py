@@ -0,0 +1,24 @@
+from aiohttp import web
+
+from hubcast.web.jobs import JobTracker
+
+
+class HealthHandler:
+    """Liveness and readiness endpoints for load balancers and orchestrators."""
+
+    def __init__(self, jobs: JobTracker, startup=None):
+        self.jobs = jobs
+        self.startup = startup
+
+    async def live(self, request):
+        return web.Response(text="ok")
+
+    async def ready(self, request):
+        # report not-ready as soon as draining starts so load balancers stop
+        # sending us webhooks before the listener closes
+        if self.jobs.draining:
+            return web.Response(status=503, text="draining")
+        # live as soon as we're listening, ready once webhooks can be handled
+        if self.startup is not None and not self.startup.ready:
+            return web.Response(status=503, text="starting")
+        return web.Response(text="ok")
@@ -0,0 +1,401 @@
+import asyncio
+import itertools
+import json
+import logging
+import os
+import time
+from contextvars import ContextVar
+from typing import Any, Coroutine, Dict, List, Optional, Set
+
+from aiojobs import Job, Scheduler
+
+from hubcast import metrics
+from hubcast.web.dedup import DeliveryCache
+from hubcast.web.shards import ShardQueue, shard_wait
+
+log = logging.getLogger(__name__)
+
+jobs_abandoned = metrics.counter(
+    "hubcast_jobs_abandoned_total",
+    "Webhook jobs still unfinished when the drain deadline passed on shutdown.",
+)
+jobs_replayed = metrics.counter(
+    "hubcast_jobs_replayed_total",
+    "Webhook jobs checkpointed by a previous instance and replayed on startup.",
+)
+
+_ids = itertools.count(1)
+
+# the job being run by the current task, so deeper code can report progress
+# without it being passed down through every call
+_current_job: ContextVar[Optional["EventJob"]] = ContextVar("current_job", default=None)
+
+
+def set_step(step: str) -> None:
+    """Record what the job being run by the current task is doing."""
+    job = _current_job.get()
+    if job is not None:
+        job.step = step
+
+
+def set_failed() -> None:
+    """Record that the job being run by the current task didn't succeed."""
+    job = _current_job.get()
+    if job is not None:
+        job.failed = True
+
+
+class EventJob:
+    """
+    A webhook event being processed in the background.
+
+    Holds everything needed to process the event again, so unfinished jobs
+    can be checkpointed on shutdown and replayed by the next instance.
+
+    Attributes
+    ----------
+    source: str
+        Where the event came from, "github" or "gitlab".
+    event_type: str
+        The webhook event type.
+    data: dict
+        The verified webhook payload.
+    delivery_id: str
+        The delivery id of the webhook, if the source provides one.
+    query: dict
+        The query parameters the webhook was delivered with.
+    repo: str
+        The full name of the repository the event is about.
+    lane: str
+        What in the repository the event is about, like a ref, which its
+        events are processed in the order of. Unordered if None.
+    supersedes: bool
+        Whether the event makes earlier superseding events of its lane
+        still waiting to be processed redundant.
+    delivery_key: str
+        The key the webhook was recorded under as seen, forgotten again if
+        the job doesn't succeed so a redelivery of it is processed.
+    step: str
+        What the job is currently doing, reported through set_step.
+    failed: bool
+        Whether processing the event failed, reported through set_failed.
+    """
+
+    def __init__(
+        self,
+        source: str,
+        event_type: str,
+        data: Dict[str, Any],
+        delivery_id: Optional[str] = None,
+        query: Optional[Dict[str, str]] = None,
+        repo: Optional[str] = None,
+        lane: Optional[str] = None,
+        supersedes: bool = False,
+        delivery_key: Optional[str] = None,
+    ):
+        self.id = next(_ids)
+        self.source = source
+        self.event_type = event_type
+        self.data = data
+        self.delivery_id = delivery_id
+        self.query = dict(query or {})
+        self.repo = repo
+        self.lane = lane
+        self.supersedes = supersedes
+        self.delivery_key = delivery_key
+        self.created = time.time()
+        self.step = "queued"
+        self.failed = False
+        self.handle: Optional[Job] = None
+
+    def to_checkpoint(self) -> Dict[str, Any]:
+        return {
+            "source": self.source,
+            "event_type": self.event_type,
+            "data": self.data,
+            "delivery_id": self.delivery_id,
+            "query": self.query,
+            "repo": self.repo,
+        }
+
+    @classmethod
+    def from_checkpoint(cls, entry: Dict[str, Any]) -> "EventJob":
+        return cls(
+            entry["source"],
+            entry["event_type"],
+            entry["data"],
+            entry.get("delivery_id"),
+            entry.get("query"),
+            entry.get("repo"),
+        )
+
+
+class JobTracker:
+    """
+    Runs webhook events as aiojobs jobs while keeping track of which are
+    unfinished, so they can be drained and checkpointed on shutdown.
+
+    Events with a lane are queued in a ShardQueue first, which starts them
+    in order per lane and in turn per repository. Unordered events start
+    right away.
+
+    Attributes
+    ----------
+    drain_timeout: float
+        Seconds to wait for running jobs to finish on shutdown.
+    checkpoint_path: str
+        A file unfinished jobs are written to on shutdown and replayed from
+        on startup. Checkpointing is disabled if this is None.
+    draining: bool
+        Set once shutdown begins, no new webhooks are accepted after.
+    shards: ShardQueue
+        Decides when events with a lane may start.
+    deliveries: DeliveryCache
+        The seen webhook deliveries, which jobs failing, being cancelled or
+        being abandoned on shutdown are removed from.
+    """
+
+    def __init__(
+        self,
+        drain_timeout: float = 30,
+        checkpoint_path: Optional[str] = None,
+        shards: Optional[ShardQueue] = None,
+        deliveries: Optional[DeliveryCache] = None,
+    ):
+        self.drain_timeout = drain_timeout
+        self.checkpoint_path = checkpoint_path
+        self.draining = False
+        self.scheduler: Optional[Scheduler] = None
+        self.jobs: Dict[int, EventJob] = {}
+        self.shards = shards or ShardQueue()
+        self.deliveries = deliveries
+        # coroutines of the jobs waiting in the shard queue
+        self._queued: Dict[int, Coroutine] = {}
+        self._queued_at: Dict[int, float] = {}
+        # coroutines of the jobs handed to the scheduler it hasn't started
+        self._unstarted: Dict[int, Coroutine] = {}
+        self._pumps: Set[asyncio.Task] = set()
+        self._stopped = False
+
+    async def spawn(self, coro: Coroutine, job: EventJob) -> None:
+        """Run the coroutine processing an event as a background job."""
+        self.jobs[job.id] = job
+        if job.lane is None:
+            await self._start(coro, job)
+            return
+
+        self._queued[job.id] = coro
+        self._queued_at[job.id] = time.monotonic()
+        superseded = self.shards.add(
+            (job.source, job.repo or ""), job.lane, job, job.supersedes
+        )
+        for old in superseded:
+            log.info(
+                "Dropping superseded webhook job",
+                extra={
+                    "job_id": old.id,
+                    "event_type": old.event_type,
+                    "repo": old.repo,
+                    "superseded_by": job.id,
+                },
+            )
+            self._discard(old)
+
+        await self.pump()
+
+    def set_concurrency(self, concurrency: int) -> None:
+        """
+        Change how many jobs may run at once. Jobs already running carry on,
+        queued ones start once fewer than `concurrency` are running.
+        """
+        self.shards.concurrency = concurrency
+        if self.scheduler is not None:
+            # aiojobs has no public way to change the limit of a scheduler,
+            # it's only read when spawning or finishing a job
+            self.scheduler._limit = concurrency
+
+    async def pump(self) -> None:
+        """Start the queued jobs which may run now."""
+        if self._stopped or self.scheduler is None or self.scheduler.closed:
+            return
+
+        for job in self.shards.take():
+            shard_wait.observe(
+                time.monotonic() - self._queued_at.pop(job.id),
+                source=job.source,
+                repo=job.repo or "",
+            )
+            await self._start(self._queued.pop(job.id), job)
+
+    async def _start(self, coro: Coroutine, job: EventJob) -> None:
+        async def run():
+            self._unstarted.pop(job.id, None)
+            _current_job.set(job)
+            job.step = "running"
+            try:
+                await coro
+            except BaseException:
+                job.failed = True
+                raise
+            finally:
+                self._finish(job)
+
+        self._unstarted[job.id] = coro
+        job.handle = await self.scheduler.spawn(
+            run(), name=f"{job.source}:{job.event_type}"
+        )
+
+    def _finish(self, job: EventJob) -> None:
+        """Forget a started job which is done, letting its lane move on."""
+        if job.failed:
+            self._forget_delivery(job)
+        self.jobs.pop(job.id, None)
+        if job.lane is not None:
+            self.shards.finish((job.source, job.repo or ""), job.lane)
+            # the job may be cancelled, start the next ones apart
+            pump = asyncio.create_task(self.pump())
+            self._pumps.add(pump)
+            pump.add_done_callback(self._pumps.discard)
+
+    def _forget_delivery(self, job: EventJob) -> None:
+        """Let a redelivery of the webhook of an unsuccessful job be processed."""
+        if self.deliveries is not None and job.delivery_key:
+            self.deliveries.discard(job.delivery_key)
+
+    def _discard(self, job: EventJob) -> None:
+        """Forget a queued job which will never run."""
+        self._queued.pop(job.id).close()
+        self._queued_at.pop(job.id, None)
+        self.jobs.pop(job.id, None)
+
+    async def cancel(self, job_id: int) -> bool:
+        """Cancel a job, returning False if it isn't running or queued."""
+        job = self.jobs.get(job_id)
+        if job is not None and job.id in self._queued:
+            if not self.shards.remove((job.source, job.repo or ""), job.lane, job):
+                return False
+            log.warning(
+                "Cancelling queued webhook job",
+                extra={
+                    "job_id": job_id,
+                    "event_type": job.event_type,
+                    "repo": job.repo,
+                },
+            )
+            self._discard(job)
+            self._forget_delivery(job)
+            return True
+
+        if job is None or job.handle is None:
+            return False
+
+        log.warning(
+            "Cancelling webhook job",
+            extra={
+                "job_id": job_id,
+                "event_type": job.event_type,
+                "repo": job.repo,
+                "step": job.step,
+            },
+        )
+        pending = job.handle.pending
+        try:
+            await job.handle.close()
+        except asyncio.TimeoutError:
+            # it's been cancelled and cleans up once it stops
+            log.warning(
+                "Webhook job is taking long to stop",
+                extra={"job_id": job_id, "event_type": job.event_type},
+            )
+
+        if pending:
+            # a job the scheduler hadn't started yet is closed without ever
+            # running, so it never cleans up after itself
+            self._unstarted.pop(job.id).close()
+            job.failed = True
+            self._finish(job)
+        return True
+
+    async def drain(self) -> List[EventJob]:
+        """
+        Wait up to drain_timeout for unfinished jobs, returning any which
+        are still unfinished after it.
+        """
+        self.draining = True
+        start = time.monotonic()
+        deadline = start + self.drain_timeout
+
+        while self.jobs and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+
+        # queued jobs are checkpointed along with the running ones, and
+        # nothing else is started from now on
+        self._stopped = True
+        for job in self.shards.clear():
+            self._queued.pop(job.id).close()
+        self._queued_at.clear()
+
+        abandoned = list(self.jobs.values())
+        for job in abandoned:
+            self._forget_delivery(job)
+        jobs_abandoned.inc(len(abandoned))
+        log.info(
+            "Drained webhook jobs",
+            extra={
+                "seconds": round(time.monotonic() - start, 3),
+                "abandoned": len(abandoned),
+            },
+        )
+        return abandoned
+
+    def checkpoint(self, jobs: List[EventJob]) -> None:
+        """Append jobs to the checkpoint file for the next instance."""
+        if not jobs:
+            return
+
+        if not self.checkpoint_path:
+            log.warning(
+                "Abandoning unfinished webhook jobs, no checkpoint path configured",
+                extra={"abandoned": len(jobs)},
+            )
+            return
+
+        with open(self.checkpoint_path, "a") as f:
+            for job in jobs:
+                f.write(json.dumps(job.to_checkpoint()) + "\n")
+
+        log.info(
+            "Checkpointed unfinished webhook jobs",
+            extra={"jobs": len(jobs), "path": self.checkpoint_path},
+        )
+
+    def claim_checkpoint(self) -> List[EventJob]:
+        """
+        Read and remove the jobs checkpointed by previous instances.
+
+        The file is renamed before being read so that if several instances
+        share it, only one of them replays each job.
+        """
+        if not self.checkpoint_path or not os.path.exists(self.checkpoint_path):
+            return []
+
+        claimed = f"{self.checkpoint_path}.{os.getpid()}"
+        try:
+            os.replace(self.checkpoint_path, claimed)
+        except FileNotFoundError:
+            # claimed by another instance first
+            return []
+
+        jobs = []
+        with open(claimed) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    jobs.append(EventJob.from_checkpoint(json.loads(line)))
+                except (json.JSONDecodeError, KeyError):
+                    log.exception("Skipping invalid checkpoint entry")
+        os.remove(claimed)
+
+        jobs_replayed.inc(len(jobs))
+        return jobs
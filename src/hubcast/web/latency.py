@@ -0,0 +1,107 @@
+import time
+from typing import Any, Dict, List
+
+from cachetools import TTLCache
+
+from hubcast import metrics
+
+# the stages a commit passes through after its event is received, in order
+STAGES = ("mirrored", "pipeline", "check")
+
+stage_latency = metrics.histogram(
+    "hubcast_e2e_stage_seconds",
+    "Time from a commit reaching the previous stage to reaching this one.",
+    buckets=(0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800),
+)
+total_latency = metrics.histogram(
+    "hubcast_e2e_seconds",
+    "Time from receiving the GitHub event of a commit to its check showing on GitHub.",
+    buckets=(1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600),
+)
+
+
+class _Trace:
+    def __init__(self, repo: str, sha: str, received: float):
+        self.repo = repo
+        self.sha = sha
+        self.received = received
+        self.stages: Dict[str, float] = {}
+
+
+class LatencyTracker:
+    """
+    Follows commits from the GitHub event announcing them until their CI
+    status shows on GitHub, to measure how long the trip takes.
+
+    A commit is traced once its push or pull request event is received.
+    It's then marked as it's mirrored, when the first GitLab pipeline hook
+    for it arrives and when its check is first set, each stage observing
+    the time since the one before it. Commits are identified by sha alone,
+    as pull requests from forks are mirrored from the fork but report to
+    the base repository.
+
+    Attributes
+    ----------
+    size: int
+        Commits traced at once, the oldest are dropped past this.
+    ttl: float
+        Seconds a commit is traced for.
+    """
+
+    def __init__(self, size: int = 10000, ttl: float = 3600):
+        self.size = size
+        self.ttl = ttl
+        self._traces: TTLCache = TTLCache(maxsize=size, ttl=ttl)
+
+    def received(self, repo: str, sha: str) -> None:
+        """Start tracing a commit, unless an earlier event already did."""
+        if sha not in self._traces:
+            self._traces[sha] = _Trace(repo, sha, time.time())
+
+    def mark(self, sha: str, stage: str) -> None:
+        """Record a traced commit reaching a stage for the first time."""
+        trace = self._traces.get(sha)
+        if trace is None or stage in trace.stages:
+            return
+
+        now = time.time()
+        trace.stages[stage] = now
+
+        # stages may be skipped, like a pipeline only found by polling
+        previous = trace.received
+        for earlier in STAGES[: STAGES.index(stage)]:
+            previous = trace.stages.get(earlier, previous)
+        stage_latency.observe(now - previous, repo=trace.repo, stage=stage)
+
+        if stage == STAGES[-1]:
+            total_latency.observe(now - trace.received, repo=trace.repo)
+
+    def slowest(self, limit: int = 20) -> List[Dict[str, Any]]:
+        """
+        Return the traced commits which took, or have been taking, the
+        longest to reach their check, slowest first.
+        """
+        now = time.time()
+        traces = []
+        for trace in list(self._traces.values()):
+            end = trace.stages.get(STAGES[-1], now)
+            traces.append((end - trace.received, trace))
+        traces.sort(key=lambda entry: entry[0], reverse=True)
+
+        return [
+            {
+                "repo": trace.repo,
+                "sha": trace.sha,
+                "seconds": round(seconds, 3),
+                "done": STAGES[-1] in trace.stages,
+                "stages": {
+                    stage: round(at - trace.received, 3)
+                    for stage, at in trace.stages.items()
+                },
+            }
+            for seconds, trace in traces[:limit]
+        ]
+
+
+# the commits being traced, replaced on startup with the configured limits
+tracker = LatencyTracker()
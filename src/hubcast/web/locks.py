@@ -0,0 +1,147 @@
+import asyncio
+import contextlib
+import logging
+import random
+import time
+import uuid
+from typing import AsyncIterator, Dict, Iterable, Optional
+
+from hubcast import metrics
+from hubcast.cache.abc import CacheBackend, CacheError
+
+log = logging.getLogger(__name__)
+
+lock_wait = metrics.histogram(
+    "hubcast_ref_lock_wait_seconds",
+    "Time mirror operations waited for the locks of their destination refs.",
+)
+
+
+class RefLocks:
+    """
+    Mutual exclusion for the operations reading, then updating, a
+    destination ref, so two events for the same ref never both push from
+    the sha they read.
+
+    Within a process each key has an asyncio lock. With a shared cache
+    backend the holder also takes a lease in it, so replicas exclude each
+    other too. Leases are renewed while held and expire if their holder
+    dies. When the backend can't be reached operations go ahead holding only
+    the local lock, a push from a stale sha is then rejected and retried
+    from a fresh read.
+
+    Attributes
+    ----------
+    backend: CacheBackend
+        Where leases are held, None to only lock within this process.
+    lease_ttl: float
+        Seconds a lease lasts without being renewed, 0 disables leases.
+    poll_interval: float
+        Seconds between attempts to take a lease held by another replica.
+    """
+
+    def __init__(
+        self,
+        backend: Optional[CacheBackend] = None,
+        lease_ttl: float = 30,
+        poll_interval: float = 0.2,
+    ):
+        self.backend = backend
+        self.lease_ttl = lease_ttl
+        self.poll_interval = poll_interval
+        self._locks: Dict[str, asyncio.Lock] = {}
+        # holders and waiters of each lock, which is dropped once unused
+        self._users: Dict[str, int] = {}
+        # the local lock allows one holder per key, so one owner will do
+        self._owner = uuid.uuid4().hex
+
+    @property
+    def shared(self) -> bool:
+        return self.backend is not None and self.lease_ttl > 0
+
+    @contextlib.asynccontextmanager
+    async def hold(self, keys: Iterable[str]) -> AsyncIterator[None]:
+        """
+        Hold the locks of every key. They're taken in order, so operations
+        locking overlapping keys can't deadlock.
+        """
+        start = time.monotonic()
+        async with contextlib.AsyncExitStack() as stack:
+            for key in sorted(set(keys)):
+                await stack.enter_async_context(self._hold(key))
+            lock_wait.observe(time.monotonic() - start)
+            yield
+
+    @contextlib.asynccontextmanager
+    async def _hold(self, key: str) -> AsyncIterator[None]:
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        self._users[key] = self._users.get(key, 0) + 1
+
+        try:
+            async with lock:
+                if not self.shared:
+                    yield
+                    return
+
+                async with self._lease(f"ref_lock:{key}"):
+                    yield
+        finally:
+            self._users[key] -= 1
+            if not self._users[key]:
+                del self._users[key]
+                del self._locks[key]
+
+    @contextlib.asynccontextmanager
+    async def _lease(self, name: str) -> AsyncIterator[None]:
+        backend = self.backend
+        leased = await self._acquire(backend, name)
+        renewal = None
+        if leased:
+            renewal = asyncio.create_task(self._renew(backend, name))
+
+        try:
+            yield
+        finally:
+            if renewal is not None:
+                renewal.cancel()
+                with contextlib.suppress(asyncio.CancelledError):
+                    await renewal
+            if leased:
+                try:
+                    await backend.release_lease(name, self._owner)
+                except CacheError as exc:
+                    # it expires on its own
+                    log.warning(
+                        "Failed to release ref lock",
+                        extra={"lock": name, "error": str(exc)},
+                    )
+
+    async def _acquire(self, backend: CacheBackend, name: str) -> bool:
+        while True:
+            try:
+                if await backend.acquire_lease(name, self._owner, self.lease_ttl):
+                    return True
+            except CacheError as exc:
+                log.warning(
+                    "Ref lock unavailable, going ahead without it",
+                    extra={"lock": name, "error": str(exc)},
+                )
+                return False
+
+            # jittered, so replicas waiting on the same lease don't poll it
+            # in lockstep
+            await asyncio.sleep(self.poll_interval * random.uniform(0.5, 1.5))  # nosec B311
+
+    async def _renew(self, backend: CacheBackend, name: str) -> None:
+        while True:
+            await asyncio.sleep(self.lease_ttl / 3)
+            try:
+                if not await backend.renew_lease(name, self._owner, self.lease_ttl):
+                    log.warning("Lost ref lock", extra={"lock": name})
+                    return
+            except CacheError as exc:
+                log.warning(
+                    "Failed to renew ref lock", extra={"lock": name, "error": str(exc)}
+                )
@@ -0,0 +1,10 @@
+from aiohttp import web
+
+from hubcast.metrics import REGISTRY
+
+
+async def handle(request):
+    """Serve the process metrics in Prometheus text format."""
+    return web.Response(
+        text=REGISTRY.render(), content_type="text/plain", charset="utf-8"
+    )
@@ -0,0 +1,413 @@
+import asyncio
+import logging
+import logging.handlers
+from typing import Dict, List, Optional, Tuple
+
+from hubcast.account_map.abc import AccountMap
+from hubcast.account_map.file import FileMap, FileMapError
+from hubcast.cache.abc import CacheBackend, CacheError
+from hubcast.cache.memory import MemoryBackend
+from hubcast.cache.resp import RespBackend
+from hubcast.cache.sqlite import SQLiteBackend
+from hubcast.clients import shadow
+from hubcast.clients.github import GitHubClientFactory
+from hubcast.clients.gitlab import GitLabClientFactory, GitLabInstances
+from hubcast.config import (
+    DEFAULT_INSTANCE,
+    Config,
+    ConfigError,
+    GitLabConfig,
+    load_config,
+)
+from hubcast.logging import (
+    LoggingConfigError,
+    configure_logging,
+    start_queue_logging,
+    stop_queue_logging,
+)
+from hubcast.web.github import GitHubHandler, mirror
+from hubcast.web.github.prune import Pruner
+from hubcast.web.github.reconcile import Reconciler
+from hubcast.web.gitlab import GitLabHandler, job_status, pipelines
+from hubcast.web.jobs import JobTracker
+
+log = logging.getLogger(__name__)
+
+# settings only read on startup, changing them takes a restart
+RESTART_SETTINGS = (
+    "port",
+    "logging_async",
+    "logging_queue_size",
+    "dedup_size",
+    "dedup_ttl",
+    "reconcile_interval",
+    "prune_interval",
+    "drain_delay",
+    "checkpoint_path",
+    "cache_backend",
+    "cache_path",
+    "cache_url",
+    "cache_prefix",
+    "cache_ttl",
+    "pack_memory_limit",
+    "loop_lag_threshold",
+    "profile_dir",
+    "profile_seconds",
+    "latency_size",
+    "latency_ttl",
+    "shadow",
+    "shadow_latency",
+    "shadow_upload_rate",
+)
+
+
+class ReloadError(Exception):
+    pass
+
+
+def create_account_map(conf: Config) -> AccountMap:
+    if conf.account_map_type == "file":
+        return FileMap(conf.account_map_path)
+
+    raise ConfigError(f"Unknown account map type: {conf.account_map_type}")
+
+
+def create_cache_backend(conf: Config) -> CacheBackend:
+    if conf.cache_backend == "memory":
+        return MemoryBackend()
+
+    # a shadow sharing the real instance's cache would hold its ref locks
+    # and write to its caches
+    if conf.shadow:
+        log.warning(
+            "Shadow mode, using an in-process cache instead of the configured one",
+            extra={"cache_backend": conf.cache_backend},
+        )
+        return MemoryBackend()
+
+    try:
+        if conf.cache_backend == "sqlite":
+            if not conf.cache_path:
+                raise ConfigError("HC_CACHE_PATH is required for the sqlite cache")
+            return SQLiteBackend(conf.cache_path, conf.cache_prefix)
+
+        if conf.cache_backend == "redis":
+            if not conf.cache_url:
+                raise ConfigError("HC_CACHE_URL is required for the redis cache")
+            return RespBackend(conf.cache_url, conf.cache_prefix)
+    except CacheError as exc:
+        raise ConfigError(str(exc))
+
+    raise ConfigError(f"Unknown cache backend: {conf.cache_backend}")
+
+
+def check_shadow_tokens(conf: Config) -> None:
+    """
+    Raise ConfigError unless every GitLab instance uses a single token, as
+    a shadow would otherwise create impersonation tokens for its reads.
+    """
+    for name, gl_conf in conf.gl_instances.items():
+        if gl_conf.token_type != "single":  # nosec B105
+            prefix = "HC_GL_" if name == DEFAULT_INSTANCE else f"HC_GL_{name.upper()}_"
+            raise ConfigError(f"Shadow mode requires {prefix}TOKEN_TYPE=single")
+
+
+def create_github_factory(
+    conf: Config, cache: Optional[CacheBackend] = None
+) -> GitHubClientFactory:
+    return GitHubClientFactory(
+        conf.gh.app_id,
+        conf.gh.privkey,
+        conf.gh.requester,
+        conf.gh.bot_user,
+        cache,
+        conf.cache_ttl or None,
+    )
+
+
+def create_gitlab_factory(
+    name: str, gl_conf: GitLabConfig, cache: Optional[CacheBackend] = None
+) -> GitLabClientFactory:
+    return GitLabClientFactory(
+        gl_conf.instance_url,
+        gl_conf.requester,
+        gl_conf.token,
+        gl_conf.callback_url,
+        gl_conf.webhook_secret,
+        gl_conf.token_type,
+        cache,
+        name,
+    )
+
+
+def create_gitlab_instances(
+    conf: Config,
+    cache: Optional[CacheBackend] = None,
+    current: Optional[GitLabInstances] = None,
+    current_conf: Optional[Config] = None,
+) -> GitLabInstances:
+    """
+    Create the client factories of every configured GitLab instance,
+    keeping those of `current` whose credentials are unchanged since
+    `current_conf`.
+    """
+    factories = {}
+    for name, gl_conf in conf.gl_instances.items():
+        previous = current_conf.gl_instances.get(name) if current_conf else None
+        if (
+            current is not None
+            and name in current.factories
+            and previous is not None
+            and _gitlab_credentials(previous) == _gitlab_credentials(gl_conf)
+        ):
+            factories[name] = current.factories[name]
+        else:
+            factories[name] = create_gitlab_factory(name, gl_conf, cache)
+    return GitLabInstances(factories)
+
+
+def _github_credentials(conf: Config):
+    return (conf.gh.app_id, conf.gh.privkey, conf.gh.requester)
+
+
+def _gitlab_credentials(gl_conf: GitLabConfig):
+    return (gl_conf.instance_url, gl_conf.requester, gl_conf.token, gl_conf.token_type)
+
+
+def _all_gitlab_credentials(conf: Config):
+    return {
+        name: _gitlab_credentials(gl_conf)
+        for name, gl_conf in conf.gl_instances.items()
+    }
+
+
+class Reloader:
+    """
+    Reloads the configuration of a running instance, on SIGHUP or through the
+    admin API, and swaps in the components whose settings changed.
+
+    The new configuration is read and every replacement is built before
+    anything is swapped, so an invalid configuration leaves the running one
+    untouched. Reading it and reconfiguring logging block on files and the
+    log listener, so both run in a worker thread while the event loop keeps
+    serving. The rest of the swap happens on the loop without awaiting, so
+    no event sees half of the old configuration and half of the new. Client
+    factories are only replaced when their credentials change, keeping
+    their warm token caches otherwise, and jobs already running finish with
+    the clients they started with.
+
+    Attributes
+    ----------
+    config_path: str
+        The config file settings are read from, on top of the environment.
+    conf: Config
+        The configuration currently in use.
+    admin: AdminHandler
+        The admin API, whose token is replaced, if it's enabled.
+    log_listener: QueueListener
+        The listener of queued logging, restarted along with logging.
+    cache: CacheBackend
+        The cache backend replacement client factories share.
+    """
+
+    def __init__(
+        self,
+        conf: Config,
+        config_path: Optional[str],
+        github_client_factory: GitHubClientFactory,
+        gitlab_client_factory: GitLabInstances,
+        gh_handler: GitHubHandler,
+        gl_handler: GitLabHandler,
+        jobs: JobTracker,
+        reconciler: Optional[Reconciler] = None,
+        pruner: Optional[Pruner] = None,
+        admin=None,
+        log_listener: Optional[logging.handlers.QueueListener] = None,
+        cache: Optional[CacheBackend] = None,
+    ):
+        self.conf = conf
+        self.config_path = config_path
+        self.gh = github_client_factory
+        self.gl = gitlab_client_factory
+        self.gh_handler = gh_handler
+        self.gl_handler = gl_handler
+        self.jobs = jobs
+        self.reconciler = reconciler
+        self.pruner = pruner
+        self.admin = admin
+        self.log_listener = log_listener
+        self.cache = cache
+        # restart-only settings keep comparing against what we started with
+        self._startup = conf
+        # a SIGHUP and an admin request may both ask for a reload
+        self._lock = asyncio.Lock()
+
+    async def reload(self) -> Dict[str, List[str]]:
+        """
+        Reload the configuration, returning the components which were
+        swapped or updated, those which failed to, and the changed settings
+        needing a restart. Raises ReloadError, leaving everything as it was,
+        if the new configuration is invalid.
+
+        Only a logging config which parses but can't be applied fails once
+        swapping has begun, logging then falls back to the console.
+        """
+        async with self._lock:
+            conf, account_map, gh, gl = await asyncio.to_thread(self._prepare)
+            # logging goes first, so the rest is logged with the new config
+            logged = await asyncio.to_thread(self._reload_logging, conf)
+            result = self._swap(conf, account_map, gh, gl, logged)
+            # a raised concurrency lets queued jobs start right away
+            await self.jobs.pump()
+            return result
+
+    def _prepare(
+        self,
+    ) -> Tuple[Config, AccountMap, GitHubClientFactory, GitLabInstances]:
+        """Read the new configuration and build the replacements it needs."""
+        try:
+            conf = load_config(self.config_path)
+            account_map = create_account_map(conf)
+            if conf.job_status_mode not in job_status.MODES:
+                raise ConfigError(f"Unknown job status mode: {conf.job_status_mode}")
+            if shadow.recorder is not None:
+                check_shadow_tokens(conf)
+
+            gh = self.gh
+            if _github_credentials(conf) != _github_credentials(self.conf):
+                gh = create_github_factory(conf, self.cache)
+            gl = self.gl
+            if _all_gitlab_credentials(conf) != _all_gitlab_credentials(self.conf):
+                gl = create_gitlab_instances(conf, self.cache, self.gl, self.conf)
+        except (ConfigError, FileMapError, ValueError) as exc:
+            raise ReloadError(str(exc))
+        return conf, account_map, gh, gl
+
+    def _swap(
+        self,
+        conf: Config,
+        account_map: AccountMap,
+        gh: GitHubClientFactory,
+        gl: GitLabInstances,
+        logged: bool,
+    ) -> Dict[str, List[str]]:
+        restart = [
+            name
+            for name in RESTART_SETTINGS
+            if getattr(conf, name) != getattr(self._startup, name)
+        ]
+        # the poller and admin API can be reconfigured, but not started or
+        # stopped while running
+        if (conf.pipeline_poll_min > 0) != pipelines.tracker.enabled:
+            restart.append("pipeline_poll_min")
+        if bool(conf.admin_token) != (self.admin is not None):
+            restart.append("admin_token")
+
+        failed = []
+        swapped = ["account_map"]
+        if logged:
+            swapped.append("logging")
+        else:
+            failed.append("logging")
+
+        self.gh_handler.account_map = account_map
+        self.gh_handler.webhook_secret = conf.gh.webhook_secret
+        self.gl_handler.webhook_secrets = {
+            name: gl_conf.webhook_secret for name, gl_conf in conf.gl_instances.items()
+        }
+        if self.admin is not None and conf.admin_token:
+            self.admin.token = conf.admin_token
+
+        if gh is not self.gh or gl is not self.gl:
+            self._swap_factories(gh, gl)
+            swapped.append("client_factories")
+        gh.bot_user = conf.gh.bot_user
+        for name, factory in gl.factories.items():
+            factory.callback_url = conf.gl_instances[name].callback_url
+            factory.webhook_secret = conf.gl_instances[name].webhook_secret
+
+        # limits take effect for work started from now on
+        mirror.batcher.window = conf.batch_window
+        mirror.batcher.max_size = conf.batch_size
+        mirror.batcher.spill_threshold = conf.pack_spill_threshold
+        mirror.batcher.spill_dir = conf.pack_spill_dir
+        mirror.batcher.max_pack_size = conf.max_pack_size
+        if conf.mirror_concurrency != self.conf.mirror_concurrency:
+            mirror.mirror_slots = asyncio.Semaphore(conf.mirror_concurrency)
+            swapped.append("mirror_slots")
+        mirror.ref_locks.lease_ttl = conf.ref_lock_lease
+        self.jobs.drain_timeout = conf.drain_timeout
+        self.jobs.set_concurrency(conf.job_concurrency)
+        self.jobs.shards.repo_concurrency = conf.repo_concurrency
+        self.jobs.shards.weights = conf.repo_weights
+
+        job_status.relay.mode = conf.job_status_mode
+        job_status.relay.window = conf.job_status_window
+        job_status.relay.max_checks = conf.job_status_max_checks
+        if pipelines.tracker.enabled and "pipeline_poll_min" not in restart:
+            pipelines.tracker.min_interval = conf.pipeline_poll_min
+            pipelines.tracker.max_interval = conf.pipeline_poll_max
+            pipelines.tracker.max_age = conf.pipeline_poll_max_age
+            pipelines.tracker.service_user = conf.reconcile_user
+
+        if self.reconciler is not None:
+            self.reconciler.gl_user = conf.reconcile_user or self.reconciler.gl_user
+            self.reconciler.jitter = conf.reconcile_jitter
+            self.reconciler.concurrency = conf.reconcile_concurrency
+        if self.pruner is not None:
+            self.pruner.gl_user = conf.reconcile_user or self.pruner.gl_user
+            self.pruner.jitter = conf.reconcile_jitter
+            self.pruner.batch_size = conf.prune_batch_size
+            self.pruner.batch_delay = conf.prune_batch_delay
+            # a shadow never prunes, whatever its configuration says
+            self.pruner.dry_run = conf.prune_dry_run or shadow.recorder is not None
+        swapped.append("limits")
+
+        self.conf = conf
+        for name in restart:
+            log.warning("Changed setting requires a restart", extra={"setting": name})
+        log.info(
+            "Reloaded configuration",
+            extra={"reloaded": swapped, "failed": failed, "restart_required": restart},
+        )
+        return {"reloaded": swapped, "failed": failed, "restart_required": restart}
+
+    def _reload_logging(self, conf: Config) -> bool:
+        # stopping the listener flushes records queued for the old handlers,
+        # and puts them back on the root logger, so they're kept when there's
+        # no logging config to replace them with
+        if self.log_listener is not None:
+            stop_queue_logging(self.log_listener)
+
+        try:
+            configure_logging(conf.logging_config_path)
+            return True
+        except LoggingConfigError as exc:
+            # the old handlers are gone by now, keep logging somewhere
+            logging.basicConfig(level=logging.INFO, force=True)
+            log.error("Failed to reload logging config", extra={"error": str(exc)})
+            return False
+        finally:
+            if self.log_listener is not None:
+                self.log_listener = start_queue_logging(
+                    self._startup.logging_queue_size
+                )
+
+    def _swap_factories(self, gh: GitHubClientFactory, gl: GitLabInstances):
+        self.gh_handler.gh = gh
+        self.gh_handler.gl = gl
+        self.gl_handler.github_client_factory = gh
+        pipelines.tracker.gh = gh
+        pipelines.tracker.gl = gl
+        for worker in (self.reconciler, self.pruner):
+            if worker is not None:
+                worker.gh = gh
+                worker.gl = gl
+
+        if self.admin is not None:
+            for name in {**self.gh.auth.caches(), **self.gl.caches()}:
+                self.admin.caches.pop(name, None)
+            self.admin.caches.update({**gh.auth.caches(), **gl.caches()})
+
+        self.gh = gh
+        self.gl = gl
@@ -0,0 +1,221 @@
+import asyncio
+import logging
+import logging.handlers
+from typing import Any, Callable, Coroutine, Dict, List, NamedTuple, Optional
+
+from hubcast.account_map.abc import AccountMap
+from hubcast.account_map.file import FileMapError
+from hubcast.cache.abc import CacheBackend
+from hubcast.cache.memory import MemoryBackend
+from hubcast.clients import shadow
+from hubcast.clients.git import PackBudget, RefBatcher
+from hubcast.clients.github import GitHubClientFactory
+from hubcast.clients.gitlab import GitLabInstances
+from hubcast.clients.utils import LookupCache
+from hubcast.config import Config, ConfigError
+from hubcast.web import latency
+from hubcast.web.admin import AdminHandler
+from hubcast.web.dedup import DeliveryCache
+from hubcast.web.diagnostics import Profiler
+from hubcast.web.github import GitHubHandler, mirror
+from hubcast.web.github import utils as github_utils
+from hubcast.web.github.prune import Pruner
+from hubcast.web.github.reconcile import Reconciler
+from hubcast.web.gitlab import GitLabHandler, job_status, pipelines
+from hubcast.web.jobs import JobTracker
+from hubcast.web.locks import RefLocks
+from hubcast.web.reload import (
+    Reloader,
+    check_shadow_tokens,
+    create_account_map,
+    create_cache_backend,
+    create_github_factory,
+    create_gitlab_instances,
+)
+
+log = logging.getLogger(__name__)
+
+
+class Workers(NamedTuple):
+    account_map: AccountMap
+    gh: GitHubClientFactory
+    gl: GitLabInstances
+    reconciler: Optional[Reconciler]
+    pruner: Optional[Pruner]
+    cache: CacheBackend
+
+
+class Services(NamedTuple):
+    # webhook handlers by the source recorded in checkpointed jobs
+    handlers: Dict[str, Any]
+    admin: Optional[AdminHandler]
+    reloader: Reloader
+    # loops running for the lifetime of the app
+    background: List[Callable[[], Coroutine]]
+    cache: CacheBackend
+
+
+def build_workers(
+    conf: Config, command: Optional[str] = None, dry_run: bool = False
+) -> Workers:
+    """
+    Build the clients and shared state used both by the server and the
+    one-off commands, raising ConfigError if the configuration is unusable.
+    """
+    try:
+        account_map = create_account_map(conf)
+    except FileMapError as exc:
+        raise ConfigError(f"Error initializing file account map: {exc}")
+
+    if conf.shadow:
+        check_shadow_tokens(conf)
+    cache = create_cache_backend(conf)
+    github_utils.config_cache = LookupCache(
+        "repo_config", cache, conf.cache_ttl or None
+    )
+    shadow.recorder = None
+    if conf.shadow:
+        log.warning("Shadow mode, changes are logged instead of made")
+        shadow.recorder = shadow.ShadowRecorder(
+            conf.shadow_latency, conf.shadow_upload_rate
+        )
+
+    gh = create_github_factory(conf, cache)
+    gl = create_gitlab_instances(conf, cache)
+
+    mirror.batcher = RefBatcher(
+        conf.batch_window,
+        conf.batch_size,
+        PackBudget(conf.pack_memory_limit),
+        conf.pack_spill_threshold,
+        conf.pack_spill_dir,
+        conf.max_pack_size,
+    )
+    mirror.mirror_slots = asyncio.Semaphore(conf.mirror_concurrency)
+    # a backend kept in this process has nobody to share locks with
+    mirror.ref_locks = RefLocks(
+        None if isinstance(cache, MemoryBackend) else cache, conf.ref_lock_lease
+    )
+    try:
+        job_status.relay = job_status.JobStatusRelay(
+            conf.job_status_mode, conf.job_status_window, conf.job_status_max_checks
+        )
+    except ValueError as exc:
+        raise ConfigError(str(exc))
+
+    pipelines.tracker = pipelines.PipelineTracker(
+        gh,
+        gl,
+        conf.pipeline_poll_min,
+        conf.pipeline_poll_max,
+        conf.pipeline_poll_max_age,
+        service_user=conf.reconcile_user,
+    )
+    latency.tracker = latency.LatencyTracker(conf.latency_size, conf.latency_ttl)
+
+    reconciler = None
+    if command == "reconcile" or conf.reconcile_interval > 0:
+        if not conf.reconcile_user:
+            raise ConfigError("HC_RECONCILE_USER is required for reconciliation")
+
+        reconciler = Reconciler(
+            gh,
+            gl,
+            conf.reconcile_user,
+            conf.reconcile_interval,
+            conf.reconcile_jitter,
+            conf.reconcile_concurrency,
+        )
+
+    pruner = None
+    if command == "prune" or conf.prune_interval > 0:
+        if not conf.reconcile_user:
+            raise ConfigError("HC_RECONCILE_USER is required for pruning")
+
+        pruner = Pruner(
+            gh,
+            gl,
+            conf.reconcile_user,
+            conf.prune_interval,
+            conf.reconcile_jitter,
+            conf.prune_batch_size,
+            conf.prune_batch_delay,
+            conf.prune_dry_run or dry_run or conf.shadow,
+        )
+
+    return Workers(account_map, gh, gl, reconciler, pruner, cache)
+
+
+def build_services(
+    conf: Config,
+    config_path: Optional[str],
+    deliveries: DeliveryCache,
+    jobs: JobTracker,
+    log_listener: Optional[logging.handlers.QueueListener] = None,
+    profiler: Optional[Profiler] = None,
+) -> Services:
+    """Build everything the server needs to handle webhooks."""
+    workers = build_workers(conf)
+
+    gh_handler = GitHubHandler(
+        conf.gh.webhook_secret,
+        workers.account_map,
+        workers.gh,
+        workers.gl,
+        deliveries,
+        jobs,
+    )
+
+    gl_handler = GitLabHandler(
+        {name: gl_conf.webhook_secret for name, gl_conf in conf.gl_instances.items()},
+        workers.gh,
+        deliveries,
+        jobs,
+    )
+
+    admin = None
+    if conf.admin_token:
+        admin = AdminHandler(
+            conf.admin_token,
+            jobs,
+            {
+                "repo_config": github_utils.config_cache,
+                "deliveries": deliveries,
+                **workers.gh.auth.caches(),
+                **workers.gl.caches(),
+            },
+        )
+
+    reloader = Reloader(
+        conf,
+        config_path,
+        workers.gh,
+        workers.gl,
+        gh_handler,
+        gl_handler,
+        jobs,
+        workers.reconciler,
+        workers.pruner,
+        admin,
+        log_listener,
+        workers.cache,
+    )
+    if admin is not None:
+        admin.reloader = reloader
+        admin.profiler = profiler
+
+    background = []
+    if conf.reconcile_interval > 0:
+        background.append(workers.reconciler.run)
+    if conf.prune_interval > 0:
+        background.append(workers.pruner.run)
+    if pipelines.tracker.enabled:
+        background.append(pipelines.tracker.run)
+
+    return Services(
+        {"github": gh_handler, "gitlab": gl_handler},
+        admin,
+        reloader,
+        background,
+        workers.cache,
+    )
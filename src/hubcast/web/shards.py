@@ -0,0 +1,212 @@
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+
+from hubcast import metrics
+
+shard_depth = metrics.gauge(
+    "hubcast_shard_queue_depth",
+    "Webhook jobs of a repository queued behind others.",
+)
+shard_wait = metrics.histogram(
+    "hubcast_shard_wait_seconds",
+    "Time webhook jobs of a repository waited in its queue before starting.",
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900),
+)
+jobs_superseded = metrics.counter(
+    "hubcast_jobs_superseded_total",
+    "Queued webhook jobs dropped because a later event made them redundant.",
+)
+
+# (source, repository) a job belongs to
+ShardKey = Tuple[str, str]
+
+
+class _Entry:
+    def __init__(self, job: Any, supersedes: bool):
+        self.job = job
+        self.supersedes = supersedes
+
+
+class _Shard:
+    def __init__(self, key: ShardKey):
+        self.key = key
+        # queued jobs of each lane, in the order they arrived
+        self.lanes: Dict[str, Deque[_Entry]] = {}
+        # lanes with a queued job and none running, in the order they
+        # became ready
+        self.ready: Deque[str] = deque()
+        self.running: Set[str] = set()
+        self.waiting = False
+
+    @property
+    def depth(self) -> int:
+        return sum(len(queue) for queue in self.lanes.values())
+
+    def report(self) -> None:
+        source, repo = self.key
+        shard_depth.set(self.depth, source=source, repo=repo)
+
+
+class ShardQueue:
+    """
+    Decides which queued webhook jobs may start, keeping each repository's
+    events in order and sharing the concurrency cap fairly between them.
+
+    Jobs are queued in a shard per source and repository, and in a lane
+    within it: the ref, pull request or pipeline they're about. A lane runs
+    one job at a time in the order they arrived, so a deletion can't
+    overtake the push before it, while jobs in different lanes of a shard
+    may run side by side up to the repository's weight. Shards with work
+    waiting are served one job at a time in round-robin order while fewer
+    than `concurrency` jobs are running, so a busy repository can't take
+    every slot from the others.
+
+    A job queued as superseding drops the superseding jobs still queued in
+    its lane, like pushes of the same ref whose result it will overwrite.
+
+    Attributes
+    ----------
+    concurrency: int
+        Jobs which may run at once across every shard.
+    repo_concurrency: int
+        Jobs of one shard which may run at once, unless it has a weight.
+    weights: Dict[str, int]
+        Jobs which may run at once by repository full name.
+    active: int
+        Jobs currently running.
+    """
+
+    def __init__(
+        self,
+        concurrency: int = 100,
+        repo_concurrency: int = 4,
+        weights: Optional[Dict[str, int]] = None,
+    ):
+        self.concurrency = concurrency
+        self.repo_concurrency = repo_concurrency
+        self.weights = weights or {}
+        self.active = 0
+        self._shards: Dict[ShardKey, _Shard] = {}
+        # shards with a ready lane, served in turn
+        self._waiting: Deque[_Shard] = deque()
+
+    @property
+    def queued(self) -> int:
+        return sum(shard.depth for shard in self._shards.values())
+
+    def depths(self) -> Dict[ShardKey, int]:
+        return {key: shard.depth for key, shard in self._shards.items()}
+
+    def weight(self, key: ShardKey) -> int:
+        return max(1, self.weights.get(key[1], self.repo_concurrency))
+
+    def add(self, key: ShardKey, lane: str, job: Any, supersedes: bool) -> List[Any]:
+        """Queue a job, returning the queued jobs it superseded."""
+        shard = self._shards.get(key)
+        if shard is None:
+            shard = self._shards[key] = _Shard(key)
+
+        queue = shard.lanes.setdefault(lane, deque())
+        dropped = []
+        if supersedes:
+            dropped = [entry.job for entry in queue if entry.supersedes]
+            kept = [entry for entry in queue if not entry.supersedes]
+            queue.clear()
+            queue.extend(kept)
+            if dropped:
+                jobs_superseded.inc(len(dropped), source=key[0], repo=key[1])
+
+        queue.append(_Entry(job, supersedes))
+        if lane not in shard.running and lane not in shard.ready:
+            shard.ready.append(lane)
+            self._wait(shard)
+        shard.report()
+        return dropped
+
+    def take(self) -> List[Any]:
+        """Mark the jobs which may start now as running and return them."""
+        started = []
+        while self.active < self.concurrency and self._waiting:
+            progressed = False
+            for _ in range(len(self._waiting)):
+                if self.active >= self.concurrency or not self._waiting:
+                    break
+
+                shard = self._waiting[0]
+                self._waiting.rotate(-1)
+                if len(shard.running) >= self.weight(shard.key):
+                    continue
+
+                lane = shard.ready.popleft()
+                entry = shard.lanes[lane].popleft()
+                if not shard.lanes[lane]:
+                    del shard.lanes[lane]
+                shard.running.add(lane)
+                self.active += 1
+                started.append(entry.job)
+                progressed = True
+                shard.report()
+
+                if not shard.ready:
+                    self._unwait(shard)
+
+            if not progressed:
+                break
+
+        return started
+
+    def finish(self, key: ShardKey, lane: str) -> None:
+        """Mark the running job of a lane as finished."""
+        shard = self._shards[key]
+        shard.running.discard(lane)
+        self.active -= 1
+
+        if lane in shard.lanes:
+            shard.ready.append(lane)
+            self._wait(shard)
+        elif not shard.lanes and not shard.running:
+            del self._shards[key]
+
+    def remove(self, key: ShardKey, lane: str, job: Any) -> bool:
+        """Drop a queued job, returning False if it isn't queued."""
+        shard = self._shards.get(key)
+        queue = shard.lanes.get(lane) if shard else None
+        entry = next((e for e in queue or () if e.job is job), None)
+        if entry is None:
+            return False
+
+        queue.remove(entry)
+        if not queue:
+            del shard.lanes[lane]
+            if lane in shard.ready:
+                shard.ready.remove(lane)
+        if not shard.ready:
+            self._unwait(shard)
+        if not shard.lanes and not shard.running:
+            del self._shards[key]
+        shard.report()
+        return True
+
+    def clear(self) -> List[Any]:
+        """Drop every queued job, returning them."""
+        dropped = []
+        for shard in self._shards.values():
+            for queue in shard.lanes.values():
+                dropped.extend(entry.job for entry in queue)
+            shard.lanes.clear()
+            shard.ready.clear()
+            shard.waiting = False
+            shard.report()
+        self._waiting.clear()
+        self._shards = {k: s for k, s in self._shards.items() if s.running}
+        return dropped
+
+    def _wait(self, shard: _Shard) -> None:
+        if not shard.waiting:
+            shard.waiting = True
+            self._waiting.append(shard)
+
+    def _unwait(self, shard: _Shard) -> None:
+        if shard.waiting:
+            shard.waiting = False
+            self._waiting.remove(shard)
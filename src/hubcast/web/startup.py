@@ -0,0 +1,149 @@
+import asyncio
+import contextlib
+import importlib
+import logging
+import time
+from typing import Any, Callable, Optional, Sequence, Set
+
+from aiohttp import web
+
+from hubcast.config import ConfigError
+from hubcast.web.jobs import EventJob, JobTracker
+
+log = logging.getLogger(__name__)
+
+
+class Startup:
+    """
+    Builds the components handling webhooks once the server is listening,
+    so health checks are answered while the rest of Hubcast is imported.
+
+    The modules are imported in a thread, leaving the event loop free to
+    serve requests in between. Once they're built the background loops are
+    started and checkpointed jobs replayed, webhooks arriving before then
+    wait for it, so they're still processed after the replayed ones. If the
+    components can't be built or started the server shuts down, and
+    `failed` is set. A checkpointed job failing to replay is only logged.
+
+    Attributes
+    ----------
+    modules: Sequence[str]
+        The modules imported before `build` is called.
+    build: Callable
+        Returns the built Services, called on the event loop.
+    services: Services
+        The components once built, None until then.
+    ready_timeout: float
+        Seconds a webhook waits for startup to finish before being refused
+        with a 503, for its sender to retry.
+    """
+
+    def __init__(
+        self,
+        modules: Sequence[str],
+        build: Callable[[], Any],
+        jobs: JobTracker,
+        ready_timeout: float = 60,
+    ):
+        self.modules = modules
+        self.build = build
+        self.jobs = jobs
+        self.ready_timeout = ready_timeout
+        self.services: Optional[Any] = None
+        self.failed = False
+        self._ready = asyncio.Event()
+        self._tasks: Set[asyncio.Task] = set()
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set()
+
+    async def run(self) -> None:
+        """Build the components, then start serving webhooks with them."""
+        start = time.monotonic()
+        try:
+            for name in self.modules:
+                await asyncio.to_thread(importlib.import_module, name)
+            services = self.build()
+        except ConfigError as exc:
+            log.error(exc)
+            self._fail()
+            return
+        except Exception:
+            log.exception("Error building services")
+            self._fail()
+            return
+
+        self.services = services
+        try:
+            for func in services.background:
+                self._tasks.add(asyncio.create_task(func()))
+
+            for job in self.jobs.claim_checkpoint():
+                await self._replay(job)
+        except Exception:
+            log.exception("Error starting services")
+            self._fail()
+            return
+
+        self._ready.set()
+        log.info("Ready", extra={"startup_seconds": time.monotonic() - start})
+
+    async def _replay(self, job: EventJob) -> None:
+        log.info(
+            "Replaying checkpointed job",
+            extra={"event_type": job.event_type, "repo": job.repo},
+        )
+        try:
+            await self.services.handlers[job.source].replay(job)
+        except Exception:
+            # one bad job mustn't keep the others or new webhooks waiting
+            log.exception(
+                "Failed to replay checkpointed job",
+                extra={
+                    "source": job.source,
+                    "event_type": job.event_type,
+                    "repo": job.repo,
+                    "delivery_id": job.delivery_id,
+                },
+            )
+
+    async def stop(self) -> None:
+        """Stop the background loops, and close the cache."""
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+        self._tasks.clear()
+
+        if self.services is not None:
+            await self.services.cache.close()
+
+    def handler(self, pick: Callable[[Any], Callable]) -> Callable:
+        """
+        Return a request handler waiting for startup to finish, then handing
+        the request to the one `pick` returns from the built Services.
+        """
+
+        async def handle(request):
+            try:
+                await asyncio.wait_for(self._ready.wait(), self.ready_timeout)
+            except asyncio.TimeoutError:
+                log.warning(
+                    "Refusing webhook, startup hasn't finished",
+                    extra={"path": request.path, "failed": self.failed},
+                )
+                return web.Response(status=503)
+            return await pick(self.services)(request)
+
+        return handle
+
+    def _fail(self) -> None:
+        log.error("Startup failed, shutting down")
+        self.failed = True
+
+        def raise_graceful_exit():
+            raise web.GracefulExit()
+
+        asyncio.get_running_loop().call_soon(raise_graceful_exit)
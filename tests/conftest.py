@@ -0,0 +1,169 @@
+import asyncio
+import re
+import time
+
+import pytest_asyncio
+
+from hubcast.cache import resp
+from hubcast.cache.memory import MemoryBackend
+from hubcast.cache.resp import RespBackend
+from hubcast.cache.sqlite import SQLiteBackend
+
+
+def _glob(pattern: bytes) -> re.Pattern:
+    """Translate a Redis glob pattern, backslash escapes included."""
+    out = []
+    i = 0
+    while i < len(pattern):
+        char = pattern[i : i + 1]
+        if char == b"\\" and i + 1 < len(pattern):
+            out.append(re.escape(pattern[i + 1 : i + 2]))
+            i += 2
+            continue
+        if char == b"*":
+            out.append(b".*")
+        elif char == b"?":
+            out.append(b".")
+        elif char == b"[":
+            end = pattern.index(b"]", i + 1)
+            out.append(b"[" + pattern[i + 1 : end] + b"]")
+            i = end
+        else:
+            out.append(re.escape(char))
+        i += 1
+    return re.compile(b"".join(out), re.DOTALL)
+
+
+class RespStandIn:
+    """
+    Just enough of a Redis server for RespBackend, run in-process. The lease
+    scripts are recognised by their text and run as Python.
+    """
+
+    def __init__(self):
+        # key -> (expiry as a time.monotonic(), or None, value)
+        self.values = {}
+        self.server = None
+
+    async def start(self) -> str:
+        self.server = await asyncio.start_server(self.serve, "127.0.0.1", 0)
+        port = self.server.sockets[0].getsockname()[1]
+        return f"redis://127.0.0.1:{port}"
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def serve(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                args = []
+                for _ in range(int(line[1:])):
+                    length = int((await reader.readline())[1:])
+                    args.append((await reader.readexactly(length + 2))[:-2])
+                writer.write(self.execute(args))
+                await writer.drain()
+        except (asyncio.CancelledError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    def _get(self, key):
+        expires, value = self.values.get(key, (None, None))
+        if expires is not None and expires <= time.monotonic():
+            del self.values[key]
+            return None
+        return value
+
+    def _set(self, key, value, ms=None):
+        expires = time.monotonic() + int(ms) / 1000 if ms else None
+        self.values[key] = (expires, value)
+
+    def execute(self, args):
+        command = args[0].upper()
+        if command == b"GET":
+            value = self._get(args[1])
+            if value is None:
+                return b"$-1\r\n"
+            return b"$%d\r\n%s\r\n" % (len(value), value)
+        if command == b"SET":
+            ms = args[4] if len(args) == 5 and args[3].upper() == b"PX" else None
+            self._set(args[1], args[2], ms)
+            return b"+OK\r\n"
+        if command == b"DEL":
+            found = self._get(args[1]) is not None
+            self.values.pop(args[1], None)
+            return b":%d\r\n" % found
+        if command == b"SCAN":
+            pattern = _glob(args[3])
+            keys = [
+                key
+                for key in list(self.values)
+                if self._get(key) is not None and pattern.fullmatch(key)
+            ]
+            reply = b"*2\r\n$1\r\n0\r\n*%d\r\n" % len(keys)
+            return reply + b"".join(b"$%d\r\n%s\r\n" % (len(k), k) for k in keys)
+        if command == b"EVAL":
+            return b":%d\r\n" % self.eval(args[1].decode(), args[3], args[4:])
+        return b"-ERR unknown command\r\n"
+
+    def eval(self, script, key, argv):
+        owner = self._get(key)
+        if script == resp.ACQUIRE_SCRIPT:
+            if owner is not None and owner != argv[0]:
+                return 0
+            self._set(key, argv[0], argv[1])
+            return 1
+        if script == resp.RENEW_SCRIPT:
+            if owner != argv[0]:
+                return 0
+            self._set(key, owner, argv[1])
+            return 1
+        if script == resp.RELEASE_SCRIPT:
+            if owner == argv[0]:
+                del self.values[key]
+            return 0
+        raise ValueError("unknown script")
+
+
+@pytest_asyncio.fixture(params=["memory", "sqlite", "resp"])
+async def backend(request, tmp_path):
+    """Every cache backend, each starting out empty."""
+    if request.param == "memory":
+        yield MemoryBackend()
+        return
+
+    if request.param == "sqlite":
+        cache = SQLiteBackend(str(tmp_path / "cache.db"), "test:")
+        yield cache
+        await cache.close()
+        return
+
+    stand_in = RespStandIn()
+    cache = RespBackend(await stand_in.start(), "test:")
+    yield cache
+    await cache.close()
+    await stand_in.stop()
+
+
+@pytest_asyncio.fixture(params=["sqlite", "resp"])
+async def replicas(request, tmp_path):
+    """Two backends sharing one store, as two replicas would."""
+    if request.param == "sqlite":
+        path = str(tmp_path / "cache.db")
+        caches = [SQLiteBackend(path, "test:"), SQLiteBackend(path, "test:")]
+        yield caches
+        for cache in caches:
+            await cache.close()
+        return
+
+    stand_in = RespStandIn()
+    url = await stand_in.start()
+    caches = [RespBackend(url, "test:"), RespBackend(url, "test:")]
+    yield caches
+    for cache in caches:
+        await cache.close()
+    await stand_in.stop()
@@ -0,0 +1,156 @@
+import asyncio
+
+import pytest
+from repligit.exceptions import RefUpdateRejected, UnexpectedResponse
+
+from hubcast.clients.git import batch
+from hubcast.clients.git.batch import RefBatcher
+from hubcast.clients.git.client import NULL_SHA, RefUpdate
+
+pytestmark = pytest.mark.asyncio
+
+SRC_URL = "https://github.com/org/repo.git"
+DEST_A = "https://gitlab-a.example.com/group/repo.git"
+DEST_B = "https://gitlab-b.example.com/group/repo.git"
+PACK = b"PACK" + (2).to_bytes(4, "big") + (1).to_bytes(4, "big") + b"objects"
+
+
+class Remotes:
+    """Stands in for the source and destination remotes of a batcher."""
+
+    def __init__(self):
+        self.fetches = []
+        self.pushes = []
+        # ref -> the reason destinations reject it with
+        self.rejected = {}
+
+    async def fetch_pack(self, url, want_shas, have_shas, **auth):
+        self.fetches.append((url, set(want_shas), set(have_shas)))
+
+        async def stream():
+            yield PACK
+
+        return stream()
+
+    async def send_pack(self, url, updates, packfile, username=None, password=None):
+        if not isinstance(packfile, bytes):
+            packfile = b"".join([chunk async for chunk in packfile])
+        self.pushes.append((url, updates, packfile, password))
+        return {u.ref: self.rejected.get(u.ref) for u in updates}
+
+
+@pytest.fixture
+def remotes(monkeypatch):
+    remotes = Remotes()
+    monkeypatch.setattr(batch, "fetch_pack", remotes.fetch_pack)
+    monkeypatch.setattr(batch, "send_pack", remotes.send_pack)
+    return remotes
+
+
+async def test_pushes_each_instance_with_its_own_token(remotes):
+    batcher = RefBatcher()
+    update = RefUpdate("refs/heads/main", NULL_SHA, "a" * 40)
+    await asyncio.gather(
+        batcher.update(SRC_URL, DEST_A, update, [], "bot", "token-a"),
+        batcher.update(SRC_URL, DEST_B, update, [], "bot", "token-b"),
+    )
+
+    assert sorted((url, password) for url, _, _, password in remotes.pushes) == [
+        (DEST_A, "token-a"),
+        (DEST_B, "token-b"),
+    ]
+    # the pack is fetched once and handed to both destinations
+    assert len(remotes.fetches) == 1
+    assert [packfile for _, _, packfile, _ in remotes.pushes] == [PACK, PACK]
+
+
+async def test_collapses_updates_of_the_same_ref(remotes):
+    batcher = RefBatcher()
+    await asyncio.gather(
+        batcher.update(
+            SRC_URL, DEST_A, RefUpdate("refs/heads/main", "a" * 40, "b" * 40), []
+        ),
+        batcher.update(
+            SRC_URL, DEST_A, RefUpdate("refs/heads/main", "b" * 40, "c" * 40), []
+        ),
+        batcher.update(
+            SRC_URL, DEST_A, RefUpdate("refs/heads/old", "d" * 40, NULL_SHA), []
+        ),
+    )
+
+    [(_, updates, _, _)] = remotes.pushes
+    assert updates == [
+        RefUpdate("refs/heads/main", "a" * 40, "c" * 40),
+        RefUpdate("refs/heads/old", "d" * 40, NULL_SHA),
+    ]
+
+
+async def test_only_fails_the_rejected_ref(remotes):
+    remotes.rejected["refs/heads/main"] = "stale info"
+    batcher = RefBatcher()
+    results = await asyncio.gather(
+        batcher.update(
+            SRC_URL, DEST_A, RefUpdate("refs/heads/main", NULL_SHA, "a" * 40), []
+        ),
+        batcher.update(
+            SRC_URL, DEST_A, RefUpdate("refs/heads/other", NULL_SHA, "b" * 40), []
+        ),
+        return_exceptions=True,
+    )
+
+    assert isinstance(results[0], RefUpdateRejected)
+    assert results[1] is None
+
+
+async def test_flushes_a_full_batch_without_waiting(remotes):
+    batcher = RefBatcher(window=60, max_size=2)
+    update = RefUpdate("refs/heads/main", NULL_SHA, "a" * 40)
+    await asyncio.wait_for(
+        asyncio.gather(
+            batcher.update(SRC_URL, DEST_A, update, []),
+            batcher.update(SRC_URL, DEST_B, update, []),
+        ),
+        timeout=5,
+    )
+
+    assert len(remotes.pushes) == 2
+
+
+async def test_fails_the_batch_without_a_pack(remotes, monkeypatch):
+    async def fetch_pack(url, want_shas, have_shas, **auth):
+        return None
+
+    monkeypatch.setattr(batch, "fetch_pack", fetch_pack)
+    batcher = RefBatcher()
+    with pytest.raises(UnexpectedResponse):
+        await batcher.update(
+            SRC_URL, DEST_A, RefUpdate("refs/heads/main", NULL_SHA, "a" * 40), []
+        )
+
+
+async def test_closes_a_pack_the_upload_abandoned(remotes, monkeypatch):
+    closed = []
+
+    async def fetch_pack(url, want_shas, have_shas, **auth):
+        async def stream():
+            try:
+                yield PACK
+                yield PACK
+            finally:
+                closed.append(url)
+
+        return stream()
+
+    async def send_pack(url, updates, packfile, **auth):
+        await anext(aiter(packfile))
+        raise ConnectionResetError()
+
+    monkeypatch.setattr(batch, "fetch_pack", fetch_pack)
+    monkeypatch.setattr(batch, "send_pack", send_pack)
+    batcher = RefBatcher()
+    with pytest.raises(ConnectionResetError):
+        await batcher.update(
+            SRC_URL, DEST_A, RefUpdate("refs/heads/main", NULL_SHA, "a" * 40), []
+        )
+
+    assert closed == [SRC_URL]
@@ -0,0 +1,123 @@
+import asyncio
+
+import pytest
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_get_set(backend):
+    assert await backend.get("missing") is None
+
+    await backend.set("key", "value")
+    assert await backend.get("key") == "value"
+
+    await backend.set("key", "other")
+    assert await backend.get("key") == "other"
+
+
+async def test_delete(backend):
+    await backend.set("key", "value")
+
+    assert await backend.delete("key")
+    assert await backend.get("key") is None
+    assert not await backend.delete("key")
+
+
+async def test_ttl(backend):
+    await backend.set("short", "value", ttl=0.05)
+    await backend.set("long", "value", ttl=60)
+    await backend.set("forever", "value")
+    assert await backend.get("short") == "value"
+
+    await asyncio.sleep(0.1)
+    assert await backend.get("short") is None
+    assert await backend.get("long") == "value"
+    assert await backend.get("forever") == "value"
+
+
+async def test_count(backend):
+    for key in ("tokens:a", "tokens:b", "tokensx", "ids:a"):
+        await backend.set(key, "value")
+    await backend.set("tokens:expired", "value", ttl=0.05)
+    await asyncio.sleep(0.1)
+
+    assert await backend.count("tokens:") == 2
+    assert await backend.count("") == 4
+    assert await backend.count("none:") == 0
+
+
+@pytest.mark.parametrize("prefix", ["a*", "a?", "a[b]", "a\\", "a%", "a_"])
+async def test_count_glob_characters(backend, prefix):
+    # wildcards in the prefix only match themselves
+    await backend.set(f"{prefix}:1", "value")
+    await backend.set(f"{prefix}:2", "value")
+    for key in ("ab:1", "aX:1", "a:1", "abc:1", "a\\b:1"):
+        if not key.startswith(prefix):
+            await backend.set(key, "value")
+
+    assert await backend.count(prefix) == 2
+
+
+async def test_lease_contention(backend):
+    assert await backend.acquire_lease("lock", "one", 60)
+    assert not await backend.acquire_lease("lock", "two", 60)
+    # taking a lease again renews it
+    assert await backend.acquire_lease("lock", "one", 60)
+
+    assert not await backend.renew_lease("lock", "two", 60)
+    assert await backend.renew_lease("lock", "one", 60)
+
+    # only the holder can release a lease
+    await backend.release_lease("lock", "two")
+    assert not await backend.acquire_lease("lock", "two", 60)
+    await backend.release_lease("lock", "one")
+    assert await backend.acquire_lease("lock", "two", 60)
+
+
+async def test_lease_expiry(backend):
+    assert await backend.acquire_lease("lock", "one", 0.05)
+    await asyncio.sleep(0.1)
+
+    # an expired lease can't be renewed, and is free to take
+    assert not await backend.renew_lease("lock", "one", 60)
+    assert await backend.acquire_lease("lock", "two", 60)
+    assert not await backend.acquire_lease("lock", "one", 60)
+
+
+async def test_renewed_lease_outlives_ttl(backend):
+    assert await backend.acquire_lease("lock", "one", 0.1)
+    await asyncio.sleep(0.05)
+    assert await backend.renew_lease("lock", "one", 60)
+    await asyncio.sleep(0.1)
+
+    assert not await backend.acquire_lease("lock", "two", 60)
+
+
+async def test_replicas_share_values(replicas):
+    one, two = replicas
+
+    await one.set("key", "value")
+    assert await two.get("key") == "value"
+    assert await two.count("k") == 1
+
+
+async def test_replicas_contend_for_lease(replicas):
+    one, two = replicas
+
+    results = await asyncio.gather(
+        *(
+            cache.acquire_lease("lock", owner, 60)
+            for cache, owner in ((one, "one"), (two, "two"))
+            for _ in range(5)
+        )
+    )
+    # every attempt by the first owner to take it wins, or every one of the
+    # second's does
+    assert results in ([True] * 5 + [False] * 5, [False] * 5 + [True] * 5)
+
+    caches = {"one": one, "two": two}
+    winner, loser = ("one", "two") if results[0] else ("two", "one")
+    await caches[loser].release_lease("lock", loser)
+    assert await caches[winner].renew_lease("lock", winner, 60)
+    await caches[winner].release_lease("lock", winner)
+    assert await caches[loser].acquire_lease("lock", loser, 60)
@@ -0,0 +1,75 @@
+import hashlib
+import hmac
+import json
+import time
+
+import pytest
+
+from hubcast.web.dedup import DeliveryCache, content_key, webhooks_duplicate
+from hubcast.web.github.handler import GitHubHandler
+from hubcast.web.jobs import JobTracker
+
+pytestmark = pytest.mark.asyncio
+
+SECRET = "secret"
+
+
+class FakeRequest:
+    def __init__(self, delivery_id, payload):
+        self.body = json.dumps(payload).encode()
+        signature = hmac.new(SECRET.encode(), self.body, hashlib.sha256).hexdigest()
+        self.headers = {
+            "content-type": "application/json",
+            "x-github-event": "ping",
+            "x-github-delivery": delivery_id,
+            "x-hub-signature-256": f"sha256={signature}",
+        }
+
+    async def read(self):
+        return self.body
+
+
+async def test_remembers_deliveries():
+    deliveries = DeliveryCache()
+
+    assert deliveries.add("github:1")
+    assert not deliveries.add("github:1")
+    deliveries.discard("github:1")
+    assert deliveries.add("github:1")
+
+
+async def test_forgets_old_deliveries():
+    deliveries = DeliveryCache(maxsize=2, ttl=0.05)
+    deliveries.add("github:1")
+    deliveries.add("github:2")
+    deliveries.add("github:3")
+    # the oldest is evicted once the cache is full
+    assert deliveries.add("github:1")
+
+    time.sleep(0.1)
+    assert len(deliveries) == 0
+
+
+async def test_keys_deliveries_by_content():
+    key = content_key("gitlab", "Push Hook", b"{}")
+
+    assert key == content_key("gitlab", "Push Hook", b"{}")
+    assert key != content_key("gitlab", "Push Hook", b"{ }")
+    assert key != content_key("gitlab", "Tag Push Hook", b"{}")
+
+
+async def test_drops_redelivered_webhooks():
+    processed = []
+
+    class Handler(GitHubHandler):
+        async def process(self, event, delivery_key=None):
+            processed.append(delivery_key)
+
+    handler = Handler(SECRET, None, None, None, DeliveryCache(), JobTracker())
+    before = webhooks_duplicate.get(source="github")
+    for delivery_id in ("a", "a", "b"):
+        resp = await handler.handle(FakeRequest(delivery_id, {"zen": "hi"}))
+        assert resp.status == 200
+
+    assert processed == ["github:a", "github:b"]
+    assert webhooks_duplicate.get(source="github") == before + 1
@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+from cachetools import TTLCache
+
+from hubcast.web.gitlab.job_status import JobStatusRelay
+
+pytestmark = pytest.mark.asyncio
+
+HOMEPAGE = "https://gitlab.example.com/group/repo"
+
+
+class FakeGitHub:
+    def __init__(self):
+        self.outputs = []
+        self.checks = []
+
+    async def set_check_output(self, sha, name, url, text):
+        self.outputs.append((name, url, text))
+
+    async def set_check_statuses(self, sha, checks):
+        self.checks.append(checks)
+
+
+def job_hook(build_id, status, pipeline_id=1, name=None):
+    return {
+        "pipeline_id": pipeline_id,
+        "build_id": build_id,
+        "build_name": name or f"job-{build_id}",
+        "build_stage": "test",
+        "build_status": status,
+        "sha": "a" * 40,
+        "repository": {"homepage": HOMEPAGE},
+    }
+
+
+async def test_coalesces_updates_within_a_window():
+    gh = FakeGitHub()
+    relay = JobStatusRelay("summary", window=0.01)
+    await asyncio.gather(
+        relay.update(gh, "gitlab-ci", job_hook(1, "running")),
+        relay.update(gh, "gitlab-ci", job_hook(1, "failed")),
+        relay.update(gh, "gitlab-ci", job_hook(2, "success")),
+    )
+
+    [(_, url, text)] = gh.outputs
+    assert url == f"{HOMEPAGE}/-/pipelines/1"
+    # failed jobs first
+    assert text.splitlines()[2:] == [
+        f"| [job-1]({HOMEPAGE}/-/jobs/1) | test | failed |",
+        f"| [job-2]({HOMEPAGE}/-/jobs/2) | test | success |",
+    ]
+
+
+async def test_keeps_pipelines_of_each_instance_apart():
+    gh = FakeGitHub()
+    relay = JobStatusRelay("summary", window=0.01)
+    await asyncio.gather(
+        relay.update(gh, "gitlab-ci", job_hook(1, "success", name="a"), "a"),
+        relay.update(gh, "gitlab-ci", job_hook(1, "failed", name="b"), "b"),
+    )
+
+    assert "[a]" in relay.summary(1, "a")
+    assert "[b]" in relay.summary(1, "b")
+    assert "[a]" not in relay.summary(1, "b")
+    assert relay.summary(1) is None
+
+
+async def test_relays_pipelines_evicted_while_waiting():
+    gh = FakeGitHub()
+    relay = JobStatusRelay("summary", window=0.01)
+    relay._pipelines = TTLCache(maxsize=1, ttl=60)
+    await asyncio.wait_for(
+        asyncio.gather(
+            relay.update(gh, "gitlab-ci", job_hook(1, "running", pipeline_id=1)),
+            relay.update(gh, "gitlab-ci", job_hook(2, "running", pipeline_id=2)),
+        ),
+        timeout=1,
+    )
+
+    assert len(gh.outputs) == 2
+
+
+async def test_collapses_jobs_past_max_checks():
+    gh = FakeGitHub()
+    relay = JobStatusRelay("checks", window=0.01, max_checks=1)
+    await asyncio.gather(
+        relay.update(gh, "gitlab-ci", job_hook(1, "running")),
+        relay.update(gh, "gitlab-ci", job_hook(2, "running")),
+    )
+    assert gh.checks == [
+        [("gitlab-ci / job-1", "in_progress", f"{HOMEPAGE}/-/jobs/1", None)]
+    ]
+    [(_, _, text)] = gh.outputs
+    assert "job-2" in text
+
+    # a redelivered status isn't sent again
+    await relay.update(gh, "gitlab-ci", job_hook(1, "running"))
+    assert len(gh.checks) == 1
@@ -0,0 +1,120 @@
+import asyncio
+
+import pytest
+import pytest_asyncio
+from aiojobs import Scheduler
+
+from hubcast.web.dedup import DeliveryCache
+from hubcast.web.jobs import EventJob, JobTracker
+
+pytestmark = pytest.mark.asyncio
+
+
+@pytest_asyncio.fixture
+async def tracker():
+    """A tracker running at most one job at a time."""
+    tracker = JobTracker(drain_timeout=0.2, deliveries=DeliveryCache())
+    tracker.scheduler = Scheduler(limit=1, pending_limit=10, close_timeout=0.05)
+    yield tracker
+    await tracker.scheduler.close()
+
+
+def push(lane="refs/heads/main", delivery_key=None):
+    return EventJob(
+        "github", "push", {}, repo="org/repo", lane=lane, delivery_key=delivery_key
+    )
+
+
+async def test_cancelling_a_pending_job_frees_its_lane(tracker):
+    blocker = asyncio.Event()
+    await tracker.spawn(blocker.wait(), EventJob("github", "ping", {}))
+
+    tracker.deliveries.add("pending")
+    job = push(delivery_key="pending")
+    await tracker.spawn(asyncio.sleep(0), job)
+    assert job.handle.pending
+
+    assert await tracker.cancel(job.id)
+    assert job.id not in tracker.jobs
+    assert tracker.shards.active == 0
+    # a redelivery of the cancelled webhook is processed
+    assert tracker.deliveries.add("pending")
+
+    # the lane moves on to the next job
+    ran = asyncio.Event()
+
+    async def next_job():
+        ran.set()
+
+    await tracker.spawn(next_job(), push())
+    blocker.set()
+    await asyncio.wait_for(ran.wait(), 1)
+
+
+async def test_cancelling_a_job_slow_to_stop(tracker):
+    async def stubborn():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            await asyncio.sleep(0.2)
+
+    job = push()
+    await tracker.spawn(stubborn(), job)
+    await asyncio.sleep(0)
+
+    assert await tracker.cancel(job.id)
+    await asyncio.sleep(0.01)
+    assert job.id not in tracker.jobs
+    assert tracker.shards.active == 0
+
+
+async def test_cancelling_a_queued_job(tracker):
+    blocker = asyncio.Event()
+    await tracker.spawn(blocker.wait(), push())
+
+    tracker.deliveries.add("queued")
+    job = push(delivery_key="queued")
+    await tracker.spawn(asyncio.sleep(0), job)
+
+    assert await tracker.cancel(job.id)
+    assert not await tracker.cancel(job.id)
+    assert tracker.shards.queued == 0
+    assert tracker.deliveries.add("queued")
+    blocker.set()
+
+
+async def test_drain_waits_for_jobs_finishing_in_time(tracker):
+    await tracker.spawn(asyncio.sleep(0.05), push())
+
+    assert await tracker.drain() == []
+    assert tracker.draining
+
+
+async def test_drain_returns_unfinished_jobs(tracker):
+    tracker.deliveries.add("running")
+    tracker.deliveries.add("queued")
+    running = push(delivery_key="running")
+    queued = push(delivery_key="queued")
+    await tracker.spawn(asyncio.sleep(10), running)
+    await tracker.spawn(asyncio.sleep(0), queued)
+
+    assert await tracker.drain() == [running, queued]
+    assert tracker.shards.queued == 0
+    # the next instance replays them, a redelivery in between is processed
+    assert tracker.deliveries.add("running")
+    assert tracker.deliveries.add("queued")
+
+
+async def test_replays_checkpointed_jobs_once(tmp_path):
+    path = str(tmp_path / "checkpoint.jsonl")
+    first = JobTracker(checkpoint_path=path)
+    job = EventJob(
+        "gitlab", "Pipeline Hook", {"id": 1}, query={"gl_instance": "b"}, repo="g/r"
+    )
+    first.checkpoint([job])
+    with open(path, "a") as f:
+        f.write("not json\n")
+
+    [replayed] = JobTracker(checkpoint_path=path).claim_checkpoint()
+    assert replayed.to_checkpoint() == job.to_checkpoint()
+    assert JobTracker(checkpoint_path=path).claim_checkpoint() == []
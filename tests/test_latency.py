@@ -0,0 +1,61 @@
+from types import SimpleNamespace
+
+import pytest
+
+from hubcast.web import latency
+from hubcast.web.latency import LatencyTracker, stage_latency, total_latency
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(latency, "time", SimpleNamespace(time=lambda: clock.now))
+    return clock
+
+
+def test_observes_each_stage_once(clock):
+    tracker = LatencyTracker()
+    before = stage_latency.get(repo="org/staged", stage="mirrored")
+    tracker.received("org/staged", "a" * 40)
+
+    clock.now += 2
+    tracker.mark("a" * 40, "mirrored")
+    tracker.mark("a" * 40, "mirrored")
+    # commits nobody announced aren't traced
+    tracker.mark("b" * 40, "mirrored")
+
+    assert stage_latency.get(repo="org/staged", stage="mirrored") == before + 1
+    [trace] = tracker.slowest()
+    assert trace["stages"] == {"mirrored": 2.0}
+    assert not trace["done"]
+
+
+def test_measures_skipped_stages_from_the_last_reached(clock):
+    tracker = LatencyTracker()
+    before = total_latency.get(repo="org/polled")
+    tracker.received("org/polled", "a" * 40)
+    # a later event for the same commit doesn't restart its trace
+    clock.now += 1
+    tracker.received("org/polled", "a" * 40)
+    tracker.mark("a" * 40, "mirrored")
+
+    # the pipeline was only found by polling, its webhook never arrived
+    clock.now += 5
+    tracker.mark("a" * 40, "check")
+
+    assert total_latency.get(repo="org/polled") == before + 1
+    [trace] = tracker.slowest()
+    assert trace["seconds"] == 6.0
+    assert trace["done"]
+
+
+def test_lists_the_slowest_commits_first(clock):
+    tracker = LatencyTracker()
+    tracker.received("org/repo", "a" * 40)
+    clock.now += 10
+    tracker.received("org/repo", "b" * 40)
+    clock.now += 1
+    tracker.mark("a" * 40, "check")
+
+    assert [trace["sha"] for trace in tracker.slowest()] == ["a" * 40, "b" * 40]
+    assert len(tracker.slowest(limit=1)) == 1
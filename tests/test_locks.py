@@ -0,0 +1,61 @@
+import asyncio
+
+import pytest
+
+from hubcast.cache.abc import CacheError
+from hubcast.cache.memory import MemoryBackend
+from hubcast.web.locks import RefLocks
+
+pytestmark = pytest.mark.asyncio
+
+KEY = "https://gitlab.example.com/group/repo.git refs/heads/main"
+OTHER = "https://gitlab.example.com/group/repo.git refs/heads/other"
+
+
+async def hold_in_turn(locks_a, locks_b, keys_a, keys_b):
+    """Hold keys_a through locks_a and keys_b through locks_b at once,
+    returning the order each holder got in and out in."""
+    events = []
+
+    async def hold(locks, keys, name):
+        async with locks.hold(keys):
+            events.append(f"{name} in")
+            await asyncio.sleep(0.02)
+            events.append(f"{name} out")
+
+    await asyncio.gather(hold(locks_a, keys_a, "a"), hold(locks_b, keys_b, "b"))
+    return events
+
+
+async def test_excludes_holders_of_the_same_ref():
+    locks = RefLocks()
+    events = await hold_in_turn(locks, locks, [KEY, OTHER], [OTHER, KEY])
+
+    assert events == ["a in", "a out", "b in", "b out"]
+    # unused locks are dropped
+    assert locks._locks == {}
+
+
+async def test_holds_other_refs_at_once():
+    locks = RefLocks()
+    events = await hold_in_turn(locks, locks, [KEY], [OTHER])
+
+    assert events == ["a in", "b in", "a out", "b out"]
+
+
+async def test_excludes_replicas(replicas):
+    first, second = (RefLocks(cache, poll_interval=0.01) for cache in replicas)
+    events = await hold_in_turn(first, second, [KEY], [KEY])
+
+    assert events == ["a in", "a out", "b in", "b out"]
+
+
+class UnavailableBackend(MemoryBackend):
+    async def acquire_lease(self, key, owner, ttl):
+        raise CacheError("connection refused")
+
+
+async def test_goes_ahead_without_a_backend():
+    locks = RefLocks(UnavailableBackend())
+    async with locks.hold([KEY]):
+        pass
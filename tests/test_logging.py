@@ -0,0 +1,69 @@
+import logging
+
+import pytest
+
+from hubcast.logging import (
+    HubcastQueueHandler,
+    RateLimitFilter,
+    log_records_dropped,
+    start_queue_logging,
+    stop_queue_logging,
+)
+
+
+class Collect(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+@pytest.fixture
+def logger():
+    """A logger of its own, out of reach of pytest's log capturing."""
+    logger = logging.Logger("hubcast.test_logging", logging.INFO)
+    logger.propagate = False
+    return logger
+
+
+def test_filters_before_queueing(logger):
+    limit = RateLimitFilter(rate=0.001, burst=1)
+    other = RateLimitFilter()
+    first, second = Collect(), Collect()
+    first.addFilter(limit)
+    second.addFilter(limit)
+    second.addFilter(other)
+    logger.addHandler(first)
+    logger.addHandler(second)
+
+    listener = start_queue_logging(10, logger)
+    [queue_handler] = logger.handlers
+    # only the filter every handler has is moved in front of the queue
+    assert queue_handler.filters == [limit]
+    assert first.filters == [] and second.filters == [other]
+
+    for _ in range(5):
+        logger.info("flood")
+
+    stop_queue_logging(listener, logger)
+    assert logger.handlers == [first, second]
+    assert first.filters == [limit] and second.filters == [other, limit]
+    assert len(first.records) == len(second.records) == 1
+
+
+def test_counts_dropped_records(logger):
+    logger.addHandler(Collect())
+    listener = start_queue_logging(1, logger)
+    [queue_handler] = logger.handlers
+    assert isinstance(queue_handler, HubcastQueueHandler)
+    # nothing is taken off the queue while the listener is stopped
+    listener.stop()
+
+    before = log_records_dropped.get()
+    for _ in range(3):
+        logger.info("record")
+
+    assert queue_handler.dropped == 2
+    assert log_records_dropped.get() == before + 2
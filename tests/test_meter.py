@@ -0,0 +1,64 @@
+import pytest
+
+from hubcast.clients.git.batch import RefBatcher, _Batch, _Entry
+from hubcast.clients.git.meter import PackMeter, PackTooLarge, pack_objects, pack_size
+
+pytestmark = pytest.mark.asyncio
+
+HEADER = b"PACK" + (2).to_bytes(4, "big") + (3).to_bytes(4, "big")
+
+
+async def stream(*chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+async def test_records_pack_size_and_objects():
+    meter = PackMeter("org/measured")
+    # the header may be split across chunks
+    chunks = [c async for c in meter.wrap(stream(HEADER[:6], HEADER[6:], b"x" * 10))]
+
+    assert b"".join(chunks) == HEADER + b"x" * 10
+    assert meter.size == 22
+    assert meter.objects == 3
+    assert pack_size.get(repo="org/measured") == 1
+    assert pack_objects.get(repo="org/measured") == 1
+
+
+async def test_cuts_off_packs_past_the_limit():
+    closed = []
+
+    async def source():
+        try:
+            yield HEADER
+            yield b"x" * 100
+            yield b"never read"
+        finally:
+            closed.append(True)
+
+    meter = PackMeter("org/large", limit=50)
+    with pytest.raises(PackTooLarge):
+        async for _ in meter.wrap(source()):
+            pass
+
+    assert meter.error is not None and meter.error.limit == 50
+    # the download is stopped rather than read to the end
+    assert closed == [True]
+
+
+def batch_limited(*limits):
+    batch = _Batch("https://github.com/org/repo.git", None)
+    batch.entries = [
+        _Entry("dest", None, set(), None, max_pack_size=limit) for limit in limits
+    ]
+    return batch
+
+
+async def test_holds_batches_to_their_strictest_limit():
+    batcher = RefBatcher(max_pack_size=100)
+
+    assert batcher._pack_limit(batch_limited(None, 50)) == 50
+    assert batcher._pack_limit(batch_limited(None, None)) == 100
+    # 0 is no limit, it only wins when every update says so
+    assert batcher._pack_limit(batch_limited(0, 200)) == 200
+    assert RefBatcher()._pack_limit(batch_limited(None, 0)) == 0
@@ -0,0 +1,77 @@
+import pytest
+from repligit.exceptions import RefUpdateRejected
+
+from hubcast.clients.git import RefUpdate
+from hubcast.web.github import mirror
+
+pytestmark = pytest.mark.asyncio
+
+DEST_URL = "https://gitlab.example.com/group/repo.git"
+REF = "refs/heads/main"
+
+
+class StaleBatcher:
+    """Rejects updates until they start from the destination's ref."""
+
+    def __init__(self, dest_refs):
+        self.dest_refs = dest_refs
+        self.updates = []
+
+    async def update(self, src_url, dest_url, update, have_shas, **kwargs):
+        self.updates.append(update)
+        if self.dest_refs.get(update.ref) != update.from_sha:
+            raise RefUpdateRejected("stale info")
+        self.dest_refs[update.ref] = update.to_sha
+
+
+@pytest.fixture
+def dest_refs(monkeypatch):
+    dest_refs = {}
+
+    async def ls_refs(url, prefixes):
+        return dict(dest_refs)
+
+    monkeypatch.setattr(mirror, "ls_refs", ls_refs)
+    monkeypatch.setattr(mirror, "batcher", StaleBatcher(dest_refs))
+    return dest_refs
+
+
+async def update_ref(from_sha, to_sha):
+    await mirror._update_ref(
+        "https://github.com/org/repo.git",
+        DEST_URL,
+        RefUpdate(REF, from_sha, to_sha),
+        [],
+        {REF},
+        "bot",
+        "token",
+        "org/repo",
+    )
+
+
+async def test_retries_from_where_the_ref_moved_to(dest_refs):
+    dest_refs[REF] = "b" * 40
+
+    await update_ref("a" * 40, "c" * 40)
+
+    assert dest_refs[REF] == "c" * 40
+    assert mirror.batcher.updates[-1] == RefUpdate(REF, "b" * 40, "c" * 40)
+
+
+async def test_stops_once_the_ref_got_there(dest_refs):
+    dest_refs[REF] = "c" * 40
+
+    await update_ref("a" * 40, "c" * 40)
+
+    assert len(mirror.batcher.updates) == 1
+
+
+async def test_raises_rejections_of_an_unmoved_ref(dest_refs, monkeypatch):
+    dest_refs[REF] = "a" * 40
+
+    async def reject(*args, **kwargs):
+        raise RefUpdateRejected("protected branch")
+
+    monkeypatch.setattr(mirror.batcher, "update", reject)
+    with pytest.raises(RefUpdateRejected):
+        await update_ref("a" * 40, "c" * 40)
@@ -0,0 +1,98 @@
+import pytest
+
+from hubcast.web.gitlab.pipelines import PipelineTracker
+
+pytestmark = pytest.mark.asyncio
+
+PROJECT = "group/repo"
+URL = "https://gitlab.example.com/group/repo/-/pipelines/1"
+
+
+class FakeGitHub:
+    def __init__(self):
+        self.statuses = []
+
+    def create_client(self, owner, repo):
+        return self
+
+    async def set_check_status(self, sha, name, status, url, text=None):
+        self.statuses.append((name, status))
+
+
+class FakeGitLab:
+    """A GitLab instance whose pipelines are in `statuses`, by id."""
+
+    def __init__(self, statuses):
+        self.statuses = statuses
+        self.polled_as = []
+
+    def create_client(self, user):
+        self.polled_as.append(user)
+        return self
+
+    async def get_pipelines(self, project, pipeline_ids, cache=None):
+        return {
+            pipeline_id: {"status": self.statuses[pipeline_id]}
+            for pipeline_id in pipeline_ids
+            if pipeline_id in self.statuses
+        }
+
+
+def observe(tracker, status, gl_user="alice", instance="default"):
+    tracker.observe(
+        PROJECT, 1, "a" * 40, status, URL, "org", "repo", "gitlab-ci", gl_user, instance
+    )
+
+
+def make_due(tracker):
+    for pipeline in tracker.pipelines.values():
+        pipeline.next_poll = 0
+
+
+async def test_tracks_pipelines_until_final():
+    tracker = PipelineTracker(min_interval=10)
+    observe(tracker, "running")
+    assert list(tracker.pipelines) == [("default", PROJECT, 1)]
+
+    observe(tracker, "success")
+    assert tracker.pipelines == {}
+
+
+async def test_only_polls_as_hubcast_users():
+    tracker = PipelineTracker(min_interval=10)
+    observe(tracker, "running", gl_user=None)
+    assert tracker.pipelines == {}
+
+    tracker.service_user = "hubcast"
+    observe(tracker, "running", gl_user=None)
+    assert tracker.pipelines[("default", PROJECT, 1)].gl_user == "hubcast"
+
+
+async def test_relays_statuses_missed_by_webhooks():
+    gh = FakeGitHub()
+    gitlabs = {"default": FakeGitLab({1: "running"}), "b": FakeGitLab({1: "failed"})}
+    tracker = PipelineTracker(gh, gitlabs, min_interval=10)
+    observe(tracker, "running")
+    observe(tracker, "running", gl_user="bob", instance="b")
+    make_due(tracker)
+
+    await tracker.poll()
+
+    # each pipeline is polled on its own instance, as its own user
+    assert gitlabs["default"].polled_as == ["alice"]
+    assert gitlabs["b"].polled_as == ["bob"]
+    assert gh.statuses == [("gitlab-ci", "failure")]
+    assert list(tracker.pipelines) == [("default", PROJECT, 1)]
+
+    # an unchanged pipeline isn't polled again right away
+    await tracker.poll()
+    assert gitlabs["default"].polled_as == ["alice"]
+
+
+async def test_gives_up_on_old_pipelines():
+    tracker = PipelineTracker(FakeGitHub(), {}, min_interval=10, max_age=0)
+    observe(tracker, "running")
+
+    await tracker.poll()
+
+    assert tracker.pipelines == {}
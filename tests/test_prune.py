@@ -0,0 +1,103 @@
+import pytest
+
+from hubcast.repos.config import RepoConfig
+from hubcast.web.github import prune, reconcile
+from hubcast.web.github.prune import Pruner
+
+pytestmark = pytest.mark.asyncio
+
+REPO = {
+    "full_name": "org/repo",
+    "name": "repo",
+    "owner": {"login": "org"},
+    "clone_url": "https://github.com/org/repo.git",
+}
+DEST_URL = "https://gitlab.example.com/group/repo.git"
+
+
+def pull_request(number, head_repo, sha="f" * 40):
+    return {
+        "number": number,
+        "head": {"repo": head_repo, "sha": sha, "ref": "feature"},
+        "base": {"ref": "main", "repo": {"full_name": "org/repo"}},
+    }
+
+
+class FakeGitHub:
+    def __init__(self, prs):
+        self.prs = prs
+
+    def create_client(self, owner, name):
+        return self
+
+    async def get_open_prs(self):
+        return self.prs
+
+
+class FakeGitLab:
+    instance_url = "https://gitlab.example.com"
+
+    def create_client(self, user):
+        return self
+
+    def for_dest(self, dest):
+        return self
+
+
+@pytest.fixture
+def refs(monkeypatch):
+    """The refs of GitHub and of the destination, by remote url."""
+    refs = {
+        REPO["clone_url"]: {"refs/heads/main": "a" * 40},
+        DEST_URL: {"refs/heads/main": "a" * 40},
+    }
+
+    async def ls_refs(url, prefixes):
+        return {
+            ref: sha
+            for ref, sha in refs.get(url, {}).items()
+            if any(ref.startswith(prefix) for prefix in prefixes)
+        }
+
+    async def get_repo_config(gh, fullname, **kwargs):
+        return RepoConfig(fullname, "group", "repo")
+
+    monkeypatch.setattr(prune, "ls_refs", ls_refs)
+    monkeypatch.setattr(reconcile, "ls_refs", ls_refs)
+    monkeypatch.setattr(prune, "get_repo_config", get_repo_config)
+    return refs
+
+
+async def test_prunes_closed_pull_request_branches(refs):
+    refs[DEST_URL]["refs/heads/pr-1"] = "b" * 40
+    refs[DEST_URL]["refs/heads/pr-2"] = "c" * 40
+    fork = {
+        "full_name": "someone/repo",
+        "clone_url": "https://github.com/someone/repo.git",
+    }
+    refs[REPO["clone_url"]]["refs/pull/2/head"] = "c" * 40
+    pruner = Pruner(FakeGitHub([pull_request(2, fork, "c" * 40)]), FakeGitLab(), "bot")
+
+    assert await pruner.prune_repo(REPO) == {"group/repo": ["refs/heads/pr-1"]}
+
+
+async def test_keeps_open_pull_request_with_deleted_fork(refs):
+    # the fork is gone and refs/pull/3/head is behind, so there's nothing to
+    # mirror, but the pull request is still open
+    refs[DEST_URL]["refs/heads/pr-3"] = "b" * 40
+    refs[REPO["clone_url"]]["refs/pull/3/head"] = "b" * 40
+    pruner = Pruner(FakeGitHub([pull_request(3, None, "c" * 40)]), FakeGitLab(), "bot")
+
+    assert await pruner.prune_repo(REPO) == {}
+
+
+async def test_only_prunes_other_branches_when_allowed(refs, monkeypatch):
+    refs[DEST_URL]["refs/heads/gone"] = "b" * 40
+    pruner = Pruner(FakeGitHub([]), FakeGitLab(), "bot")
+    assert await pruner.prune_repo(REPO) == {}
+
+    async def get_repo_config(gh, fullname, **kwargs):
+        return RepoConfig(fullname, "group", "repo", prune_branches=True)
+
+    monkeypatch.setattr(prune, "get_repo_config", get_repo_config)
+    assert await pruner.prune_repo(REPO) == {"group/repo": ["refs/heads/gone"]}
@@ -0,0 +1,119 @@
+import pytest
+
+from hubcast.clients.github.client import RepoSnapshot
+from hubcast.repos.config import RepoConfig
+from hubcast.web.github import reconcile
+from hubcast.web.github.reconcile import Reconciler
+
+pytestmark = pytest.mark.asyncio
+
+REPO = {
+    "full_name": "org/repo",
+    "name": "repo",
+    "owner": {"login": "org"},
+    "clone_url": "https://github.com/org/repo.git",
+}
+DEST_URL = "https://gitlab.example.com/group/repo.git"
+# an open pull request from a fork, which nobody approved
+FORK_PR = {
+    "number": 7,
+    "head": {
+        "repo": {
+            "full_name": "someone/repo",
+            "clone_url": "https://github.com/someone/repo.git",
+        },
+        "sha": "d" * 40,
+        "ref": "feature",
+    },
+    "base": {"ref": "main", "repo": {"full_name": "org/repo"}},
+}
+
+
+class FakeGitHub:
+    def create_client(self, owner, name):
+        return self
+
+    async def get_repo_snapshot(self, **kwargs):
+        return RepoSnapshot(None, {}, {}, [FORK_PR])
+
+    async def get_open_prs(self):
+        return [FORK_PR]
+
+
+class FakeGitLab:
+    instance_url = "https://gitlab.example.com"
+
+    def create_client(self, user):
+        return self
+
+    def for_dest(self, dest):
+        return self
+
+
+@pytest.fixture
+def synced(monkeypatch):
+    """The refs mirrored by the reconciler, with the sha they're synced to."""
+    refs = {
+        REPO["clone_url"]: {
+            "refs/heads/main": "a" * 40,
+            "refs/heads/feature": "b" * 40,
+            "refs/heads/same": "c" * 40,
+            "refs/pull/7/head": "d" * 40,
+        },
+        DEST_URL: {
+            "refs/heads/main": "0" * 40,
+            "refs/heads/same": "c" * 40,
+            "refs/heads/pr-7": "e" * 40,
+        },
+    }
+    synced = []
+
+    async def ls_refs(url, prefixes):
+        return {
+            ref: sha
+            for ref, sha in refs[url].items()
+            if any(ref.startswith(prefix) for prefix in prefixes)
+        }
+
+    async def load_repo_config(gh, fullname, data):
+        return RepoConfig(fullname, "group", "repo")
+
+    async def mirror_ref(gl, gl_user, src_fullname, src_url, ref, sha, *a, **kw):
+        assert src_url == REPO["clone_url"]
+        synced.append((ref, sha))
+
+    monkeypatch.setattr(reconcile, "ls_refs", ls_refs)
+    monkeypatch.setattr(reconcile, "load_repo_config", load_repo_config)
+    monkeypatch.setattr(reconcile, "mirror_ref", mirror_ref)
+    return synced
+
+
+async def test_syncs_out_of_date_branches(synced):
+    reconciler = Reconciler(FakeGitHub(), FakeGitLab(), "bot")
+
+    assert await reconciler.reconcile_repo(REPO) == 2
+    assert sorted(synced) == [
+        ("refs/heads/feature", "b" * 40),
+        ("refs/heads/main", "a" * 40),
+    ]
+
+
+async def test_never_syncs_fork_pull_requests(synced):
+    reconciler = Reconciler(FakeGitHub(), FakeGitLab(), "bot")
+    await reconciler.reconcile_repo(REPO)
+
+    # neither moved forward to a commit nobody approved, nor created
+    assert not [ref for ref, _ in synced if "pr-" in ref]
+
+
+async def test_counts_only_successful_syncs(synced, monkeypatch):
+    async def mirror_ref(gl, gl_user, src_fullname, src_url, ref, sha, *a, **kw):
+        if ref == "refs/heads/main":
+            raise RuntimeError("push failed")
+
+    monkeypatch.setattr(reconcile, "mirror_ref", mirror_ref)
+    failures = reconcile.reconcile_failures.get(repo="org/repo")
+
+    reconciler = Reconciler(FakeGitHub(), FakeGitLab(), "bot")
+    assert await reconciler.reconcile_repo(REPO) == 1
+    assert reconcile.reconcile_failures.get(repo="org/repo") == failures + 1
@@ -0,0 +1,116 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import pytest
+import pytest_asyncio
+from aiojobs import Scheduler
+
+from hubcast.clients.git.batch import RefBatcher
+from hubcast.config import load_config
+from hubcast.web import reload
+from hubcast.web.github import mirror
+from hubcast.web.gitlab import job_status, pipelines
+from hubcast.web.jobs import JobTracker
+from hubcast.web.reload import Reloader, ReloadError
+from hubcast.web.shards import ShardQueue
+
+pytestmark = pytest.mark.asyncio
+
+ENV = {
+    "HC_ACCOUNT_MAP_TYPE": "file",
+    "HC_LOGGING_CONFIG_PATH": "/nonexistent/logging.json",
+    "HC_GH_APP_IDENTIFIER": "1",
+    "HC_GH_PRIVATE_KEY": "key",
+    "HC_GH_REQUESTER": "hubcast",
+    "HC_GH_SECRET": "secret",
+    "HC_GH_BOT_USER": "hubcast-bot",
+    "HC_GL_URL": "https://gitlab.example.com",
+    "HC_GL_REQUESTER": "hubcast",
+    "HC_GL_TOKEN": "token",
+    "HC_GL_SECRET": "secret",
+    "HC_GL_CALLBACK_URL": "https://hubcast.example.com",
+    "HC_PIPELINE_POLL_MIN": "0",
+}
+
+
+@pytest.fixture
+def config_file(tmp_path, monkeypatch):
+    """The config file a running instance reloads, empty to begin with."""
+    account_map = tmp_path / "users.yml"
+    account_map.write_text("Users:\n  octocat: octocat\n")
+    for name, value in {**ENV, "HC_ACCOUNT_MAP_PATH": str(account_map)}.items():
+        monkeypatch.setenv(name, value)
+
+    # the reloader reconfigures these shared components
+    monkeypatch.setattr(mirror, "batcher", RefBatcher())
+    monkeypatch.setattr(job_status, "relay", job_status.JobStatusRelay())
+    monkeypatch.setattr(pipelines, "tracker", pipelines.PipelineTracker(min_interval=0))
+
+    path = tmp_path / "hubcast.env"
+    path.write_text("")
+    return path
+
+
+@pytest_asyncio.fixture
+async def reloader(config_file):
+    conf = load_config(str(config_file))
+    jobs = JobTracker(shards=ShardQueue(conf.job_concurrency))
+    jobs.scheduler = Scheduler(limit=conf.job_concurrency)
+    yield Reloader(
+        conf,
+        str(config_file),
+        reload.create_github_factory(conf),
+        reload.create_gitlab_instances(conf),
+        SimpleNamespace(),
+        SimpleNamespace(),
+        jobs,
+    )
+    await jobs.scheduler.close()
+
+
+async def test_applies_job_concurrency_live(reloader, config_file):
+    config_file.write_text("HC_JOB_CONCURRENCY=7\nHC_BATCH_SIZE=3\n")
+
+    result = await reloader.reload()
+
+    assert result["restart_required"] == []
+    assert reloader.jobs.shards.concurrency == 7
+    assert reloader.jobs.scheduler.limit == 7
+    assert mirror.batcher.max_size == 3
+
+
+async def test_reports_settings_needing_a_restart(reloader, config_file):
+    config_file.write_text("HC_PORT=4000\n")
+
+    result = await reloader.reload()
+
+    assert result["restart_required"] == ["port"]
+
+
+async def test_keeps_running_config_when_invalid(reloader, config_file):
+    config_file.write_text("HC_JOB_STATUS=everything\nHC_BATCH_SIZE=3\n")
+
+    with pytest.raises(ReloadError):
+        await reloader.reload()
+    assert mirror.batcher.max_size == 100
+    assert reloader.conf.job_status_mode == "off"
+
+
+async def test_reads_config_off_the_event_loop(reloader, monkeypatch):
+    threads = []
+
+    def read(path):
+        threads.append(threading.current_thread())
+        return load_config(path)
+
+    monkeypatch.setattr(reload, "load_config", read)
+    await reloader.reload()
+
+    assert threads and threads[0] is not threading.main_thread()
+
+
+async def test_reloads_one_at_a_time(reloader):
+    results = await asyncio.gather(reloader.reload(), reloader.reload())
+
+    assert all("limits" in result["reloaded"] for result in results)
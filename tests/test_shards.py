@@ -0,0 +1,65 @@
+from hubcast.web.shards import ShardQueue
+
+BUSY = ("github", "org/busy")
+QUIET = ("github", "org/quiet")
+
+
+def test_runs_one_job_per_lane_in_order():
+    shards = ShardQueue()
+    for job in ("push-1", "push-2"):
+        shards.add(BUSY, "refs/heads/main", job, supersedes=False)
+    shards.add(BUSY, "refs/heads/other", "other", supersedes=False)
+
+    assert shards.take() == ["push-1", "other"]
+    assert shards.take() == []
+
+    shards.finish(BUSY, "refs/heads/main")
+    assert shards.take() == ["push-2"]
+
+
+def test_drops_superseded_jobs_still_queued():
+    shards = ShardQueue()
+    shards.add(BUSY, "refs/heads/main", "running", supersedes=True)
+    assert shards.take() == ["running"]
+
+    shards.add(BUSY, "refs/heads/main", "push-1", supersedes=True)
+    shards.add(BUSY, "refs/heads/main", "delete", supersedes=False)
+    assert shards.add(BUSY, "refs/heads/main", "push-2", supersedes=True) == ["push-1"]
+
+    shards.finish(BUSY, "refs/heads/main")
+    assert shards.take() == ["delete"]
+    shards.finish(BUSY, "refs/heads/main")
+    assert shards.take() == ["push-2"]
+
+
+def test_serves_repositories_in_turn():
+    shards = ShardQueue(concurrency=3, repo_concurrency=4)
+    for i in range(4):
+        shards.add(BUSY, f"refs/heads/{i}", f"busy-{i}", supersedes=False)
+    shards.add(QUIET, "refs/heads/main", "quiet", supersedes=False)
+
+    # the quiet repository gets a slot ahead of the busy one's backlog
+    assert shards.take() == ["busy-0", "quiet", "busy-1"]
+    assert shards.depths() == {BUSY: 2, QUIET: 0}
+
+
+def test_limits_repositories_by_weight():
+    shards = ShardQueue(repo_concurrency=2, weights={"org/quiet": 1})
+    for i in range(3):
+        shards.add(BUSY, f"refs/heads/{i}", f"busy-{i}", supersedes=False)
+        shards.add(QUIET, f"refs/heads/{i}", f"quiet-{i}", supersedes=False)
+
+    assert sorted(shards.take()) == ["busy-0", "busy-1", "quiet-0"]
+    assert shards.active == 3
+
+
+def test_removes_queued_jobs():
+    shards = ShardQueue()
+    shards.add(BUSY, "refs/heads/main", "running", supersedes=False)
+    shards.take()
+    shards.add(BUSY, "refs/heads/main", "queued", supersedes=False)
+
+    assert shards.remove(BUSY, "refs/heads/main", "queued")
+    assert not shards.remove(BUSY, "refs/heads/main", "queued")
+    assert not shards.remove(BUSY, "refs/heads/main", "running")
+    assert shards.queued == 0
@@ -0,0 +1,86 @@
+import asyncio
+
+import pytest
+
+from hubcast.clients.git.spool import PackBudget, PackSpool
+
+pytestmark = pytest.mark.asyncio
+
+
+async def stream(*chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+async def read(spool):
+    return b"".join([chunk async for chunk in spool.chunks()])
+
+
+async def test_buffers_small_packs_within_the_budget():
+    budget = PackBudget(100)
+    spool = PackSpool(budget, spill_threshold=50)
+    await spool.fill(stream(b"PACK", b"data"))
+
+    assert not spool.spilled
+    # the unused part of the reservation is handed back
+    assert budget.used == 8
+    # every upload reads the whole pack
+    assert await read(spool) == await read(spool) == b"PACKdata"
+
+    spool.close()
+    assert budget.used == 0
+
+
+async def test_spills_large_packs_to_disk(tmp_path):
+    budget = PackBudget(100)
+    spool = PackSpool(budget, spill_threshold=10, spill_dir=str(tmp_path))
+    await spool.fill(stream(b"PACK", b"x" * 20, b"y" * 20))
+
+    assert spool.spilled
+    assert budget.used == 0
+    assert await read(spool) == b"PACK" + b"x" * 20 + b"y" * 20
+    spool.close()
+
+
+async def test_waits_for_room_in_the_budget():
+    budget = PackBudget(10)
+    first = PackSpool(budget, spill_threshold=10)
+    second = PackSpool(budget, spill_threshold=10)
+    await first.fill(stream(b"x" * 10))
+
+    filling = asyncio.create_task(second.fill(stream(b"y")))
+    await asyncio.sleep(0.01)
+    assert not filling.done()
+
+    first.close()
+    await asyncio.wait_for(filling, 1)
+    assert budget.used == 1
+    second.close()
+
+
+async def test_grants_reservations_in_order():
+    budget = PackBudget(10)
+    await budget.reserve(8)
+    large = asyncio.create_task(budget.reserve(5))
+    await asyncio.sleep(0)
+    small = asyncio.create_task(budget.reserve(1))
+    await asyncio.sleep(0)
+
+    # the small reservation fits, but waits behind the large one
+    assert not small.done()
+    budget.release(8)
+    await asyncio.wait_for(asyncio.gather(large, small), 1)
+    assert budget.used == 6
+
+
+async def test_cancelled_reservations_let_others_through():
+    budget = PackBudget(10)
+    await budget.reserve(8)
+    large = asyncio.create_task(budget.reserve(5))
+    await asyncio.sleep(0)
+    small = asyncio.create_task(budget.reserve(1))
+    await asyncio.sleep(0)
+
+    large.cancel()
+    await asyncio.wait_for(small, 1)
+    assert budget.used == 9
@@ -0,0 +1,59 @@
+import asyncio
+
+import pytest
+
+from hubcast.web.github.utils import gather_or_cancel
+
+pytestmark = pytest.mark.asyncio
+
+
+async def value(result, delay=0.0):
+    await asyncio.sleep(delay)
+    return result
+
+
+async def test_returns_results_in_order():
+    assert await gather_or_cancel(value("slow", 0.02), value("fast")) == [
+        "slow",
+        "fast",
+    ]
+    assert await gather_or_cancel() == []
+
+
+async def test_cancels_the_others_when_one_fails():
+    cancelled = asyncio.Event()
+
+    async def slow():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    async def fail():
+        raise ValueError("no such ref")
+
+    with pytest.raises(ValueError):
+        await asyncio.wait_for(gather_or_cancel(slow(), fail()), 1)
+    assert cancelled.is_set()
+
+
+async def test_cancels_everything_when_cancelled():
+    started = asyncio.Event()
+    cancelled = asyncio.Event()
+
+    async def slow():
+        started.set()
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    task = asyncio.create_task(gather_or_cancel(slow()))
+    await started.wait()
+    task.cancel()
+
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert cancelled.is_set()